@@ -1,27 +1,47 @@
 import streamlit as st
 import os
+import time
+import uuid
 
-from core import engine, init_db, migrate_db, ensure_dirs, get_active_event
+from core import engine, init_db, migrate_db, ensure_dirs, get_active_event, set_query_scope
 from auth import AUTH_MODE, admin_ok, seed_demo_users, reset_session
 from auth import find_student_user, create_student_user, find_company_user, create_student_if_not_exists
 from page_student import render_student
 from page_company import render_company
 from page_admin import render_admin
+from mailer import start_outbox_worker
+from cv_index import start_cv_index_worker
+from notifier import start_late_notifier
+from metrics import LOGIN_SECONDS, RERUN_SECONDS, start_metrics_server, touch_session
+from tracing import end_trace, span, start_trace
+from profiler import profile_rerun
 
 # ------------------- APP SETUP -------------------
 st.set_page_config(page_title="Industrial Engineering Day", page_icon="🎓", layout="centered")
+rerun_t0 = time.perf_counter()  # durata del rerun per /metrics
 
 # ------------------- SESSION STATE INIT -------------------
 if "role" not in st.session_state:
     st.session_state["role"] = None
 if "student_mode" not in st.session_state:
     st.session_state["student_mode"] = "Login"
+if "metrics_sid" not in st.session_state:
+    st.session_state["metrics_sid"] = uuid.uuid4().hex
+touch_session(st.session_state["metrics_sid"])
+# traccia campionata del rerun (TRACE_SAMPLE_RATE), chiusa in fondo o dal rerun successivo
+start_trace("rerun", session=st.session_state["metrics_sid"][:12],
+            role=st.session_state["role"] or "anonymous", page=st.session_state["role"] or "login")
 
 # ------------------- DB INIT -------------------
+set_query_scope("setup")  # statistiche query per pagina/ruolo (tab admin "Query")
 init_db()
 migrate_db()
 ensure_dirs()
 seed_demo_users()
+start_outbox_worker()  # una sola volta per processo, poi è un no-op
+start_cv_index_worker()
+start_late_notifier()  # un solo processo per deployment lavora (lease su DB)
+start_metrics_server()  # /metrics Prometheus su localhost (METRICS_PORT)
 
 with engine.begin() as conn:
     event = get_active_event(conn)
@@ -45,6 +65,7 @@ if st.session_state.get("role") is None:
 
 # ------------------- LOGIN VIEW -------------------
 if st.session_state.get("role") is None:
+    set_query_scope("login")
     st.header("Industrial Engineering Day - Login page")
     tab_student, tab_company  = st.tabs(["Student", "Company"])
 
@@ -94,7 +115,7 @@ if st.session_state.get("role") is None:
                     elif not (email.endswith("@unitn.it") or email.endswith("@studenti.unitn.it")):
                         st.error("⚠️ Use a valid @unitn.it or @studenti.unitn.it email")
                     else:
-                        with engine.begin() as conn:
+                        with LOGIN_SECONDS.time(role="student"), engine.begin() as conn:
                             student = find_student_user(email, pw, conn=conn)
                         if student:
                             st.session_state.update({
@@ -151,12 +172,16 @@ if st.session_state.get("role") is None:
         email = st.text_input("Email", key="company_email")
         pw = st.text_input("Password", type="password", key="company_pass")
         if st.button("Entra", key="btn_company"):
-            if admin_ok(email, pw):
+            with LOGIN_SECONDS.time(role="company"):
+                is_admin = admin_ok(email, pw)
+                cu = None
+                if not is_admin:
+                    with engine.begin() as conn:
+                        cu = find_company_user(conn, email, pw)
+            if is_admin:
                 st.session_state.update({"role": "admin", "email": "admin@local"})
                 st.rerun()
             else:
-                with engine.begin() as conn:
-                    cu = find_company_user(conn, email, pw)
                 if cu:
                     st.session_state.update({
                         "role": "company",
@@ -168,6 +193,8 @@ if st.session_state.get("role") is None:
                     st.error("Wrong email or password")
 
     # 👇 IMPORTANT: stop here so we don't fall through to routing with role=None
+    RERUN_SECONDS.observe(time.perf_counter() - rerun_t0, page="login", end="done")
+    end_trace()
     st.stop()
 
                                                       
@@ -176,6 +203,7 @@ if st.session_state.get("role") is None:
 role = st.session_state.get("role")
 
 if role in ("student", "company", "admin"):
+    set_query_scope(role)
     col1, col2 = st.columns([3, 1])
     with col1:
         # role is guaranteed valid here, so no 'none'
@@ -185,9 +213,22 @@ if role in ("student", "company", "admin"):
             reset_session()
             st.rerun()
 
-    if role == "student":
-        render_student(event)
-    elif role == "company":
-        render_company(event)
-    elif role == "admin":
-        render_admin(event)
+    rerun_end = "error"
+    try:
+        # profile_rerun: solo se l'admin ha chiesto di profilare questo ruolo (tab "Profiler")
+        with span(f"render_{role}"), profile_rerun(role):
+            if role == "student":
+                render_student(event)
+            elif role == "company":
+                render_company(event)
+            elif role == "admin":
+                render_admin(event)
+        rerun_end = "done"
+    except BaseException as e:
+        # st.rerun()/st.stop() escono con un'eccezione: sono proprio i click che scrivono sul DB
+        if type(e).__name__ in ("RerunException", "StopException"):
+            rerun_end = "rerun"
+        raise
+    finally:
+        RERUN_SECONDS.observe(time.perf_counter() - rerun_t0, page=role, end=rerun_end)
+    end_trace()
@@ -5,6 +5,7 @@ from dotenv import load_dotenv
 from werkzeug.security import generate_password_hash, check_password_hash
 from sqlalchemy import text
 from core import engine
+from tracing import span
 
 load_dotenv()
 
@@ -18,7 +19,8 @@ def create_student_user(conn, givenName, sn, matricola, email, password):
     if not password:
         raise ValueError("Password cannot be empty!")
 
-    hashed_pw = generate_password_hash(password)
+    with span("auth.hash"):
+        hashed_pw = generate_password_hash(password)
 
     conn.execute(text("""
         INSERT INTO student (givenName, sn, matricola, email, password)
@@ -59,7 +61,9 @@ def find_student_user(email, password=None, conn=None):
         return None
 
     if password:
-        if not check_password_hash(res["password"], password):
+        with span("auth.hash"):
+            ok = check_password_hash(res["password"], password)
+        if not ok:
             return None
 
     return res
@@ -91,7 +95,8 @@ def create_student_if_not_exists(email: str, givenName: str, sn: str, matricola:
             raise ValueError(f"ID number '{matricola_clean}' already registered")
 
         # Hash password se fornita
-        pw_hash = generate_password_hash(password) if password else ''
+        with span("auth.hash"):
+            pw_hash = generate_password_hash(password) if password else ''
 
         # Inserimento
         conn.execute(
@@ -111,8 +116,11 @@ def create_student_if_not_exists(email: str, givenName: str, sn: str, matricola:
 
 # ------------------- secrets/env helpers -------------------
 def read_secret(key: str, default=None):
-    if hasattr(st, "secrets") and key in st.secrets:
-        return st.secrets[key]
+    try:
+        if hasattr(st, "secrets") and key in st.secrets:
+            return st.secrets[key]
+    except Exception:
+        pass  # nessun secrets.toml (script e benchmark lanciati fuori dalla cartella dell'app)
     return os.getenv(key, default)
 
 # Default di PRODUZIONE
@@ -263,14 +271,16 @@ from core import engine  # core non importa auth => OK
 def make_hash(plain: str) -> str:
     if not HAS_BCRYPT:
         return plain
-    return bcrypt.hashpw(plain.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+    with span("auth.hash"):
+        return bcrypt.hashpw(plain.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
 
 def check_password(plain: str, stored: str | None) -> bool:
     if not stored:
         return False
     if stored.startswith("$2") and HAS_BCRYPT:
         try:
-            return bcrypt.checkpw(plain.encode("utf-8"), stored.encode("utf-8"))
+            with span("auth.hash"):
+                return bcrypt.checkpw(plain.encode("utf-8"), stored.encode("utf-8"))
         except Exception:
             return False
     return ALLOW_PLAIN_FALLBACK and (plain == stored)
@@ -0,0 +1,113 @@
+# bench_cv_search.py
+"""
+Benchmark della ricerca full-text nei CV (core.search_cvs su FTS5).
+
+    python bench_cv_search.py --cvs 3000 --companies 30 --queries 300
+
+Genera CV sintetici (testo, niente PDF) in un DB SQLite temporaneo, li indicizza
+come farebbe cv_index.py e misura la latenza delle ricerche per azienda, confrontandola
+con una scansione LIKE degli stessi testi senza indice.
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import create_engine, text
+
+import core
+
+SKILLS = [
+    "matlab", "python", "simulink", "solidworks", "catia", "ansys", "labview", "plc",
+    "autocad", "c++", "java", "sql", "excel", "sap", "lean", "six sigma", "cfd", "fem",
+    "robotics", "ros", "machine learning", "tensorflow", "pytorch", "arduino", "siemens",
+    "mechatronics", "thermodynamics", "materials", "logistics", "supply chain",
+]
+FILLER = (
+    "experience project team internship university trento engineering thesis design analysis "
+    "laboratory course degree bachelor master skills language english italian german "
+    "responsible developed managed production quality process industrial plant"
+).split()
+
+
+def fake_cv(rnd: random.Random) -> str:
+    words = rnd.choices(FILLER, k=rnd.randint(300, 900))
+    for s in rnd.sample(SKILLS, rnd.randint(3, 8)):
+        words.insert(rnd.randrange(len(words)), s)
+    return " ".join(words)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Benchmark ricerca CV full-text")
+    ap.add_argument("--cvs", type=int, default=3000)
+    ap.add_argument("--companies", type=int, default=30)
+    ap.add_argument("--queries", type=int, default=300)
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+
+    rnd = random.Random(args.seed)
+    fd, db_path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    eng = create_engine(f"sqlite:///{db_path}", future=True)
+    try:
+        core.init_db(eng)
+        core.migrate_db(eng)
+        if not core.HAS_FTS:
+            raise SystemExit("❌ SQLite senza FTS5")
+
+        slots = core.generate_slots()
+        t0 = time.perf_counter()
+        with eng.begin() as conn:
+            bookings, docs, bodies = [], [], []
+            for i in range(args.cvs):
+                cid = 1 + i % args.companies
+                bid = i + 1
+                body = fake_cv(rnd)
+                bookings.append({"id": bid, "c": cid, "s": f"s{i}@unitn.it", "d": f"d{bid}",
+                                 "slot": f"{slots[(i // args.companies) % len(slots)]}#{i}"})
+                bodies.append({"d": f"d{bid}", "body": body})
+                docs.append({"b": bid, "scope": core.cv_scope(1, cid), "body": body})
+            conn.execute(
+                text("""INSERT INTO booking (id, event_id, company_id, student, slot, cv_digest)
+                        VALUES (:id, 1, :c, :s, :slot, :d)"""),
+                bookings
+            )
+            conn.execute(text("INSERT INTO cv_text (digest, status, body) VALUES (:d, 'done', :body)"), bodies)
+            conn.execute(text("INSERT INTO cv_fts (rowid, scope, body) VALUES (:b, :scope, :body)"), docs)
+        t_index = time.perf_counter() - t0
+
+        queries = [" ".join(rnd.sample(SKILLS, rnd.randint(1, 2))) for _ in range(args.queries)]
+        lat_fts, lat_scan, hits = [], [], 0
+        with eng.connect() as conn:
+            for q in queries:
+                cid = rnd.randint(1, args.companies)
+                t = time.perf_counter()
+                res = core.search_cvs(conn, 1, cid, q)
+                lat_fts.append((time.perf_counter() - t) * 1000)
+                hits += len(res)
+
+                t = time.perf_counter()
+                terms = q.split()
+                conn.execute(
+                    text(f"""SELECT b.id FROM booking b JOIN cv_text t ON t.digest = b.cv_digest
+                             WHERE b.event_id = 1 AND b.company_id = :c
+                               AND {" AND ".join(f"t.body LIKE :w{k}" for k in range(len(terms)))}"""),
+                    {"c": cid, **{f"w{k}": f"%{w}%" for k, w in enumerate(terms)}}
+                ).all()
+                lat_scan.append((time.perf_counter() - t) * 1000)
+
+        print(f"CV indicizzati: {args.cvs} su {args.companies} aziende in {t_index:.2f}s")
+        print(f"{'':14}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+        for name, lat in (("FTS5", lat_fts), ("LIKE", lat_scan)):
+            print(f"{name:14}{statistics.median(lat):>10.2f}{percentile(lat, 95):>10.2f}{max(lat):>10.2f}")
+        print(f"\nRisultati medi per query: {hits / len(queries):.1f}")
+    finally:
+        eng.dispose()
+        os.remove(db_path)
@@ -0,0 +1,105 @@
+# bench_cv_store.py
+"""
+Confronto tra il vecchio salvataggio dei CV (un file con timestamp per prenotazione,
+upload intero in memoria) e lo store content-addressed di core.store_cv_blob.
+
+    python bench_cv_store.py --students 300 --max-bookings 5
+
+Tutto avviene in una cartella temporanea con un DB SQLite in memoria.
+"""
+import argparse
+import io
+import os
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+from sqlalchemy import create_engine, text
+
+import core
+
+
+def _dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return total
+
+
+def make_upload_set(workdir, students, max_bookings, seed):
+    """Un PDF finto per studente (100 KB – 2 MB), caricato per 1..max_bookings aziende."""
+    rnd = random.Random(seed)
+    src_dir = os.path.join(workdir, "src")
+    os.makedirs(src_dir)
+    uploads = []
+    for i in range(students):
+        path = os.path.join(src_dir, f"s{i}.pdf")
+        with open(path, "wb") as f:
+            f.write(b"%PDF-1.4\n" + rnd.randbytes(rnd.randint(100_000, 2_000_000)))
+        for c in range(rnd.randint(1, max_bookings)):
+            uploads.append((i, c + 1, path))
+    return uploads
+
+
+def run_legacy(uploads, out_dir):
+    """Come il vecchio save_cv_file: upload intero in memoria, un file per prenotazione."""
+    os.makedirs(out_dir)
+    peak = 0
+    t0 = time.perf_counter()
+    for i, c, src in uploads:
+        tracemalloc.start()
+        with open(src, "rb") as f:
+            upload = io.BytesIO(f.read())   # ciò che riceviamo da file_uploader
+        fname = os.path.join(out_dir, f"e1_c{c}_s{i}_{time.time_ns()}.pdf")
+        with open(fname, "wb") as f:
+            f.write(upload.getbuffer())
+        del upload
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return time.perf_counter() - t0, _dir_size(out_dir), peak
+
+
+def run_store(uploads, out_dir):
+    """Store content-addressed: hash in streaming, un solo file per contenuto."""
+    eng = create_engine("sqlite://", future=True)
+    core.init_db(eng)
+    peak = 0
+    t0 = time.perf_counter()
+    with eng.begin() as conn:
+        for i, c, src in uploads:
+            tracemalloc.start()
+            with open(src, "rb") as f:
+                digest, _, _ = core.store_cv_blob(conn, f, base_dir=out_dir)
+            conn.execute(text("UPDATE cv_blob SET refcount = refcount + 1 WHERE digest = :d"), {"d": digest})
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        blobs = conn.execute(text("SELECT COUNT(*), SUM(refcount) FROM cv_blob")).first()
+    return time.perf_counter() - t0, _dir_size(out_dir), peak, blobs
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Benchmark dello store dei CV")
+    ap.add_argument("--students", type=int, default=200)
+    ap.add_argument("--max-bookings", type=int, default=5)
+    ap.add_argument("--seed", type=int, default=42)
+    args = ap.parse_args()
+
+    work = tempfile.mkdtemp(prefix="cvbench_")
+    try:
+        uploads = make_upload_set(work, args.students, args.max_bookings, args.seed)
+        t_old, disk_old, mem_old = run_legacy(uploads, os.path.join(work, "legacy"))
+        t_new, disk_new, mem_new, (n_blobs, refs) = run_store(uploads, os.path.join(work, "store"))
+
+        mb = 1024 * 1024
+        print(f"Upload simulati: {len(uploads)} ({args.students} studenti)")
+        print(f"{'':18}{'legacy':>12}{'store':>12}")
+        print(f"{'file su disco':18}{len(uploads):>12}{n_blobs:>12}")
+        print(f"{'disco (MB)':18}{disk_old / mb:>12.1f}{disk_new / mb:>12.1f}")
+        print(f"{'picco memoria (KB)':18}{mem_old / 1024:>12.0f}{mem_new / 1024:>12.0f}")
+        print(f"{'tempo (s)':18}{t_old:>12.2f}{t_new:>12.2f}")
+        print(f"\n✅ Disco risparmiato: {(1 - disk_new / disk_old) * 100:.0f}% • "
+              f"memoria per upload: {mem_old / max(mem_new, 1):.0f}x in meno • refcount totale {refs}")
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
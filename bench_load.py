@@ -0,0 +1,303 @@
+# bench_load.py
+"""
+Test di carico delle prenotazioni: tanti studenti insieme sulle funzioni vere di
+core/auth, contro un DB SQLite su file (niente rete, niente Streamlit).
+
+    python bench_load.py --students 600 --processes 4 --threads 8
+    python bench_load.py --students 600 --processes 4 --threads 8 --wal --timeout 1
+
+Ogni studente simulato fa quello che fa la pagina: registrazione
+(create_student_if_not_exists), login (find_student_user), "My Bookings"
+(get_student_bookings), poi per ogni colloquio una lettura degli slot liberi e,
+in una seconda transazione come dopo il rerun di conferma, book_slot; infine la
+round table (conteggi, limite ROUNDTABLE_BOOKABLE_SHARE, book_roundtable).
+La finestra tra lettura e conferma è quella reale della pagina: le prenotazioni
+rifiutate sono il comportamento atteso, i "database is locked" no.
+
+Alla fine stampa throughput, latenze p50/p95/p99 per operazione, lock timeout,
+rifiuti, gare fermate dai vincoli UNIQUE, errori e le violazioni di integrità trovate sul DB (stesso slot/linea
+due volte, studente due volte con la stessa azienda o a meno di 15 minuti,
+round table oltre capienza o oltre il limite prenotabile, più round table per
+studente).
+"""
+import argparse
+import multiprocessing as mp
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+import auth
+import core
+from scheduler import slot_minutes
+
+EVENT_ID = 1
+OPS = ("register", "login", "my_bookings", "slot_page", "book_slot", "rt_page", "book_roundtable")
+
+
+def make_engine(db_path, timeout, wal=False):
+    eng = create_engine(f"sqlite:///{db_path}", future=True, connect_args={"timeout": timeout})
+    if wal:
+        with eng.begin() as conn:
+            conn.exec_driver_sql("PRAGMA journal_mode=WAL")
+    return eng
+
+
+def populate(eng, n_companies, lanes):
+    with eng.begin() as conn:
+        conn.execute(text("DELETE FROM event_company"))
+        conn.execute(
+            text("INSERT INTO company (id, name) VALUES (:id, :n) ON CONFLICT DO NOTHING"),
+            [{"id": 1000 + c, "n": f"Azienda {c}"} for c in range(n_companies)]
+        )
+        conn.execute(
+            text("INSERT INTO event_company (event_id, company_id, lanes) VALUES (:e, :id, :l)"),
+            [{"e": EVENT_ID, "id": 1000 + c, "l": lanes} for c in range(n_companies)]
+        )
+        conn.execute(
+            text("INSERT INTO roundtable (event_id, name, room) VALUES (:e, :n, :r) ON CONFLICT DO NOTHING"),
+            [{"e": EVENT_ID, "n": name, "r": f"Aula {i}"} for i, name in enumerate(core.ROUNDTABLE_CAPACITY, 1)]
+        )
+
+
+class Stats:
+    def __init__(self):
+        self.latency = {op: [] for op in OPS}
+        self.locked = {op: 0 for op in OPS}
+        self.rejected = {op: 0 for op in OPS}
+        self.constraint = {op: 0 for op in OPS}
+        self.errors = {op: 0 for op in OPS}
+        self.sample_error = None
+
+    def run(self, op, fn, *a, **kw):
+        t0 = time.perf_counter()
+        try:
+            return fn(*a, **kw)
+        except ValueError:
+            self.rejected[op] += 1
+        except IntegrityError:
+            # la gara l'ha fermata un vincolo UNIQUE: dato integro, ma lo studente vede un errore
+            self.constraint[op] += 1
+        except OperationalError as e:
+            if "locked" in str(e) or "busy" in str(e):
+                self.locked[op] += 1
+            else:
+                self.errors[op] += 1
+                self.sample_error = self.sample_error or str(e)[:200]
+        except Exception as e:
+            self.errors[op] += 1
+            self.sample_error = self.sample_error or f"{type(e).__name__}: {e}"[:200]
+        finally:
+            self.latency[op].append((time.perf_counter() - t0) * 1000)
+        return None
+
+
+def slot_page(eng, student, company_id):
+    """Prima transazione: quello che la pagina legge per mostrare gli slot prenotabili."""
+    with eng.begin() as conn:
+        full = core.get_full_slots(conn, EVENT_ID, company_id)
+        myb = core.get_student_bookings(conn, EVENT_ID, student)
+        slots = core.get_event_slots(conn, EVENT_ID)
+    if any(b["company_id"] == company_id for b in myb):
+        raise ValueError("already booked with this company")
+    blocked = set()
+    for b in myb:
+        blocked.add(b["slot"])
+        blocked.update(core._neighbor_slots(b["slot"], step=15))
+    return [s for s in slots if s not in full and s not in blocked]
+
+
+def confirm_slot(eng, student, company_id, slot, matricola):
+    """Seconda transazione: la conferma, con il ricontrollo che fa la pagina."""
+    with eng.begin() as conn:
+        myb = core.get_student_bookings(conn, EVENT_ID, student)
+        if any(b["company_id"] == company_id for b in myb):
+            raise ValueError("already booked with this company")
+        core.book_slot(conn, EVENT_ID, company_id, student, slot, "https://cv.example/x", matricola)
+
+
+def rt_page(eng, student):
+    with eng.begin() as conn:
+        roundtables = core.get_roundtables(conn, EVENT_ID)
+        mine = core.get_student_roundtable_bookings(conn, EVENT_ID, student)
+    if mine:
+        raise ValueError("round table already booked")
+    return [rt for rt in roundtables
+            if rt["booked"] < core.roundtable_capacity(rt["name"]) * core.ROUNDTABLE_BOOKABLE_SHARE]
+
+
+def confirm_roundtable(eng, student, roundtable_id, matricola):
+    with eng.begin() as conn:
+        if core.get_student_roundtable_bookings(conn, EVENT_ID, student):
+            raise ValueError("round table already booked")
+        core.book_roundtable(conn, EVENT_ID, roundtable_id, student, matricola)
+
+
+def student_session(eng, stats, i, n_companies, interviews, popularity, rng):
+    email = f"s{i}@studenti.unitn.it"
+    matricola = f"{200000 + i}"
+    stats.run("register", auth.create_student_if_not_exists, email, f"Nome{i}", f"Cognome{i}", matricola)
+    stats.run("login", auth.find_student_user, email)
+
+    def my_bookings():
+        with eng.begin() as conn:
+            return core.get_student_bookings(conn, EVENT_ID, email)
+    stats.run("my_bookings", my_bookings)
+
+    for company in rng.choices(range(n_companies), weights=popularity, k=interviews):
+        company_id = 1000 + company
+        available = stats.run("slot_page", slot_page, eng, email, company_id)
+        if available:
+            stats.run("book_slot", confirm_slot, eng, email, company_id, rng.choice(available), matricola)
+
+    tables = stats.run("rt_page", rt_page, eng, email)
+    if tables:
+        stats.run("book_roundtable", confirm_roundtable, eng, email, rng.choice(tables)["id"], matricola)
+
+
+def worker(args):
+    """Un processo: il suo engine sul file condiviso e `threads` studenti alla volta."""
+    db_path, students, opts = args
+    eng = make_engine(db_path, opts["timeout"])
+    # le funzioni di auth/core usano l'engine di modulo: lo punto sul DB del test
+    core.engine = eng
+    auth.engine = eng
+    stats = Stats()
+    popularity = list(1.0 / np.arange(1, opts["companies"] + 1) ** 0.8)
+
+    def run(i):
+        rng = random.Random(opts["seed"] * 100003 + i)
+        student_session(eng, stats, i, opts["companies"], opts["interviews"], popularity, rng)
+
+    with ThreadPoolExecutor(max_workers=opts["threads"]) as pool:
+        list(pool.map(run, students))
+    eng.dispose()
+    return stats.__dict__
+
+
+def check(eng):
+    """Violazioni di integrità sul DB finale (0 = tutto a posto)."""
+    out = {}
+    with eng.connect() as conn:
+        out["slot/linea doppi"] = conn.execute(text("""
+            SELECT COUNT(*) FROM (SELECT 1 FROM booking WHERE event_id = :e
+                                  GROUP BY company_id, lane, slot HAVING COUNT(*) > 1)
+        """), {"e": EVENT_ID}).scalar()
+        out["slot oltre le linee"] = conn.execute(text("""
+            SELECT COUNT(*) FROM (
+                SELECT 1 FROM booking b JOIN event_company ec
+                  ON ec.event_id = b.event_id AND ec.company_id = b.company_id
+                WHERE b.event_id = :e
+                GROUP BY b.company_id, b.slot HAVING COUNT(*) > MAX(COALESCE(ec.lanes, 1)))
+        """), {"e": EVENT_ID}).scalar()
+        out["stessa azienda due volte"] = conn.execute(text("""
+            SELECT COUNT(*) FROM (SELECT 1 FROM booking WHERE event_id = :e
+                                  GROUP BY student, company_id HAVING COUNT(*) > 1)
+        """), {"e": EVENT_ID}).scalar()
+        rows = conn.execute(text("SELECT student, slot FROM booking WHERE event_id = :e ORDER BY student"),
+                            {"e": EVENT_ID}).all()
+        by_student = {}
+        for student, slot in rows:
+            by_student.setdefault(student, []).append(slot)
+        out["colloqui a < 15 min"] = sum(
+            int((np.diff(np.sort(slot_minutes(s))) <= 15).any()) for s in by_student.values() if len(s) > 1
+        )
+        counts = conn.execute(text("""
+            SELECT r.name, COUNT(rb.id) FROM roundtable r
+            LEFT JOIN roundtable_booking rb ON rb.roundtable_id = r.id
+            WHERE r.event_id = :e GROUP BY r.id
+        """), {"e": EVENT_ID}).all()
+        out["round table oltre capienza"] = sum(n > core.roundtable_capacity(name) for name, n in counts)
+        out["round table oltre il limite prenotabile"] = sum(
+            n > core.roundtable_capacity(name) * core.ROUNDTABLE_BOOKABLE_SHARE for name, n in counts
+        )
+        out["più round table per studente"] = conn.execute(text("""
+            SELECT COUNT(*) FROM (SELECT 1 FROM roundtable_booking WHERE event_id = :e
+                                  GROUP BY student HAVING COUNT(*) > 1)
+        """), {"e": EVENT_ID}).scalar()
+        out["_bookings"] = len(rows)
+        out["_roundtable"] = sum(n for _, n in counts)
+    return out
+
+
+def merge(results):
+    total = Stats()
+    for r in results:
+        for op in OPS:
+            total.latency[op].extend(r["latency"][op])
+            total.locked[op] += r["locked"][op]
+            total.rejected[op] += r["rejected"][op]
+            total.constraint[op] += r["constraint"][op]
+            total.errors[op] += r["errors"][op]
+        total.sample_error = total.sample_error or r["sample_error"]
+    return total
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Test di carico delle prenotazioni su SQLite")
+    ap.add_argument("--students", type=int, default=600)
+    ap.add_argument("--processes", type=int, default=4)
+    ap.add_argument("--threads", type=int, default=8, help="studenti contemporanei per processo")
+    ap.add_argument("--companies", type=int, default=40)
+    ap.add_argument("--lanes", type=int, default=1, help="linee parallele per azienda")
+    ap.add_argument("--interviews", type=int, default=3, help="colloqui tentati per studente")
+    ap.add_argument("--timeout", type=float, default=5.0, help="busy timeout SQLite (s)")
+    ap.add_argument("--wal", action="store_true", help="journal_mode=WAL")
+    ap.add_argument("--db", help="file SQLite da usare (default: temporaneo, cancellato alla fine)")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    if args.db:
+        db_path = args.db
+    else:
+        fd, db_path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+    eng = make_engine(db_path, args.timeout, wal=args.wal)
+    try:
+        core.init_db(eng)
+        core.migrate_db(eng)
+        populate(eng, args.companies, args.lanes)
+
+        opts = {k: getattr(args, k) for k in ("timeout", "threads", "companies", "interviews", "seed")}
+        chunks = [(db_path, list(range(p, args.students, args.processes)), opts) for p in range(args.processes)]
+        t0 = time.perf_counter()
+        # spawn: ogni processo apre le sue connessioni, come i worker di Streamlit
+        with mp.get_context("spawn").Pool(args.processes) as pool:
+            results = pool.map(worker, chunks)
+        wall = time.perf_counter() - t0
+        total = merge(results)
+        integrity = check(eng)
+
+        n_ops = sum(len(v) for v in total.latency.values())
+        print(f"{args.students} studenti • {args.processes} processi × {args.threads} thread • "
+              f"{args.companies} aziende × {args.lanes} linee • timeout {args.timeout}s"
+              f"{' • WAL' if args.wal else ''}")
+        print(f"Tempo {wall:.2f}s • {args.students / wall:.1f} studenti/s • {n_ops / wall:.1f} operazioni/s • "
+              f"prenotazioni {integrity['_bookings']} colloqui, {integrity['_roundtable']} round table")
+        print(f"{'operazione':<16}{'n':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'locked':>8}{'rifiuti':>9}{'vincoli':>9}{'errori':>8}")
+        for op in OPS:
+            lat = np.array(total.latency[op])
+            if not len(lat):
+                continue
+            p50, p95, p99 = np.percentile(lat, [50, 95, 99])
+            print(f"{op:<16}{len(lat):>7}{p50:>9.1f}{p95:>9.1f}{p99:>9.1f}"
+                  f"{total.locked[op]:>8}{total.rejected[op]:>9}{total.constraint[op]:>9}{total.errors[op]:>8}")
+        if total.sample_error:
+            print(f"Primo errore: {total.sample_error}")
+        violations = {k: v for k, v in integrity.items() if not k.startswith("_")}
+        n_locked = sum(total.locked.values())
+        ok = not any(violations.values()) and not sum(total.errors.values())
+        print(f"Lock timeout: {n_locked}")
+        print(f"{'✅' if ok else '❌'} Violazioni di integrità: "
+              + ", ".join(f"{k} {v}" for k, v in violations.items()))
+    finally:
+        eng.dispose()
+        if not args.db:
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(db_path + suffix):
+                    os.remove(db_path + suffix)
@@ -0,0 +1,112 @@
+# bench_notifier.py
+"""
+Giro del LateNotifier (notifier.scan_late + eta.refresh_etas) su eventi sintetici.
+
+    python bench_notifier.py --students 3000 --companies 60 --ticks 20 --at 13:00
+
+Su un evento non ancora iniziato (gen_event con --at 08:00: nessun colloquio
+avviato) verifica che alle 20:00 scan_late non scriva avvisi di ritardo, e che
+avviandone uno solo avvisi unicamente il prossimo di quella linea. Poi misura la
+durata di un giro completo a metà giornata (gen_event con --at, default 13:00),
+con le notifiche 'expected_start' che si accumulano giro dopo giro.
+Esce con stato 1 se un controllo fallisce.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import create_engine, text
+
+import core
+from eta import refresh_etas
+from gen_event import generate
+from notifier import scan_late
+
+
+def _engine(workdir, name):
+    return create_engine(f"sqlite:///{os.path.join(workdir, name)}", future=True)
+
+
+def check_untouched(eng) -> list[str]:
+    """Linee mai avviate: nessun avviso; una linea avviata: un solo avviso, sulla linea giusta."""
+    errors = []
+    evening = datetime(2025, 11, 12, 20, 0)
+    with eng.begin() as conn:
+        n = scan_late(conn, now=evening)
+        if n:
+            errors.append(f"{n} avvisi di ritardo su linee mai avviate")
+        # primo slot di una linea con un prenotato nello slot successivo
+        b = conn.execute(text("""
+            SELECT b.id, b.company_id, b.lane, n.student AS next_student
+            FROM booking b
+            JOIN booking n ON n.event_id = b.event_id AND n.company_id = b.company_id AND n.lane = b.lane
+                          AND n.slot = strftime('%H:%M', b.slot, '+15 minutes')
+            WHERE b.event_id = 1 AND b.slot = (SELECT MIN(slot) FROM booking f
+                                               WHERE f.event_id = 1 AND f.company_id = b.company_id
+                                                 AND f.lane = b.lane)
+            LIMIT 1
+        """)).mappings().first()
+        core.start_interview(conn, b["id"])
+        n = scan_late(conn, now=evening)
+        rows = conn.execute(
+            text("SELECT company_id, student FROM notification WHERE kind = 'running_late'")
+        ).all()
+        if n != 1 or [tuple(r) for r in rows] != [(b["company_id"], b["next_student"])]:
+            errors.append(f"linea avviata: {n} avvisi scritti, attesi 1 per {b['next_student']}")
+    return errors
+
+
+def time_ticks(eng, ticks, at) -> np.ndarray:
+    h, m = map(int, at.split(":"))
+    now = datetime(2025, 11, 12, h, m)
+    ms = []
+    for i in range(ticks):
+        t0 = time.perf_counter()
+        with eng.begin() as conn:
+            scan_late(conn, now=now)
+            refresh_etas(conn, now=now)
+        ms.append((time.perf_counter() - t0) * 1000)
+        now += timedelta(minutes=1)  # ogni minuto gli ETA si spostano e si scrivono nuovi avvisi
+    return np.array(ms)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Benchmark e controlli del giro del notifier")
+    ap.add_argument("--students", type=int, default=3000)
+    ap.add_argument("--companies", type=int, default=60)
+    ap.add_argument("--ticks", type=int, default=20)
+    ap.add_argument("--at", default="13:00", help="ora della giornata a cui girare il notifier")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_notifier_")
+    try:
+        pre = _engine(workdir, "pre.db")
+        generate(pre, args.students, args.companies, seed=args.seed, at="08:00")
+        errors = check_untouched(pre)
+        pre.dispose()
+
+        day = _engine(workdir, "day.db")
+        generate(day, args.students, args.companies, seed=args.seed, at=args.at)
+        with day.connect() as conn:
+            n_bookings = conn.execute(text("SELECT COUNT(*) FROM booking WHERE event_id = 1")).scalar()
+        ms = time_ticks(day, args.ticks, args.at)
+        with day.connect() as conn:
+            n_eta = conn.execute(text("SELECT COUNT(*) FROM notification WHERE kind = 'expected_start'")).scalar()
+        day.dispose()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{n_bookings} prenotazioni • {args.ticks} giri • {n_eta} avvisi expected_start alla fine")
+    print(f"giro: p50 {np.median(ms):.1f} ms • p95 {np.percentile(ms, 95):.1f} • max {ms.max():.1f} "
+          f"(primo {ms[0]:.1f}, ultimo {ms[-1]:.1f})")
+    for e in errors:
+        print(f"❌ {e}")
+    if not errors:
+        print("✅ Nessun avviso di ritardo su linee mai avviate")
+    sys.exit(1 if errors else 0)
@@ -0,0 +1,101 @@
+# bench_outbox.py
+"""
+Svuotamento dell'outbox contro lo SMTP sink locale, con e senza tracing.
+
+    python bench_outbox.py --mails 200 --batch 25
+
+Per ogni frequenza di campionamento (--rates, default 0 e 1) accoda --mails
+mail in un DB SQLite temporaneo, le invia con OutboxWorker.drain_once su un
+SmtpConnection verso smtp_sink e verifica che siano tutte 'sent', su una sola
+connessione, e che con il tracing attivo ogni invio abbia il suo span
+"smtp.send". Esce con stato 1 se un controllo fallisce.
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine, text
+
+import core
+import tracing
+from mailer import OutboxWorker, SmtpConnection
+from smtp_sink import start_sink
+
+
+def _reset_tracing():
+    """Fa rileggere a tracing frequenza e cartella e chiude il file delle tracce del giro prima."""
+    logger = logging.getLogger("ied.tracing")
+    for h in list(logger.handlers):
+        h.close()
+        logger.removeHandler(h)
+    tracing._settings = tracing._logger = None
+
+
+def run(n_mails, batch, rate, trace_dir) -> dict:
+    os.environ["TRACE_SAMPLE_RATE"] = str(rate)
+    os.environ["TRACE_DIR"] = trace_dir
+    _reset_tracing()
+    fd, db_path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    eng = create_engine(f"sqlite:///{db_path}", future=True)
+    sink = start_sink()
+    try:
+        core.init_db(eng)
+        core.migrate_db(eng)
+        with eng.begin() as conn:
+            for i in range(n_mails):
+                core.enqueue_email(conn, f"s{i}@studenti.unitn.it", "Prova", "Corpo della mail", "bench")
+        smtp = SmtpConnection(host="127.0.0.1", port=sink.server_address[1], starttls=False, user="")
+        worker = OutboxWorker(smtp=smtp, batch_size=batch, db_engine=eng)
+        t0 = time.perf_counter()
+        while worker.drain_once():
+            pass
+        elapsed = time.perf_counter() - t0
+        smtp.close()
+        with eng.connect() as conn:
+            status = dict(conn.execute(text("SELECT status, COUNT(*) FROM email_outbox GROUP BY status")).all())
+        return {"rate": rate, "seconds": elapsed, "status": status, "received": len(sink.messages),
+                "connects": smtp.connects, "last_error": worker.metrics["last_error"]}
+    finally:
+        sink.shutdown()
+        sink.server_close()
+        eng.dispose()
+        os.remove(db_path)
+
+
+def traced_sends(trace_dir) -> int:
+    n = 0
+    for path in glob.glob(os.path.join(trace_dir, "traces.jsonl*")):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                t = json.loads(line)
+                if t["name"] == "outbox_batch":
+                    n += sum(1 for s in t["spans"] if s["name"] == "smtp.send" and s["attrs"].get("kind") == "bench")
+    return n
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Benchmark dell'outbox su SMTP sink")
+    ap.add_argument("--mails", type=int, default=200)
+    ap.add_argument("--batch", type=int, default=25)
+    ap.add_argument("--rates", default="0,1", help="frequenze di campionamento del tracing da provare")
+    args = ap.parse_args()
+
+    ok = True
+    for rate in (float(x) for x in args.rates.split(",")):
+        with tempfile.TemporaryDirectory() as trace_dir:
+            r = run(args.mails, args.batch, rate, trace_dir)
+            spans = traced_sends(trace_dir)
+            _reset_tracing()
+        good = (r["status"] == {"sent": args.mails} and r["received"] == args.mails and r["connects"] == 1
+                and (rate < 1 or spans == args.mails))
+        ok &= good
+        print(f"{'✅' if good else '❌'} tracing {rate:g}: {r['status']} • {r['received']} ricevute su "
+              f"{r['connects']} connessioni • {args.mails / r['seconds']:.0f} mail/s • span smtp.send {spans}"
+              + (f" • ultimo errore: {r['last_error']}" if r["last_error"] else ""))
+    sys.exit(0 if ok else 1)
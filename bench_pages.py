@@ -0,0 +1,250 @@
+# bench_pages.py
+"""
+Benchmark delle pagine con streamlit.testing.v1.AppTest.
+
+    python bench_pages.py                 # 3 ripetizioni, esce con 1 se supera le soglie
+    python bench_pages.py --repeat 5 --slack 2.0 --students 800
+
+Ogni click costa un rerun completo di app.py più render_student / render_company /
+render_admin. Qui si entra dalla pagina di login con ogni ruolo su un evento
+sintetico (DB SQLite temporaneo, preferenze assegnate con run_scheduler) e si
+ripetono le interazioni tipiche: scelta azienda, prenotazione e conferma,
+"Mark as read", Inizia/Termina colloquio, salvataggio presenze plenaria.
+Per ogni passo misura il tempo del rerun e le query SQL eseguite (listener
+before_cursor_execute sull'engine di core).
+
+THRESHOLDS fissa per ogni passo il tempo massimo (ms, moltiplicato per --slack)
+e il numero massimo di query: se un cambiamento le supera il benchmark fallisce.
+Il numero di query è deterministico e va aggiornato insieme al codice; i tempi
+hanno margine perché dipendono dalla macchina.
+
+Lavora in una cartella temporanea con DB_URL, credenziali e worker disattivati
+via env, quindi non tocca .streamlit/secrets.toml né il DB dell'app.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+STUDENT_PW = "bench-pw"
+COMPANY_PW = "bench-pw"
+ADMIN_PW = "bench-admin"
+
+# passo: (ms massimi per rerun, query massime), tarate sui default (400 studenti, 40 aziende):
+# le query della pagina admin crescono con gli studenti
+THRESHOLDS = {
+    "login_page": (1000, 100),
+    "student_login": (1000, 225),
+    "student_pick_company": (500, 125),
+    "student_book": (500, 240),
+    "student_confirm": (500, 245),
+    "student_mark_read": (500, 225),
+    "company_login": (1500, 210),
+    "company_start": (500, 215),
+    "company_end": (500, 220),
+    "admin_login": (12000, 610),
+    "admin_save_attendance": (20000, 980),
+}
+
+
+def prepare_env(workdir):
+    """Configurazione via env prima di importare core: niente secrets, niente thread."""
+    import bcrypt  # in prod auth accetta solo hash
+
+    sys.path.insert(0, os.path.dirname(APP))
+    os.chdir(workdir)
+    os.environ.update({
+        "DB_URL": f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        "CV_DIR": os.path.join(workdir, "cv"),
+        "AUTH_MODE": "prod",
+        "ADMIN_USER": "admin",
+        "ADMIN_PASS_HASH": bcrypt.hashpw(ADMIN_PW.encode(), bcrypt.gensalt()).decode(),
+        "OUTBOX_WORKER": "0",
+        "CV_INDEX_WORKER": "0",
+        "LATE_NOTIFIER": "0",
+    })
+
+
+def populate(n_students, n_companies, seed):
+    """Evento sintetico: preferenze assegnate dallo scheduler, round table, utenti di login."""
+    from sqlalchemy import text
+    from werkzeug.security import generate_password_hash
+
+    import core
+    from auth import make_hash
+    from bench_scheduler import populate as populate_prefs
+    from scheduler import run_scheduler
+
+    core.init_db()
+    core.migrate_db()
+    core.ensure_dirs()
+    populate_prefs(core.engine, n_students, n_companies, ranked=6, seed=seed)
+    run_scheduler(1, quota=3, seed=seed)
+    pw_hash = generate_password_hash(STUDENT_PW)
+    with core.engine.begin() as conn:
+        conn.execute(
+            text("""INSERT INTO student (email, givenName, sn, matricola, password, plenary_attendance)
+                    VALUES (:e, :g, :sn, :m, :pw, 1)"""),
+            [{"e": f"s{i}@studenti.unitn.it", "g": f"Nome{i}", "sn": f"Cognome{i}",
+              "m": str(200000 + i), "pw": pw_hash} for i in range(n_students)]
+        )
+        conn.execute(
+            text("INSERT INTO company_user (company_id, email, password) VALUES (:c, :e, :pw)"),
+            [{"c": 1000 + c, "e": f"hr{c}@azienda.it", "pw": make_hash(COMPANY_PW)} for c in range(n_companies)]
+        )
+        conn.execute(
+            text("INSERT INTO roundtable (event_id, name, room) VALUES (1, :n, :r) ON CONFLICT DO NOTHING"),
+            [{"n": name, "r": f"Aula {i}"} for i, name in enumerate(core.ROUNDTABLE_CAPACITY, 1)]
+        )
+        rt_ids = [r[0] for r in conn.execute(text("SELECT id FROM roundtable WHERE event_id = 1 ORDER BY id"))]
+        conn.execute(
+            text("""INSERT INTO roundtable_booking (event_id, roundtable_id, student, created_at)
+                    VALUES (1, :rt, :s, datetime('now'))"""),
+            [{"rt": rt_ids[i % len(rt_ids)], "s": f"s{i}@studenti.unitn.it"} for i in range(n_students)]
+        )
+        conn.execute(
+            text("""INSERT INTO notification (event_id, company_id, student, slot_from, kind, message, created_at)
+                    VALUES (1, 1000, :s, '09:00', 'running_late', 'Benchmark notification', datetime('now'))"""),
+            [{"s": f"s{i}@studenti.unitn.it"} for i in range(n_students)]
+        )
+
+
+class QueryCounter:
+    def __init__(self, eng):
+        from sqlalchemy import event
+        self.n = 0
+        event.listen(eng, "before_cursor_execute", self._count)
+
+    def _count(self, *args):
+        self.n += 1
+
+
+def widget(elements, label=None, key=None, prefix=None):
+    for w in elements:
+        if (key is not None and w.key == key) or (label is not None and w.label == label) \
+                or (prefix is not None and w.label.startswith(prefix)):
+            return w
+    raise LookupError(f"widget non trovato: {label or key or prefix}")
+
+
+class Session:
+    """Un AppTest (una sessione del browser) che registra ogni rerun come passo."""
+    def __init__(self, counter, results):
+        from streamlit.testing.v1 import AppTest
+        self.at = AppTest.from_file(APP, default_timeout=60)
+        self.counter = counter
+        self.results = results
+
+    def step(self, name, action=None):
+        if action:
+            action(self.at)
+        q0 = self.counter.n
+        t0 = time.perf_counter()
+        self.at.run()
+        ms = (time.perf_counter() - t0) * 1000
+        if self.at.exception:
+            raise RuntimeError(f"{name}: {self.at.exception[0].value}")
+        self.results.setdefault(name, []).append((ms, self.counter.n - q0))
+
+
+def student_flow(session, i):
+    email = f"s{i}@studenti.unitn.it"
+    session.step("login_page")
+
+    def login(at):
+        widget(at.text_input, key="student_login_email").set_value(email)
+        widget(at.text_input, key="student_login_pw").set_value(STUDENT_PW)
+        widget(at.button, key="btn_student_login").click()
+    session.step("student_login", login)
+
+    def pick(at):
+        # un'azienda in fondo alla lista (le seed, senza prenotazioni): ha sempre slot liberi
+        box = widget(at.selectbox, label="Select the company")
+        box.set_value(box.options[-1 - i % len(box.options)])
+    session.step("student_pick_company", pick)
+    session.step("student_book", lambda at: widget(at.button, label="📅 Book slot").click())
+    session.step("student_confirm", lambda at: widget(at.button, label="✅ Confirm booking").click())
+    session.step("student_mark_read", lambda at: widget(at.button, label="Mark as read").click())
+
+
+def company_flow(session, c):
+    session.step("login_page")
+
+    def login(at):
+        widget(at.text_input, key="company_email").set_value(f"hr{c}@azienda.it")
+        widget(at.text_input, key="company_pass").set_value(COMPANY_PW)
+        widget(at.button, key="btn_company").click()
+    session.step("company_login", login)
+    session.step("company_start", lambda at: widget(at.button, prefix="▶️ Inizia").click())
+    session.step("company_end", lambda at: widget(at.button, prefix="⏹️ Termina").click())
+
+
+def admin_flow(session):
+    session.step("login_page")
+
+    def login(at):
+        widget(at.text_input, key="company_email").set_value("admin")
+        widget(at.text_input, key="company_pass").set_value(ADMIN_PW)
+        widget(at.button, key="btn_company").click()
+    session.step("admin_login", login)
+
+    def save(at):
+        at.checkbox[0].check()
+        widget(at.button, label="💾 Salva presenze").click()
+    session.step("admin_save_attendance", save)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark delle pagine Streamlit (AppTest)")
+    ap.add_argument("--students", type=int, default=400)
+    ap.add_argument("--companies", type=int, default=40)
+    ap.add_argument("--repeat", type=int, default=3, help="sessioni per ruolo")
+    ap.add_argument("--slack", type=float, default=1.0, help="moltiplicatore delle soglie di tempo")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="bench_pages_")
+    prepare_env(workdir)
+    import core
+
+    try:
+        populate(args.students, args.companies, args.seed)
+        counter = QueryCounter(core.engine)
+        results = {}
+        for r in range(args.repeat):
+            student_flow(Session(counter, results), r)
+            company_flow(Session(counter, results), r)
+            admin_flow(Session(counter, results))
+
+        failed = []
+        print(f"{args.students} studenti • {args.companies} aziende • {args.repeat} sessioni per ruolo")
+        print(f"{'passo':<24}{'n':>4}{'med ms':>9}{'max ms':>9}{'soglia':>9}{'query':>7}{'max q':>7}")
+        for name, runs in results.items():
+            ms = np.array([m for m, _ in runs])
+            queries = max(q for _, q in runs)
+            max_ms, max_q = THRESHOLDS.get(name, (float("inf"), float("inf")))
+            limit = max_ms * args.slack
+            bad = np.median(ms) > limit or queries > max_q
+            if bad:
+                failed.append(name)
+            print(f"{name:<24}{len(ms):>4}{np.median(ms):>9.0f}{ms.max():>9.0f}{limit:>9.0f}"
+                  f"{queries:>7}{max_q:>7}{'  ❌' if bad else ''}")
+    finally:
+        core.engine.dispose()
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+    if failed:
+        print(f"❌ Soglie superate: {', '.join(failed)}")
+        return 1
+    print("✅ Tutti i passi entro le soglie")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
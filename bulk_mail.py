@@ -0,0 +1,291 @@
+# bulk_mail.py
+"""
+Mailing massivo del programma personale (colloqui + tavola rotonda) a tutti gli studenti.
+
+    python bulk_mail.py --campaign schedule-2025 --concurrency 4
+    python bulk_mail.py --campaign schedule-2025 --dry-run --limit 5
+
+- una sola query set-based costruisce i programmi di tutti gli studenti;
+- i messaggi sono generati in streaming (niente lista completa in memoria);
+- N thread, ognuno con la propria connessione SMTP persistente (tetto di concorrenza);
+- ogni messaggio è registrato in `email_outbox` con dedup_key `<campaign>:<email>`:
+  rilanciando lo stesso comando dopo un'interruzione gli studenti già serviti
+  vengono saltati. Quelle fallite passano al worker dell'outbox; quelle rimaste
+  a metà invio (stato 'bulk') no: il worker non le prende mai e restano ferme
+  finché non si rilancia la campagna con --retry-uncertain (possibili doppioni).
+"""
+import argparse
+import queue
+import threading
+import time
+from datetime import datetime
+from itertools import groupby, islice
+
+from sqlalchemy import text
+
+from core import engine, get_active_event
+from mailer import SmtpConnection, build_message, render_booking_summary
+
+RESERVE_CHUNK = 100     # righe prenotate in outbox per transazione
+SCHEDULE_PAGE = 500     # studenti letti per query
+FLUSH_EVERY = 50        # esiti scritti in DB ogni N messaggi (o ogni secondo)
+SEND_ATTEMPTS = 3       # tentativi diretti prima di lasciare la mail all'outbox
+
+
+# una pagina di studenti (email > :after) con colloqui e tavole rotonde
+SCHEDULES_SQL = text("""
+    WITH page AS (SELECT email, givenName, sn FROM student WHERE email > :after ORDER BY email LIMIT :n)
+    SELECT s.email, s.givenName, s.sn, 0 AS part, b.slot AS slot, c.name AS name
+    FROM page s
+    JOIN booking b ON b.event_id = :e AND b.student = s.email
+    JOIN company c ON c.id = b.company_id
+    UNION ALL
+    SELECT s.email, s.givenName, s.sn, 1 AS part, NULL AS slot, r.name AS name
+    FROM page s
+    JOIN roundtable_booking rb ON rb.event_id = :e AND rb.student = s.email
+    JOIN roundtable r ON r.id = rb.roundtable_id
+    UNION ALL
+    SELECT s.email, s.givenName, s.sn, 2 AS part, NULL AS slot, NULL AS name
+    FROM page s
+    ORDER BY 1, 4, 5
+""")
+
+
+def iter_schedules(conn, event_id):
+    """Genera (email, nome, colloqui, tavole_rotonde) per ogni studente, in streaming."""
+    # a pagine di SCHEDULE_PAGE studenti: ogni pagina è letta per intero, così la
+    # lettura non tiene il lock SQLite mentre le altre transazioni registrano gli invii
+    after = ""
+    while True:
+        rows = conn.execute(SCHEDULES_SQL, {"e": event_id, "after": after, "n": SCHEDULE_PAGE}).mappings().all()
+        if not rows:
+            return
+        for email, group in groupby(rows, key=lambda r: r["email"]):
+            interviews, roundtables, name = [], [], None
+            for r in group:
+                name = f"{r['givenName']} {r['sn']}".strip()
+                if r["part"] == 0:
+                    interviews.append({"company": r["name"], "slot": r["slot"]})
+                elif r["part"] == 1:
+                    roundtables.append(r["name"])
+            yield email, name, interviews, roundtables
+        after = rows[-1]["email"]
+
+
+def iter_messages(conn, event_id, campaign, skip: set, only_booked=False):
+    """Genera (dedup_key, email, subject, body) saltando gli studenti già serviti."""
+    for email, name, interviews, roundtables in iter_schedules(conn, event_id):
+        key = f"{campaign}:{email}"
+        if key in skip:
+            continue
+        if only_booked and not interviews and not roundtables:
+            continue
+        subject, body = render_booking_summary(name, interviews, roundtables)
+        yield key, email, subject, body
+
+
+def _chunks(it, n):
+    buf = []
+    for x in it:
+        buf.append(x)
+        if len(buf) >= n:
+            yield buf
+            buf = []
+    if buf:
+        yield buf
+
+
+class BulkSender:
+    """Pool di N thread SMTP alimentato da una coda limitata (backpressure sul generatore)."""
+
+    def __init__(self, concurrency=4, smtp_factory=SmtpConnection):
+        self.concurrency = concurrency
+        self.smtp_factory = smtp_factory
+        self.todo = queue.Queue(maxsize=concurrency * 4)
+        self.done = queue.Queue()
+        self.threads = []
+        self.connections = []
+
+    def _work(self):
+        smtp = self.smtp_factory()
+        self.connections.append(smtp)
+        try:
+            while True:
+                item = self.todo.get()
+                if item is None:
+                    return
+                outbox_id, email, subject, body = item
+                err = None
+                for attempt in range(SEND_ATTEMPTS):
+                    try:
+                        smtp.send(build_message(email, subject, body))
+                        err = None
+                        break
+                    except Exception as e:
+                        err = str(e)[:500]
+                        time.sleep(0.2 * 2 ** attempt)
+                self.done.put((outbox_id, err))
+        finally:
+            smtp.close()
+
+    def start(self):
+        for i in range(self.concurrency):
+            t = threading.Thread(target=self._work, name=f"bulk-smtp-{i}", daemon=True)
+            t.start()
+            self.threads.append(t)
+
+    def submit(self, item):
+        self.todo.put(item)
+
+    def close(self):
+        for _ in self.threads:
+            self.todo.put(None)
+        for t in self.threads:
+            t.join()
+
+
+def _already_handled(conn, campaign, retry_uncertain: bool) -> set:
+    statuses = ("sent", "pending", "sending", "failed") if retry_uncertain else \
+               ("sent", "pending", "sending", "failed", "bulk")
+    # confronto sul prefisso e non LIKE: '%' e '_' nel nome della campagna sono caratteri qualsiasi
+    prefix = f"{campaign}:"
+    q = text(f"""SELECT dedup_key FROM email_outbox
+                 WHERE substr(dedup_key, 1, :n) = :p
+                   AND status IN ({", ".join(f"'{s}'" for s in statuses)})""")
+    return {r[0] for r in conn.execute(q, {"p": prefix, "n": len(prefix)})}
+
+
+def _uncertain(conn, campaign) -> int:
+    """Mail della campagna rimaste in stato 'bulk' (invio interrotto a metà)."""
+    prefix = f"{campaign}:"
+    return conn.execute(
+        text("SELECT COUNT(*) FROM email_outbox WHERE status = 'bulk' AND substr(dedup_key, 1, :n) = :p"),
+        {"p": prefix, "n": len(prefix)}
+    ).scalar()
+
+
+def _reserve(conn, event_id, chunk) -> list:
+    """Registra il chunk in outbox con stato 'bulk'; restituisce (id, email, subject, body)."""
+    now_iso = datetime.utcnow().isoformat()
+    conn.execute(
+        text("""INSERT INTO email_outbox
+                (event_id, recipient, subject, body, kind, dedup_key, status, next_attempt_at, created_at)
+                VALUES (:e, :r, :subj, :body, 'bulk_schedule', :d, 'bulk', :t, :t)
+                ON CONFLICT(dedup_key) DO UPDATE SET subject=excluded.subject, body=excluded.body
+                WHERE email_outbox.status = 'bulk'"""),
+        [{"e": event_id, "r": email, "subj": subject, "body": body, "d": key, "t": now_iso}
+         for key, email, subject, body in chunk]
+    )
+    ids = dict(conn.execute(
+        text(f"""SELECT dedup_key, id FROM email_outbox
+                 WHERE status = 'bulk' AND dedup_key IN ({", ".join(f":k{i}" for i in range(len(chunk)))})"""),
+        {f"k{i}": c[0] for i, c in enumerate(chunk)}
+    ).all())
+    return [(ids[key], email, subject, body) for key, email, subject, body in chunk if key in ids]
+
+
+def _flush(results):
+    if not results:
+        return
+    now_iso = datetime.utcnow().isoformat()
+    with engine.begin() as conn:
+        ok = [{"id": i, "t": now_iso} for i, err in results if err is None]
+        ko = [{"id": i, "t": now_iso, "err": err} for i, err in results if err is not None]
+        if ok:
+            conn.execute(
+                text("UPDATE email_outbox SET status='sent', sent_at=:t, attempts=attempts+1 WHERE id=:id"),
+                ok
+            )
+        if ko:
+            # lasciamo il resto al worker dell'outbox (retry con backoff)
+            conn.execute(
+                text("""UPDATE email_outbox
+                        SET status='pending', attempts=attempts+1, last_error=:err, next_attempt_at=:t
+                        WHERE id=:id"""),
+                ko
+            )
+
+
+def run_campaign(campaign, concurrency=4, limit=None, dry_run=False, only_booked=False,
+                 retry_uncertain=False, smtp_factory=SmtpConnection, report_every=5.0) -> dict:
+    with engine.begin() as conn:
+        event = get_active_event(conn)
+        skip = _already_handled(conn, campaign, retry_uncertain)
+        uncertain = 0 if retry_uncertain else _uncertain(conn, campaign)
+
+    stats = {"sent": 0, "failed": 0, "skipped": len(skip), "uncertain": uncertain, "seconds": 0.0}
+    t0 = time.perf_counter()
+
+    with engine.connect() as read_conn:
+        messages = iter_messages(read_conn, event["id"], campaign, skip, only_booked)
+        if limit:
+            messages = islice(messages, limit)
+
+        if dry_run:
+            for key, email, subject, body in messages:
+                print(f"--- {email} ---\n{body}")
+                stats["sent"] += 1
+            return stats
+
+        sender = BulkSender(concurrency, smtp_factory)
+        sender.start()
+        pending_results, last_flush, last_report = [], time.monotonic(), time.monotonic()
+
+        def drain(block=False):
+            nonlocal last_flush, last_report
+            while True:
+                try:
+                    outbox_id, err = sender.done.get(block=block, timeout=0.1 if block else None)
+                except queue.Empty:
+                    break
+                pending_results.append((outbox_id, err))
+                stats["sent" if err is None else "failed"] += 1
+                block = False
+            now = time.monotonic()
+            if len(pending_results) >= FLUSH_EVERY or (pending_results and now - last_flush > 1.0):
+                _flush(pending_results)
+                pending_results.clear()
+                last_flush = now
+            if report_every and now - last_report > report_every:
+                rate = stats["sent"] / (time.perf_counter() - t0)
+                print(f"… {stats['sent']} inviate, {stats['failed']} fallite, {rate:.1f} msg/s")
+                last_report = now
+
+        submitted = 0
+        for chunk in _chunks(messages, RESERVE_CHUNK):
+            with engine.begin() as conn:
+                reserved = _reserve(conn, event["id"], chunk)
+            for item in reserved:
+                sender.submit(item)   # blocca se i worker sono indietro
+                submitted += 1
+                drain()
+        sender.close()
+        while stats["sent"] + stats["failed"] < submitted:
+            drain(block=True)
+        _flush(pending_results)
+
+    stats["seconds"] = time.perf_counter() - t0
+    stats["messages_per_sec"] = round(stats["sent"] / stats["seconds"], 2) if stats["seconds"] else 0.0
+    return stats
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Invia a tutti gli studenti il proprio programma della giornata")
+    ap.add_argument("--campaign", required=True, help="nome della campagna (chiave di ripresa)")
+    ap.add_argument("--concurrency", type=int, default=4, help="connessioni SMTP in parallelo")
+    ap.add_argument("--limit", type=int, default=None)
+    ap.add_argument("--only-booked", action="store_true", help="salta chi non ha prenotazioni")
+    ap.add_argument("--retry-uncertain", action="store_true",
+                    help="rispedisci anche le mail interrotte a metà invio (stato 'bulk'): il worker "
+                         "dell'outbox non le riprende, senza questa opzione restano non inviate "
+                         "(possibile doppione)")
+    ap.add_argument("--dry-run", action="store_true", help="stampa i messaggi senza inviarli")
+    args = ap.parse_args()
+
+    res = run_campaign(args.campaign, args.concurrency, args.limit, args.dry_run,
+                       args.only_booked, args.retry_uncertain)
+    print(f"\n✅ Campagna '{args.campaign}': {res['sent']} inviate, {res['failed']} passate all'outbox, "
+          f"{res['skipped']} già servite, {res.get('messages_per_sec', 0)} msg/s")
+    if res["uncertain"]:
+        print(f"⚠️ {res['uncertain']} mail interrotte a metà invio in un giro precedente (stato 'bulk'): "
+              f"non le rispedisce nessuno, rilancia con --retry-uncertain per inviarle")
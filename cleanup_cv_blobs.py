@@ -0,0 +1,25 @@
+# cleanup_cv_blobs.py
+# Garbage collection dello store dei CV: rimuove i PDF non più usati da nessuna prenotazione.
+#   python cleanup_cv_blobs.py            -> esegue
+#   python cleanup_cv_blobs.py --dry-run  -> mostra soltanto cosa verrebbe rimosso
+import sys
+from core import engine, gc_cv_blobs, text
+
+dry_run = "--dry-run" in sys.argv
+
+with engine.begin() as conn:
+    if not dry_run:
+        # riallinea i refcount con le prenotazioni reali prima di decidere cosa è orfano
+        conn.execute(text("""
+            UPDATE cv_blob
+            SET refcount = (SELECT COUNT(*) FROM booking b WHERE b.cv_digest = cv_blob.digest)
+        """))
+# transazione propria: i file si cancellano dopo il commit
+res = gc_cv_blobs(engine, dry_run=dry_run)
+with engine.connect() as conn:
+    totals = conn.execute(text("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cv_blob")).first()
+
+prefix = "🔍 (dry-run) " if dry_run else "🗑️ "
+print(f"{prefix}Blob rimossi: {res['blobs']} + {res['orphans']} senza prenotazione "
+      f"({res['bytes'] / 1024 / 1024:.1f} MB), upload interrotti: {res['stale_parts']}")
+print(f"📦 Blob rimasti: {totals[0]} ({totals[1] / 1024 / 1024:.1f} MB)")
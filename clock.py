@@ -0,0 +1,95 @@
+# clock.py
+"""
+Orologio dell'applicazione, sostituibile.
+
+core, page_company, notifier ed eta leggono l'ora da qui invece che da
+datetime.now() / datetime.utcnow(): di default è l'orologio di sistema, e
+replay_day.py installa un ReplayClock che parte dall'inizio di una giornata
+registrata e scorre `speed` volte più veloce (o si sposta solo a comando).
+
+Restano sull'orologio di sistema le cose che misurano il processo e non la
+giornata: lease tra processi, log delle query lente, età dei file CV.
+"""
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+
+def _system_offset() -> timedelta:
+    return timedelta(minutes=round((datetime.now() - datetime.utcnow()).total_seconds() / 60))
+
+
+class SystemClock:
+    def now(self) -> datetime:
+        return datetime.now()
+
+    def utcnow(self) -> datetime:
+        return datetime.utcnow()
+
+
+class ReplayClock:
+    """
+    Ora simulata: `start` (ora locale) più il tempo reale trascorso per `speed`.
+    Con speed=None l'orologio è fermo e si sposta solo con set() / advance().
+    """
+
+    def __init__(self, start: datetime, speed: float | None = 60.0, utc_offset: timedelta | None = None):
+        self.speed = speed
+        self.utc_offset = _system_offset() if utc_offset is None else utc_offset
+        self.set(start)
+
+    def set(self, when: datetime):
+        self._base = when
+        self._t0 = time.perf_counter()
+
+    def advance(self, **delta):
+        self.set(self.now() + timedelta(**delta))
+
+    def now(self) -> datetime:
+        if not self.speed:
+            return self._base
+        return self._base + timedelta(seconds=(time.perf_counter() - self._t0) * self.speed)
+
+    def utcnow(self) -> datetime:
+        return self.now() - self.utc_offset
+
+    def sleep_until(self, when: datetime):
+        """Aspetta in tempo reale che l'ora simulata arrivi a `when`; da fermo ci salta subito."""
+        if not self.speed:
+            if when > self._base:
+                self.set(when)
+            return
+        wait = (when - self.now()).total_seconds() / self.speed
+        if wait > 0:
+            time.sleep(wait)
+
+
+_clock = SystemClock()
+
+
+def get_clock():
+    return _clock
+
+
+def set_clock(new_clock=None):
+    """Installa `new_clock` (None = sistema) per tutto il processo; ritorna il precedente."""
+    global _clock
+    prev, _clock = _clock, new_clock or SystemClock()
+    return prev
+
+
+@contextmanager
+def use_clock(new_clock):
+    prev = set_clock(new_clock)
+    try:
+        yield new_clock
+    finally:
+        set_clock(prev)
+
+
+def now() -> datetime:
+    return _clock.now()
+
+
+def utcnow() -> datetime:
+    return _clock.utcnow()
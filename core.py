@@ -2,18 +2,33 @@
 import os
 import re
 import json
+import glob
+import hashlib
+import tempfile
+import threading
+import time
+import contextvars
+import functools
+from collections import deque
 from datetime import datetime, timedelta
 
 import numpy as np
 import pandas as pd
-from sqlalchemy import create_engine, text
+from sqlalchemy import bindparam, create_engine, event, text
 import streamlit as st
 from werkzeug.security import generate_password_hash
 
+import clock
+from metrics import BOOKINGS, BOOKING_REJECTS, NOTIFICATIONS, SQLITE_BUSY
+from tracing import add_span, traced
+
 # ------------------- secrets/env helpers (no import from auth to avoid cycles) -------------------
 def read_secret(key: str, default=None):
-    if hasattr(st, "secrets") and key in st.secrets:
-        return st.secrets[key]
+    try:
+        if hasattr(st, "secrets") and key in st.secrets:
+            return st.secrets[key]
+    except Exception:
+        pass  # nessun secrets.toml (script e benchmark lanciati fuori dalla cartella dell'app)
     return os.getenv(key, default)
 
 # ------------------- CONFIG -------------------
@@ -23,7 +38,150 @@ CV_DIR = read_secret("CV_DIR", "cv")
 
 engine = create_engine(DB_URL, future=True)
 
-SCHEMA = '''
+# ------------------- Statistiche query (before/after_cursor_execute) -------------------
+# Per processo: conteggio, tempo totale e massimo per statement normalizzato e per
+# "scope" (pagina/ruolo del rerun, impostato da app.py; i thread di background restano
+# 'background'). Le query oltre SLOW_QUERY_MS finiscono in SLOW_QUERY_LOG con i soli
+# tipi dei parametri, mai i valori (email, matricole, password).
+# Gli stessi listener aggiungono uno span "sql" alla traccia del rerun (tracing.py).
+QUERY_STATS_ENABLED = str(read_secret("QUERY_STATS", "1")).lower() not in ("0", "false", "no")
+TRACING_ENABLED = float(read_secret("TRACE_SAMPLE_RATE", 0.01)) > 0
+SLOW_QUERY_MS = float(read_secret("SLOW_QUERY_MS", 250))
+SLOW_QUERY_LOG = read_secret("SLOW_QUERY_LOG", "slow_queries.log")
+
+_query_scope = contextvars.ContextVar("query_scope", default="background")
+_query_stats = {}  # (scope, statement) -> [count, total_ms, max_ms]
+_query_stats_lock = threading.Lock()
+_slow_queries = deque(maxlen=100)
+
+_SQL_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_SQL_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+@functools.lru_cache(maxsize=4096)
+def normalize_sql(statement: str) -> str:
+    """Spazi compattati, letterali -> ?, liste IN di lunghezza variabile -> (?...)."""
+    s = _SQL_LITERAL.sub("?", " ".join(statement.split()))
+    return _SQL_IN_LIST.sub("(?...)", s)
+
+def _redact_params(parameters, executemany):
+    if executemany:
+        return f"<{len(parameters)} righe>"
+    if isinstance(parameters, dict):
+        return {k: type(v).__name__ for k, v in parameters.items()}
+    return [type(v).__name__ for v in parameters or ()]
+
+def set_query_scope(scope: str):
+    """Attribuisce le query successive del thread corrente a `scope` (es. ruolo della pagina)."""
+    return _query_scope.set(scope)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_t0"] = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    t0 = conn.info.pop("query_t0", None)
+    if t0 is None:
+        return
+    t1 = time.perf_counter()
+    ms = (t1 - t0) * 1000
+    scope = _query_scope.get()
+    key = (scope, normalize_sql(statement))
+    add_span("sql", t0, t1, statement=key[1][:200])
+    if not QUERY_STATS_ENABLED:
+        return
+    with _query_stats_lock:
+        s = _query_stats.get(key)
+        if s is None:
+            _query_stats[key] = [1, ms, ms]
+        else:
+            s[0] += 1
+            s[1] += ms
+            if ms > s[2]:
+                s[2] = ms
+    if ms >= SLOW_QUERY_MS:
+        entry = {"at": datetime.now().isoformat(timespec="seconds"), "ms": round(ms, 1), "scope": scope,
+                 "statement": key[1], "params": _redact_params(parameters, executemany)}
+        _slow_queries.append(entry)
+        if SLOW_QUERY_LOG:
+            try:
+                with open(SLOW_QUERY_LOG, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            except OSError:
+                pass
+
+def instrument_engine(db_engine):
+    """Aggancia i listener a un engine (idempotente)."""
+    if not event.contains(db_engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(db_engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(db_engine, "after_cursor_execute", _after_cursor_execute)
+
+def get_query_stats(scope: str | None = None, top: int = 20, order: str = "total_ms") -> list[dict]:
+    """Top-N statement per `order` (total_ms, max_ms, count, avg_ms); scope=None somma tutti gli scope."""
+    with _query_stats_lock:
+        items = [(k, list(v)) for k, v in _query_stats.items()]
+    merged = {}
+    for (sc, stmt), (n, total, mx) in items:
+        if scope is not None and sc != scope:
+            continue
+        m = merged.setdefault(stmt, [0, 0.0, 0.0])
+        m[0] += n
+        m[1] += total
+        m[2] = max(m[2], mx)
+    rows = [{"statement": stmt, "count": n, "total_ms": round(total, 1), "avg_ms": round(total / n, 2),
+             "max_ms": round(mx, 1)} for stmt, (n, total, mx) in merged.items()]
+    rows.sort(key=lambda r: r[order], reverse=True)
+    return rows[:top]
+
+def get_query_scopes() -> list[dict]:
+    """Totali per scope (pagina/ruolo)."""
+    out = {}
+    with _query_stats_lock:
+        for (sc, _), (n, total, mx) in _query_stats.items():
+            o = out.setdefault(sc, {"scope": sc, "count": 0, "total_ms": 0.0, "max_ms": 0.0})
+            o["count"] += n
+            o["total_ms"] += total
+            o["max_ms"] = max(o["max_ms"], mx)
+    return sorted(({**o, "total_ms": round(o["total_ms"], 1), "max_ms": round(o["max_ms"], 1)}
+                   for o in out.values()), key=lambda o: o["total_ms"], reverse=True)
+
+def get_slow_queries() -> list[dict]:
+    return list(reversed(_slow_queries))
+
+def reset_query_stats():
+    with _query_stats_lock:
+        _query_stats.clear()
+    _slow_queries.clear()
+
+if QUERY_STATS_ENABLED or TRACING_ENABLED:
+    instrument_engine(engine)
+
+@event.listens_for(engine, "handle_error")
+def _count_sqlite_busy(ctx):
+    msg = str(ctx.original_exception)
+    if "locked" in msg or "busy" in msg:
+        SQLITE_BUSY.inc()
+
+HAS_FTS = False  # aggiornato da migrate_db()
+HAS_STUDENT_FTS = False  # idem, richiede il tokenizer trigram (SQLite >= 3.34)
+
+# Colonne di booking, condivise da SCHEMA e dalla ricostruzione della tabella in migrate_db.
+# Più recruiter ("linee") per azienda: lo slot è unico per (azienda, linea).
+BOOKING_COLUMNS = '''
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  event_id INTEGER NOT NULL,
+  company_id INTEGER NOT NULL,
+  lane INTEGER NOT NULL DEFAULT 1,
+  student TEXT NOT NULL,
+  slot TEXT NOT NULL,
+  cv_path TEXT,
+  cv_uploaded_at TEXT,
+  cv_digest TEXT,
+  cv TEXT,
+  matricola TEXT,
+  status TEXT DEFAULT 'active',
+  UNIQUE(event_id, company_id, lane, slot)
+'''
+
+SCHEMA = f'''
 CREATE TABLE IF NOT EXISTS event (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   name TEXT NOT NULL,
@@ -51,17 +209,7 @@ CREATE TABLE IF NOT EXISTS company_user (
   email TEXT NOT NULL UNIQUE,
   password TEXT NOT NULL
 );
-CREATE TABLE IF NOT EXISTS booking (
-  id INTEGER PRIMARY KEY AUTOINCREMENT,
-  event_id INTEGER NOT NULL,
-  company_id INTEGER NOT NULL,
-  student TEXT NOT NULL,
-  slot TEXT NOT NULL,
-  cv_path TEXT,
-  cv_uploaded_at TEXT,
-  matricola TEXT,
-  UNIQUE(event_id, company_id, slot)
-);
+CREATE TABLE IF NOT EXISTS booking ({BOOKING_COLUMNS});
 CREATE TABLE IF NOT EXISTS roundtable (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     event_id INTEGER NOT NULL,
@@ -113,8 +261,159 @@ CREATE TABLE IF NOT EXISTS student_matricola (
         student TEXT UNIQUE NOT NULL,
         matricola TEXT NOT NULL
 );
+CREATE TABLE IF NOT EXISTS email_outbox (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  event_id INTEGER,
+  recipient TEXT NOT NULL,
+  subject TEXT NOT NULL,
+  body TEXT NOT NULL,
+  kind TEXT NOT NULL,
+  dedup_key TEXT UNIQUE,
+  status TEXT NOT NULL DEFAULT 'pending',
+  attempts INTEGER NOT NULL DEFAULT 0,
+  next_attempt_at TEXT NOT NULL,
+  claim_token TEXT,
+  last_error TEXT,
+  created_at TEXT NOT NULL,
+  sent_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_email_outbox_due ON email_outbox (status, next_attempt_at);
+CREATE TABLE IF NOT EXISTS cv_blob (
+  digest TEXT PRIMARY KEY,
+  path TEXT NOT NULL,
+  size INTEGER NOT NULL,
+  refcount INTEGER NOT NULL DEFAULT 0,
+  created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cv_text (
+  digest TEXT PRIMARY KEY,
+  status TEXT NOT NULL DEFAULT 'pending',
+  body TEXT,
+  error TEXT,
+  extracted_at TEXT
+);
+CREATE TABLE IF NOT EXISTS cv_index_job (
+  booking_id INTEGER PRIMARY KEY,
+  digest TEXT NOT NULL,
+  created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS waitlist (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  event_id INTEGER NOT NULL,
+  company_id INTEGER NOT NULL,
+  student TEXT NOT NULL,
+  matricola TEXT,
+  status TEXT NOT NULL DEFAULT 'waiting',
+  created_at TEXT NOT NULL,
+  promoted_at TEXT,
+  booking_id INTEGER,
+  UNIQUE(event_id, company_id, student)
+);
+CREATE INDEX IF NOT EXISTS idx_waitlist_queue ON waitlist (event_id, company_id, status, id);
+CREATE TABLE IF NOT EXISTS booking_released (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  booking_id INTEGER NOT NULL,
+  event_id INTEGER NOT NULL,
+  company_id INTEGER NOT NULL,
+  student TEXT NOT NULL,
+  slot TEXT NOT NULL,
+  matricola TEXT,
+  reason TEXT NOT NULL,
+  replaced_by TEXT,
+  released_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS walkin_counter (
+  event_id INTEGER NOT NULL,
+  company_id INTEGER NOT NULL,
+  next_ticket INTEGER NOT NULL DEFAULT 0,
+  served_upto INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (event_id, company_id)
+);
+CREATE TABLE IF NOT EXISTS walkin_queue (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  event_id INTEGER NOT NULL,
+  company_id INTEGER NOT NULL,
+  student TEXT NOT NULL,
+  ticket INTEGER NOT NULL,
+  status TEXT NOT NULL DEFAULT 'waiting',
+  created_at TEXT NOT NULL,
+  called_at TEXT,
+  start_time TEXT,
+  end_time TEXT,
+  lane INTEGER,
+  UNIQUE(event_id, company_id, ticket)
+);
+CREATE INDEX IF NOT EXISTS idx_walkin_student ON walkin_queue (event_id, student, status);
+CREATE INDEX IF NOT EXISTS idx_walkin_company ON walkin_queue (event_id, company_id, status);
+CREATE INDEX IF NOT EXISTS idx_walkin_waiting ON walkin_queue (event_id, company_id, status, ticket);
+CREATE TABLE IF NOT EXISTS booking_preference (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  event_id INTEGER NOT NULL,
+  student TEXT NOT NULL,
+  company_id INTEGER NOT NULL,
+  rank INTEGER NOT NULL,
+  created_at TEXT NOT NULL,
+  UNIQUE(event_id, student, company_id)
+);
+CREATE TABLE IF NOT EXISTS worker_lease (
+  name TEXT PRIMARY KEY,
+  owner TEXT NOT NULL,
+  expires_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_notification_kind ON notification (event_id, kind, read_at);
+CREATE INDEX IF NOT EXISTS idx_notification_booking ON notification (event_id, company_id, student, slot_from, kind);
+CREATE TABLE IF NOT EXISTS booking_eta (
+  booking_id INTEGER PRIMARY KEY,
+  eta TEXT NOT NULL,
+  updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS interview_stats (
+  event_id INTEGER NOT NULL,
+  company_id INTEGER NOT NULL,
+  metric TEXT NOT NULL,
+  n INTEGER NOT NULL DEFAULT 0,
+  mean REAL NOT NULL DEFAULT 0,
+  m2 REAL NOT NULL DEFAULT 0,
+  hist TEXT NOT NULL,
+  updated_at TEXT,
+  PRIMARY KEY (event_id, company_id, metric)
+);
 '''
 
+# Indici full-text: richiedono SQLite con FTS5, quindi sono opzionali (vedi migrate_db)
+FTS_SCHEMA = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS cv_fts USING fts5(
+  scope,
+  body,
+  tokenize = 'unicode61 remove_diacritics 2',
+  prefix = '2 3'
+);
+'''
+
+# Indice trigram sugli studenti (ricerca admin per sottostringa), tenuto allineato
+# da trigger. Lista di statement: i corpi dei trigger contengono ';'.
+STUDENT_FTS_SCHEMA = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS student_fts USING fts5(
+         givenName, sn, email, matricola,
+         content = 'student', content_rowid = 'id',
+         tokenize = 'trigram'
+       )""",
+    """CREATE TRIGGER IF NOT EXISTS student_fts_ai AFTER INSERT ON student BEGIN
+         INSERT INTO student_fts (rowid, givenName, sn, email, matricola)
+         VALUES (new.id, new.givenName, new.sn, new.email, new.matricola);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS student_fts_ad AFTER DELETE ON student BEGIN
+         INSERT INTO student_fts (student_fts, rowid, givenName, sn, email, matricola)
+         VALUES ('delete', old.id, old.givenName, old.sn, old.email, old.matricola);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS student_fts_au AFTER UPDATE ON student BEGIN
+         INSERT INTO student_fts (student_fts, rowid, givenName, sn, email, matricola)
+         VALUES ('delete', old.id, old.givenName, old.sn, old.email, old.matricola);
+         INSERT INTO student_fts (rowid, givenName, sn, email, matricola)
+         VALUES (new.id, new.givenName, new.sn, new.email, new.matricola);
+       END""",
+]
+
 SEED = [
     ("INSERT OR IGNORE INTO event (id, name, is_active) VALUES (1, 'Industrial Engineering Day', 1)", {}),
     ("INSERT OR IGNORE INTO company (name) VALUES ('BLM Group')", {}),
@@ -151,8 +450,9 @@ SEED = [
 ]
 
 # ------------------- DB bootstrap -------------------
-def init_db():
-    with engine.begin() as conn:
+@traced()
+def init_db(db_engine=None):
+    with (db_engine or engine).begin() as conn:
         for stmt in SCHEMA.split(';'):
             s = stmt.strip()
             if s:
@@ -160,8 +460,31 @@ def init_db():
         for q, p in SEED:
             conn.execute(text(q), p)
 
-def migrate_db():
-    with engine.begin() as conn:
+def _rebuild_booking_with_lanes(conn):
+    """
+    Le tabelle booking create prima delle linee hanno UNIQUE(event_id, company_id, slot),
+    che SQLite non permette di modificare: ricreo la tabella con lo schema attuale
+    conservando id (e quindi interview_log, cv_fts) e il contatore AUTOINCREMENT.
+    """
+    cols = [r["name"] for r in conn.execute(text("PRAGMA table_info(booking)")).mappings()]
+    if "lane" in cols:
+        return
+    seq = conn.execute(text("SELECT seq FROM sqlite_sequence WHERE name = 'booking'")).scalar() or 0
+    conn.execute(text(f"CREATE TABLE booking_new ({BOOKING_COLUMNS})"))
+    new_cols = [r["name"] for r in conn.execute(text("PRAGMA table_info(booking_new)")).mappings()]
+    common = ", ".join(c for c in cols if c in new_cols)
+    conn.execute(text(f"INSERT INTO booking_new ({common}) SELECT {common} FROM booking"))
+    conn.execute(text("DROP TABLE booking"))
+    conn.execute(text("ALTER TABLE booking_new RENAME TO booking"))
+    conn.execute(text("DELETE FROM sqlite_sequence WHERE name IN ('booking', 'booking_new')"))
+    conn.execute(
+        text("INSERT INTO sqlite_sequence (name, seq) VALUES ('booking', MAX(:seq, (SELECT COALESCE(MAX(id), 0) FROM booking)))"),
+        {"seq": seq}
+    )
+
+@traced()
+def migrate_db(db_engine=None):
+    with (db_engine or engine).begin() as conn:
         try:
             conn.execute(text("ALTER TABLE booking ADD COLUMN cv_path TEXT"))
         except Exception:
@@ -170,6 +493,76 @@ def migrate_db():
             conn.execute(text("ALTER TABLE booking ADD COLUMN cv_uploaded_at TEXT"))
         except Exception:
             pass
+        try:
+            conn.execute(text("ALTER TABLE booking ADD COLUMN cv_digest TEXT"))
+        except Exception:
+            pass
+        try:
+            conn.execute(text("ALTER TABLE booking ADD COLUMN status TEXT DEFAULT 'active'"))
+        except Exception:
+            pass
+        # modalità di prenotazione: 'fcfs' (libera) o 'preferences' (finestra preferenze + scheduler.py)
+        try:
+            conn.execute(text("ALTER TABLE event ADD COLUMN booking_mode TEXT DEFAULT 'fcfs'"))
+        except Exception:
+            pass
+        try:
+            conn.execute(text("ALTER TABLE event ADD COLUMN preferences_close_at TEXT"))
+        except Exception:
+            pass
+        # calendario degli slot spostato dall'admin (JSON), NULL = generate_slots()
+        try:
+            conn.execute(text("ALTER TABLE event ADD COLUMN slots TEXT"))
+        except Exception:
+            pass
+        try:
+            conn.execute(text("ALTER TABLE event_company ADD COLUMN capacity INTEGER"))
+        except Exception:
+            pass
+        try:
+            conn.execute(text("ALTER TABLE event_company ADD COLUMN lanes INTEGER NOT NULL DEFAULT 1"))
+        except Exception:
+            pass
+        try:
+            conn.execute(text("ALTER TABLE walkin_queue ADD COLUMN lane INTEGER"))
+        except Exception:
+            pass
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS idx_walkin_waiting ON walkin_queue (event_id, company_id, status, ticket)"
+        ))
+        _rebuild_booking_with_lanes(conn)
+        conn.execute(text("""
+            CREATE UNIQUE INDEX IF NOT EXISTS unique_booking
+            ON booking (event_id, company_id, student, slot)
+        """))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS idx_booking_cv_digest ON booking (cv_digest)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS idx_booking_student ON booking (event_id, student)"))
+        if conn.execute(text("SELECT 1 FROM interview_stats LIMIT 1")).first() is None:
+            # colloqui registrati prima delle statistiche incrementali
+            rebuild_interview_stats(conn)
+
+    global HAS_FTS, HAS_STUDENT_FTS
+    try:
+        with (db_engine or engine).begin() as conn:
+            for stmt in FTS_SCHEMA.split(';'):
+                if stmt.strip():
+                    conn.execute(text(stmt))
+        HAS_FTS = True
+    except Exception:
+        HAS_FTS = False
+    try:
+        with (db_engine or engine).begin() as conn:
+            is_new = conn.execute(
+                text("SELECT 1 FROM sqlite_master WHERE name = 'student_fts'")
+            ).first() is None
+            for stmt in STUDENT_FTS_SCHEMA:
+                conn.execute(text(stmt))
+            if is_new:
+                # studenti registrati prima dell'indice
+                conn.execute(text("INSERT INTO student_fts (student_fts) VALUES ('rebuild')"))
+        HAS_STUDENT_FTS = True
+    except Exception:
+        HAS_STUDENT_FTS = False
 
 def ensure_dirs():
     os.makedirs(CV_DIR, exist_ok=True)
@@ -190,6 +583,21 @@ def get_companies(conn, event_id):
     """)
     return list(conn.execute(q, {"e": event_id}).mappings())
 
+# Capacità delle round table per nome (non per ID); se ne prenota al massimo la metà
+ROUNDTABLE_CAPACITY = {
+    "Round Table 1": 140,
+    "Round Table 2": 140,
+    "Round Table 3": 73,
+    "Round Table 4": 130,
+    "Round Table 5": 113,
+    "Round Table 6": 68,
+}
+ROUNDTABLE_DEFAULT_CAPACITY = 100
+ROUNDTABLE_BOOKABLE_SHARE = 0.5
+
+def roundtable_capacity(name) -> int:
+    return ROUNDTABLE_CAPACITY.get(name, ROUNDTABLE_DEFAULT_CAPACITY)
+
 def get_roundtables(conn, event_id):
     q = text("""
         SELECT 
@@ -207,6 +615,7 @@ def get_roundtables(conn, event_id):
     """)
     return list(conn.execute(q, {"e": event_id}).mappings())
 
+@traced()
 def book_roundtable(conn, event_id, roundtable_id, student, matricola=None):
     conn.execute(
         text("""
@@ -252,20 +661,22 @@ def toggle_checkin(conn, event_id, student):
     else:
         conn.execute(
             text("INSERT INTO checkin (event_id, student, created_at) VALUES (:e,:s,:t)"),
-            {"e": event_id, "s": student, "t": datetime.utcnow().isoformat()}
+            {"e": event_id, "s": student, "t": clock.utcnow().isoformat()}
         )
         return True
 
 # Booking
-def generate_slots(step=15):
+DEFAULT_SLOT_RANGES = [("11:30", "13:00"), ("14:30", "16:30")]
+
+def generate_slots(step=15, ranges=None):
     """
     Genera slot di colloqui a scaglioni di 15 minuti
-    negli intervalli:
+    negli intervalli (default):
       - 11:30 → 13:00
       - 14:30 → 16:30
     """
     slots = []
-    ranges = [("11:30", "13:00"), ("14:30", "16:30")]
+    ranges = ranges or DEFAULT_SLOT_RANGES
 
     for start, end in ranges:
         start_dt = datetime.strptime(start, "%H:%M")
@@ -276,12 +687,62 @@ def generate_slots(step=15):
 
     return slots
 
+@traced()
+def get_event_slots(conn, event_id) -> list:
+    """Calendario dell'evento: quello salvato (es. dopo uno spostamento) o generate_slots()."""
+    raw = conn.execute(text("SELECT slots FROM event WHERE id = :e"), {"e": event_id}).scalar()
+    return json.loads(raw) if raw else generate_slots()
+
+def set_event_slots(conn, event_id, slots):
+    conn.execute(text("UPDATE event SET slots = :s WHERE id = :e"), {"s": json.dumps(sorted(slots)), "e": event_id})
+
+def get_company_lanes(conn, event_id, company_id) -> int:
+    """Colloqui in parallelo (recruiter) dell'azienda all'evento."""
+    n = conn.execute(
+        text("SELECT lanes FROM event_company WHERE event_id = :e AND company_id = :c"),
+        {"e": event_id, "c": company_id}
+    ).scalar()
+    return max(int(n or 1), 1)
+
+def set_company_lanes(conn, event_id, company_id, lanes: int):
+    """Cambia il numero di linee; non si può scendere sotto una linea che ha già prenotazioni."""
+    lanes = int(lanes)
+    used = conn.execute(
+        text("SELECT COALESCE(MAX(lane), 0) FROM booking WHERE event_id = :e AND company_id = :c"),
+        {"e": event_id, "c": company_id}
+    ).scalar()
+    if lanes < max(used, 1):
+        raise ValueError(f"La linea {used} ha già delle prenotazioni: servono almeno {used} linee.")
+    conn.execute(
+        text("UPDATE event_company SET lanes = :n WHERE event_id = :e AND company_id = :c"),
+        {"n": lanes, "e": event_id, "c": company_id}
+    )
+
+def free_lane(conn, event_id, company_id, slot) -> int | None:
+    """Prima linea libera dell'azienda nello slot, None se lo slot è pieno."""
+    lanes = get_company_lanes(conn, event_id, company_id)
+    used = {r[0] for r in conn.execute(
+        text("SELECT lane FROM booking WHERE event_id = :e AND company_id = :c AND slot = :s"),
+        {"e": event_id, "c": company_id, "s": slot}
+    )}
+    return next((l for l in range(1, lanes + 1) if l not in used), None)
+
+@traced()
+def get_full_slots(conn, event_id, company_id) -> set:
+    """Slot in cui tutte le linee dell'azienda sono occupate."""
+    lanes = get_company_lanes(conn, event_id, company_id)
+    return {r[0] for r in conn.execute(
+        text("""SELECT slot FROM booking WHERE event_id = :e AND company_id = :c
+                GROUP BY slot HAVING COUNT(*) >= :n"""),
+        {"e": event_id, "c": company_id, "n": lanes}
+    )}
+
 def get_bookings(conn, event_id, company_id):
-    q = text("SELECT id, slot, student, cv_path FROM booking WHERE event_id=:e AND company_id=:c")
+    q = text("SELECT id, slot, lane, student, cv_path FROM booking WHERE event_id=:e AND company_id=:c")
     return list(conn.execute(q, {"e": event_id, "c": company_id}).mappings())
 
 def get_booking_by_id(conn, booking_id):
-    q = text("SELECT id, event_id, company_id, student, slot, cv_path FROM booking WHERE id=:id")
+    q = text("SELECT id, event_id, company_id, lane, student, slot, cv_path FROM booking WHERE id=:id")
     return conn.execute(q, {"id": booking_id}).mappings().first()
 
 def sanitize_filename(s: str) -> str:
@@ -297,14 +758,180 @@ def build_cv_filename(event_id: int, company_id: int, student: str, slot: str, o
     ts = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
     return os.path.join(CV_DIR, f"{base}_{ts}{ext}")
 
-def save_cv_file(file_uploader, event_id: int, company_id: int, student: str, slot: str) -> str | None:
+# ------------------- CV store (content-addressed) -------------------
+# Ogni PDF è salvato una sola volta in CV_DIR/blobs/<aa>/<sha256>.pdf;
+# `cv_blob.refcount` conta le prenotazioni che lo usano.
+CV_CHUNK = 64 * 1024
+CV_BLOB_GRACE_SECONDS = 3600  # un blob appena caricato non è ancora "orfano"
+
+def _blob_dir(base_dir=None) -> str:
+    return os.path.join(base_dir or CV_DIR, "blobs")
+
+def store_cv_blob(conn, fileobj, base_dir=None) -> tuple[str, str, int]:
+    """
+    Copia `fileobj` nello store a blocchi calcolando l'hash durante la scrittura.
+    Se il contenuto esiste già il file temporaneo viene scartato.
+    Restituisce (digest, path, size); il refcount lo incrementa chi crea la prenotazione.
+    """
+    blobs = _blob_dir(base_dir)
+    os.makedirs(blobs, exist_ok=True)
+    h = hashlib.sha256()
+    size = 0
+    fd, tmp = tempfile.mkstemp(dir=blobs, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            if hasattr(fileobj, "seek"):
+                fileobj.seek(0)
+            while True:
+                chunk = fileobj.read(CV_CHUNK)
+                if not chunk:
+                    break
+                h.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+        digest = h.hexdigest()
+        path = os.path.join(blobs, digest[:2], f"{digest}.pdf")
+        try:
+            os.utime(path)  # contenuto già presente: rinfrescato, gc_cv_blobs non tocca i file recenti
+            os.remove(tmp)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+    conn.execute(
+        text("""INSERT INTO cv_blob (digest, path, size, refcount, created_at)
+                VALUES (:d, :p, :s, 0, :t)
+                ON CONFLICT(digest) DO NOTHING"""),
+        {"d": digest, "p": path, "s": size, "t": datetime.utcnow().isoformat()}
+    )
+    return digest, path, size
+
+def release_cv_blobs(conn, digests):
+    """Decrementa il refcount dei blob (es. prenotazioni cancellate). I file li toglie gc_cv_blobs."""
+    digests = [d for d in digests if d]
+    if digests:
+        conn.execute(
+            text("UPDATE cv_blob SET refcount = MAX(refcount - 1, 0) WHERE digest = :d"),
+            [{"d": d} for d in digests]
+        )
+
+def gc_cv_blobs(db_engine=None, base_dir=None, dry_run=False) -> dict:
+    """
+    Rimuove i blob non più referenziati (refcount 0, nessuna prenotazione, più vecchi
+    di CV_BLOB_GRACE_SECONDS), i PDF dello store senza riga in cv_blob (caricati per una
+    prenotazione poi fallita) e i .part rimasti da upload interrotti.
+    I file si cancellano solo dopo il commit del DELETE, e solo se nel frattempo nessun
+    upload li ha ripresi (riga di nuovo presente o file rinfrescato da store_cv_blob).
+    """
+    db_engine = db_engine or engine
+    blobs = _blob_dir(base_dir)
+    cutoff_ts = time.time() - CV_BLOB_GRACE_SECONDS
+    cutoff = (datetime.utcnow() - timedelta(seconds=CV_BLOB_GRACE_SECONDS)).isoformat()
+
+    with db_engine.begin() as conn:
+        dead = list(conn.execute(
+            text("""SELECT digest, path, size FROM cv_blob cb
+                    WHERE refcount <= 0 AND created_at < :cutoff
+                      AND NOT EXISTS (SELECT 1 FROM booking b WHERE b.cv_digest = cb.digest)"""),
+            {"cutoff": cutoff}
+        ).mappings())
+        if dead and not dry_run:
+            conn.execute(
+                text("""DELETE FROM cv_blob WHERE digest = :d AND refcount <= 0
+                          AND NOT EXISTS (SELECT 1 FROM booking b WHERE b.cv_digest = cv_blob.digest)"""),
+                [{"d": b["digest"]} for b in dead]
+            )
+        known = {r[0] for r in conn.execute(text("SELECT digest FROM cv_blob"))}
+        if not dry_run:
+            dead = [b for b in dead if b["digest"] not in known]  # referenziati nel frattempo: restano
+
+    dead_digests = {b["digest"] for b in dead}
+    orphans = []
+    for path in glob.glob(os.path.join(blobs, "??", "*.pdf")):
+        digest = os.path.basename(path)[:-len(".pdf")]
+        if digest not in known and digest not in dead_digests and os.path.getmtime(path) < cutoff_ts:
+            orphans.append({"digest": digest, "path": path, "size": os.path.getsize(path)})
+
+    removed = []
+    if dry_run:
+        removed = dead + orphans
+    elif dead or orphans:
+        with db_engine.connect() as conn:
+            revived = {r[0] for r in conn.execute(
+                text("SELECT digest FROM cv_blob WHERE digest IN :d").bindparams(bindparam("d", expanding=True)),
+                {"d": [b["digest"] for b in dead + orphans]}
+            )}
+        for b in dead + orphans:
+            if b["digest"] in revived:
+                continue
+            try:
+                if os.path.getmtime(b["path"]) >= cutoff_ts:
+                    continue  # ripreso da un upload appena ora
+                os.remove(b["path"])
+            except FileNotFoundError:
+                pass
+            removed.append(b)
+    n_orphans = sum(1 for b in removed if b["digest"] not in dead_digests)
+
+    stale_parts = 0
+    for part in glob.glob(os.path.join(blobs, "*.part")):
+        if os.path.getmtime(part) < cutoff_ts:
+            stale_parts += 1
+            if not dry_run:
+                os.remove(part)
+
+    return {"blobs": len(removed) - n_orphans, "orphans": n_orphans,
+            "bytes": sum(b["size"] for b in removed), "stale_parts": stale_parts}
+
+def cv_scope(event_id, company_id) -> str:
+    """Token che limita la ricerca full-text ai CV di un'azienda in un evento."""
+    return f"e{int(event_id)}c{int(company_id)}"
+
+def _fts_query(user_query: str) -> str:
+    """'MATLAB python' -> '"matlab"* AND "python"*' (niente sintassi FTS5 dall'utente)."""
+    terms = re.findall(r"[\w+#.-]+", user_query.lower())
+    return " AND ".join(f'"{t.strip(".")}"*' for t in terms if t.strip("."))
+
+@traced()
+def search_cvs(conn, event_id, company_id, user_query: str, limit: int = 20):
+    """CV dell'azienda che contengono tutti i termini, ordinati per rilevanza (bm25)."""
+    terms = _fts_query(user_query)
+    if not terms or not HAS_FTS:
+        return []
+    q = text("""
+        SELECT b.id, b.slot, b.student, b.cv_path,
+               snippet(cv_fts, 1, '**', '**', '…', 12) AS snippet,
+               cv_fts.rank AS score
+        FROM cv_fts
+        JOIN booking b ON b.id = cv_fts.rowid
+        WHERE cv_fts MATCH :m
+        ORDER BY cv_fts.rank
+        LIMIT :n
+    """)
+    # termini limitati a body: "e1" non deve combaciare col token di scope di tutti i CV
+    m = f'scope : "{cv_scope(event_id, company_id)}" AND body : ({terms})'
+    return list(conn.execute(q, {"m": m, "n": limit}).mappings())
+
+def unindex_cv_bookings(conn, booking_ids):
+    booking_ids = [int(b) for b in booking_ids]
+    if not booking_ids:
+        return
+    conn.execute(text("DELETE FROM cv_index_job WHERE booking_id = :b"), [{"b": b} for b in booking_ids])
+    if HAS_FTS:
+        conn.execute(text("DELETE FROM cv_fts WHERE rowid = :b"), [{"b": b} for b in booking_ids])
+
+@traced()
+def save_cv_file(conn, file_uploader) -> tuple[str | None, str | None]:
+    """Salva il CV caricato nello store; restituisce (path, digest) oppure (None, None)."""
     if not file_uploader:
-        return None
+        return None, None
     ensure_dirs()
-    fname = build_cv_filename(event_id, company_id, student, slot, file_uploader.name)
-    with open(fname, "wb") as f:
-        f.write(file_uploader.getbuffer())
-    return fname
+    digest, path, _ = store_cv_blob(conn, file_uploader)
+    return path, digest
 
 def _neighbor_slots(slot: str, step: int = 15) -> tuple[str, str]:
     """Return (prev_slot, next_slot) around `slot` with the given step (HH:MM)."""
@@ -313,7 +940,8 @@ def _neighbor_slots(slot: str, step: int = 15) -> tuple[str, str]:
     next_s = (dt + timedelta(minutes=step)).strftime("%H:%M")
     return prev_s, next_s
 
-def book_slot(conn, event_id, company_id, student, slot, cv, matricola=None):
+@traced()
+def book_slot(conn, event_id, company_id, student, slot, cv, matricola=None, cv_digest=None):
     # --- Block same or adjacent slots for this student across ALL companies ---
     prev_s, next_s = _neighbor_slots(slot, step=15)
     conflict = conn.execute(
@@ -327,48 +955,147 @@ def book_slot(conn, event_id, company_id, student, slot, cv, matricola=None):
     ).first()
 
     if conflict:
+        BOOKING_REJECTS.inc(reason="adjacent")
         raise ValueError(
             f"You already have a booking at or adjacent to {slot}. "
             "Please choose a time at least 30 minutes away."
         )
 
+    lane = free_lane(conn, event_id, company_id, slot)
+    if lane is None:
+        BOOKING_REJECTS.inc(reason="slot_full")
+        raise ValueError(f"The {slot} slot is no longer available. Please choose another time.")
+
     # --- Proceed with normal insert ---
-    conn.execute(
+    res = conn.execute(
         text("""
-            INSERT INTO booking (event_id, company_id, student, slot, cv_path, status, matricola)
-            VALUES (:event_id, :company_id, :student, :slot, :cv_path, 'manual', :matricola)
+            INSERT INTO booking (event_id, company_id, lane, student, slot, cv_path, cv_digest,
+                                 cv_uploaded_at, status, matricola)
+            VALUES (:event_id, :company_id, :lane, :student, :slot, :cv_path, :cv_digest,
+                    :cv_uploaded_at, 'manual', :matricola)
             ON CONFLICT(event_id, company_id, student, slot) DO NOTHING
         """),
         {
             "event_id": event_id,
             "company_id": company_id,
+            "lane": lane,
             "student": student,
             "slot": slot,
             "cv_path": cv,
+            "cv_digest": cv_digest,
+            "cv_uploaded_at": clock.utcnow().isoformat() if cv_digest else None,
             "matricola": matricola
         }
     )
+    if res.rowcount:
+        BOOKINGS.inc(source="manual")
+    if cv_digest and res.rowcount:
+        conn.execute(
+            text("UPDATE cv_blob SET refcount = refcount + 1 WHERE digest = :d"),
+            {"d": cv_digest}
+        )
+        # estrazione testo + indicizzazione in background (cv_index.py)
+        conn.execute(
+            text("""INSERT OR REPLACE INTO cv_index_job (booking_id, digest, created_at)
+                    VALUES (:b, :d, :t)"""),
+            {"b": res.lastrowid, "d": cv_digest, "t": clock.utcnow().isoformat()}
+        )
+
+
+# ------------------- Preferenze (modalità 'preferences') -------------------
+PREF_MAX_RANKED = 8
 
+def get_booking_settings(conn, event_id) -> dict:
+    row = conn.execute(
+        text("SELECT booking_mode, preferences_close_at FROM event WHERE id = :e"),
+        {"e": event_id}
+    ).mappings().first()
+    mode = (row and row["booking_mode"]) or "fcfs"
+    close_at = row["preferences_close_at"] if row else None
+    window_open = mode == "preferences" and (
+        not close_at or clock.now().isoformat(timespec="minutes") < close_at
+    )
+    return {"mode": mode, "close_at": close_at, "window_open": window_open}
+
+def set_booking_mode(conn, event_id, mode: str, close_at: str | None = None):
+    if mode not in ("fcfs", "preferences"):
+        raise ValueError(f"Modalità non valida: {mode}")
+    conn.execute(
+        text("UPDATE event SET booking_mode = :m, preferences_close_at = :c WHERE id = :e"),
+        {"m": mode, "c": close_at, "e": event_id}
+    )
 
+def get_preferences(conn, event_id, student):
+    q = text("""
+        SELECT p.company_id, c.name AS company, p.rank
+        FROM booking_preference p
+        JOIN company c ON c.id = p.company_id
+        WHERE p.event_id = :e AND p.student = :s
+        ORDER BY p.rank
+    """)
+    return list(conn.execute(q, {"e": event_id, "s": student}).mappings())
+
+def save_preferences(conn, event_id, student, company_ids):
+    """Sostituisce la lista ordinata di aziende dello studente (la prima è la preferita)."""
+    company_ids = list(dict.fromkeys(int(c) for c in company_ids))[:PREF_MAX_RANKED]
+    conn.execute(
+        text("DELETE FROM booking_preference WHERE event_id = :e AND student = :s"),
+        {"e": event_id, "s": student}
+    )
+    if company_ids:
+        now = clock.utcnow().isoformat()
+        conn.execute(
+            text("""INSERT INTO booking_preference (event_id, student, company_id, rank, created_at)
+                    VALUES (:e, :s, :c, :r, :t)"""),
+            [{"e": event_id, "s": student, "c": c, "r": i + 1, "t": now} for i, c in enumerate(company_ids)]
+        )
+
+@traced()
 def get_student_bookings(conn, event_id, student):
     q = text("""
-        SELECT b.slot, b.company_id, c.name AS company
+        SELECT b.slot, b.company_id, c.name AS company,
+               CASE WHEN COALESCE(il.status, 'pending') = 'pending' THEN be.eta END AS eta
         FROM booking b
         JOIN company c ON c.id = b.company_id
+        LEFT JOIN interview_log il ON il.booking_id = b.id
+        LEFT JOIN booking_eta be ON be.booking_id = b.id
         WHERE b.event_id = :e AND b.student = :s
         ORDER BY b.slot
     """)
     return list(conn.execute(q, {"e": event_id, "s": student}).mappings())
 
+# Email outbox (spedite in background da mailer.py)
+@traced()
+def enqueue_email(conn, recipient, subject, body, kind, event_id=None, dedup_key=None):
+    """
+    Accoda una mail nella stessa transazione di `conn`.
+    Con `dedup_key` la stessa mail non viene accodata due volte.
+    """
+    now_iso = clock.utcnow().isoformat()
+    conn.execute(
+        text("""INSERT INTO email_outbox
+                (event_id, recipient, subject, body, kind, dedup_key, next_attempt_at, created_at)
+                VALUES (:e,:r,:subj,:body,:k,:d,:t,:t)
+                ON CONFLICT(dedup_key) DO NOTHING"""),
+        {"e": event_id, "r": recipient.lower().strip(), "subj": subject, "body": body,
+         "k": kind, "d": dedup_key, "t": now_iso}
+    )
+
+def get_outbox_counts(conn):
+    q = text("SELECT status, COUNT(*) AS n FROM email_outbox GROUP BY status")
+    return {r["status"]: r["n"] for r in conn.execute(q).mappings()}
+
 # Notifications
 def add_notification(conn, event_id, company_id, student, slot_from, kind, message):
     conn.execute(
         text("""INSERT INTO notification (event_id, company_id, student, slot_from, kind, message, created_at)
                 VALUES (:e,:c,:s,:slot,:k,:m,:t)"""),
         {"e": event_id, "c": company_id, "s": student, "slot": slot_from,
-         "k": kind, "m": message, "t": datetime.utcnow().isoformat()}
+         "k": kind, "m": message, "t": clock.utcnow().isoformat()}
     )
+    NOTIFICATIONS.inc(kind=kind)
 
+@traced()
 def get_unread_notifications(conn, event_id, student):
     q = text("""SELECT id, company_id, slot_from, kind, message, created_at
                 FROM notification
@@ -378,11 +1105,342 @@ def get_unread_notifications(conn, event_id, student):
 
 def mark_notification_read(conn, notif_id):
     conn.execute(text("UPDATE notification SET read_at=:t WHERE id=:id"),
-                 {"t": datetime.utcnow().isoformat(), "id": notif_id})
+                 {"t": clock.utcnow().isoformat(), "id": notif_id})
+
+# ------------------- Lista d'attesa -------------------
+def join_waitlist(conn, event_id, company_id, student, matricola=None) -> int | None:
+    """
+    Mette lo studente in coda per l'azienda (in fondo se rientra); restituisce la posizione,
+    oppure None se ha già un colloquio con l'azienda.
+    """
+    if conn.execute(
+        text("SELECT 1 FROM booking WHERE event_id = :e AND company_id = :c AND student = :s LIMIT 1"),
+        {"e": event_id, "c": company_id, "s": student}
+    ).first():
+        return None
+    conn.execute(
+        text("""DELETE FROM waitlist
+                WHERE event_id = :e AND company_id = :c AND student = :s AND status != 'waiting'"""),
+        {"e": event_id, "c": company_id, "s": student}
+    )
+    conn.execute(
+        text("""INSERT INTO waitlist (event_id, company_id, student, matricola, created_at)
+                VALUES (:e, :c, :s, :m, :t)
+                ON CONFLICT(event_id, company_id, student) DO NOTHING"""),
+        {"e": event_id, "c": company_id, "s": student, "m": matricola, "t": clock.utcnow().isoformat()}
+    )
+    return waitlist_position(conn, event_id, company_id, student)
+
+def leave_waitlist(conn, event_id, company_id, student):
+    conn.execute(
+        text("""UPDATE waitlist SET status = 'left'
+                WHERE event_id = :e AND company_id = :c AND student = :s AND status = 'waiting'"""),
+        {"e": event_id, "c": company_id, "s": student}
+    )
+
+def waitlist_position(conn, event_id, company_id, student) -> int | None:
+    return conn.execute(
+        text("""SELECT (SELECT COUNT(*) FROM waitlist w2
+                        WHERE w2.event_id = w.event_id AND w2.company_id = w.company_id
+                          AND w2.status = 'waiting' AND w2.id <= w.id)
+                FROM waitlist w
+                WHERE w.event_id = :e AND w.company_id = :c AND w.student = :s AND w.status = 'waiting'"""),
+        {"e": event_id, "c": company_id, "s": student}
+    ).scalar()
+
+def waitlist_length(conn, event_id, company_id) -> int:
+    return conn.execute(
+        text("SELECT COUNT(*) FROM waitlist WHERE event_id = :e AND company_id = :c AND status = 'waiting'"),
+        {"e": event_id, "c": company_id}
+    ).scalar()
+
+def get_student_waitlists(conn, event_id, student):
+    q = text("""
+        SELECT w.company_id, c.name AS company,
+               (SELECT COUNT(*) FROM waitlist w2
+                WHERE w2.event_id = w.event_id AND w2.company_id = w.company_id
+                  AND w2.status = 'waiting' AND w2.id <= w.id) AS position
+        FROM waitlist w
+        JOIN company c ON c.id = w.company_id
+        WHERE w.event_id = :e AND w.student = :s AND w.status = 'waiting'
+        ORDER BY c.name
+    """)
+    return list(conn.execute(q, {"e": event_id, "s": student}).mappings())
+
+def _waitlist_candidate(conn, event_id, company_id, slot):
+    """Primo in coda idoneo allo slot: nessun colloquio con l'azienda né nello slot o in quelli adiacenti."""
+    prev_s, next_s = _neighbor_slots(slot, step=15)
+    return conn.execute(
+        text("""
+            SELECT w.id, w.student, w.matricola
+            FROM waitlist w
+            WHERE w.event_id = :e AND w.company_id = :c AND w.status = 'waiting'
+              AND NOT EXISTS (
+                  SELECT 1 FROM booking b
+                  WHERE b.event_id = :e AND b.student = w.student
+                    AND (b.company_id = :c OR b.slot IN (:slot, :prev_s, :next_s))
+              )
+            ORDER BY w.id
+            LIMIT 1
+        """),
+        {"e": event_id, "c": company_id, "slot": slot, "prev_s": prev_s, "next_s": next_s}
+    ).mappings().first()
+
+def _promote(conn, event_id, company_id, slot, cand) -> str | None:
+    lane = free_lane(conn, event_id, company_id, slot)
+    if lane is None:
+        return None
+    res = conn.execute(
+        text("""
+            INSERT INTO booking (event_id, company_id, lane, student, slot, status, matricola)
+            VALUES (:e, :c, :lane, :s, :slot, 'waitlist', :m)
+            ON CONFLICT DO NOTHING
+        """),
+        {"e": event_id, "c": company_id, "lane": lane, "s": cand["student"], "slot": slot,
+         "m": cand["matricola"]}
+    )
+    if not res.rowcount:
+        return None  # slot ripreso nel frattempo
+    conn.execute(
+        text("""UPDATE waitlist SET status = 'promoted', promoted_at = :t, booking_id = :b
+                WHERE id = :id"""),
+        {"t": clock.utcnow().isoformat(), "b": res.lastrowid, "id": cand["id"]}
+    )
+    company = conn.execute(text("SELECT name FROM company WHERE id = :c"), {"c": company_id}).scalar()
+    add_notification(
+        conn, event_id, company_id, cand["student"], slot, "waitlist_promoted",
+        f"A slot opened up: you are now booked with {company} at {slot}."
+    )
+    return cand["student"]
+
+def promote_from_waitlist(conn, event_id, company_id, slot) -> str | None:
+    """
+    Assegna uno slot appena liberato al primo studente idoneo in lista d'attesa e lo notifica.
+    Una sola query indicizzata per slot: chi non è idoneo viene saltato dentro SQLite,
+    quindi anche molte cancellazioni di fila non riscandiscono la coda.
+    Va chiamata nella transazione che ha liberato lo slot. Restituisce lo studente promosso.
+    """
+    cand = _waitlist_candidate(conn, event_id, company_id, slot)
+    return _promote(conn, event_id, company_id, slot, cand) if cand else None
+
+def release_booking(conn, booking_id, reason: str, within_slot: bool = True) -> str | None:
+    """
+    Cede lo slot di una prenotazione annullata / no-show al primo in lista d'attesa.
+    Se nessuno può subentrare la prenotazione resta com'è; altrimenti viene archiviata in
+    booking_released. Con within_slot=True si riassegna solo finché lo slot non è finito:
+    annulli e no-show arrivano quasi sempre a slot iniziato, e chi subentra fa ancora in tempo.
+    """
+    b = conn.execute(
+        text("SELECT id, event_id, company_id, student, slot, matricola, cv_digest FROM booking WHERE id = :id"),
+        {"id": booking_id}
+    ).mappings().first()
+    if not b:
+        return None
+    slot_end = (datetime.strptime(b["slot"], "%H:%M") + timedelta(minutes=15)).strftime("%H:%M")
+    if within_slot and slot_end <= clock.now().strftime("%H:%M"):
+        return None
+    cand = _waitlist_candidate(conn, b["event_id"], b["company_id"], b["slot"])
+    if not cand:
+        return None
+
+    conn.execute(text("DELETE FROM booking WHERE id = :id"), {"id": booking_id})
+    conn.execute(
+        text("""INSERT INTO booking_released (booking_id, event_id, company_id, student, slot, matricola,
+                                              reason, replaced_by, released_at)
+                VALUES (:b, :e, :c, :s, :slot, :m, :r, :p, :t)"""),
+        {"b": booking_id, "e": b["event_id"], "c": b["company_id"], "s": b["student"], "slot": b["slot"],
+         "m": b["matricola"], "r": reason, "p": cand["student"], "t": clock.utcnow().isoformat()}
+    )
+    release_cv_blobs(conn, [b["cv_digest"]])
+    unindex_cv_bookings(conn, [booking_id])
+    return _promote(conn, b["event_id"], b["company_id"], b["slot"], cand)
+
+# ------------------- Walk-in (giorno dell'evento) -------------------
+# Coda "a biglietti": walkin_counter tiene l'ultimo numero emesso e l'ultimo chiamato,
+# quindi entrare ed essere chiamati costa O(1) da qualunque processo. La posizione conta
+# solo i biglietti ancora in attesa davanti (su idx_walkin_waiting): chi è uscito dalla
+# coda non occupa posti. Il walk-in chiamato è assegnato alla linea che l'ha chiamato.
+WALKIN_MIN_GAP_MINUTES = 10  # minuti liberi necessari prima del prossimo prenotato
+WALKIN_NOTIFY_AT = (1, 3)    # posizioni a cui avvisare chi è in coda
+
+def _now_hm() -> str:
+    return clock.now().strftime("%H:%M")
+
+# posizione in coda (1 = il prossimo) della riga q, contando solo chi è ancora in attesa
+_WALKIN_RANK_SQL = """(SELECT COUNT(*) FROM walkin_queue w
+                       WHERE w.event_id = q.event_id AND w.company_id = q.company_id
+                         AND w.status = 'waiting' AND w.ticket <= q.ticket)"""
+
+def walkin_position(conn, event_id, company_id, student) -> int | None:
+    """Posizione dello studente in coda (1 = il prossimo); None se non è in attesa."""
+    return conn.execute(
+        text(f"""SELECT {_WALKIN_RANK_SQL}
+                FROM walkin_queue q
+                WHERE q.event_id = :e AND q.company_id = :c AND q.student = :s AND q.status = 'waiting'"""),
+        {"e": event_id, "c": company_id, "s": student}
+    ).scalar()
+
+def walkin_join(conn, event_id, company_id, student) -> int | None:
+    """Aggiunge lo studente alla coda walk-in; None se ha già un colloquio con l'azienda."""
+    pos = walkin_position(conn, event_id, company_id, student)
+    if pos is not None:
+        return pos
+    if conn.execute(
+        text("""SELECT 1 FROM booking WHERE event_id = :e AND company_id = :c AND student = :s
+                UNION ALL
+                SELECT 1 FROM walkin_queue WHERE event_id = :e AND company_id = :c AND student = :s
+                  AND status IN ('called', 'active', 'done')
+                LIMIT 1"""),
+        {"e": event_id, "c": company_id, "s": student}
+    ).first():
+        return None
+    conn.execute(
+        text("""INSERT INTO walkin_counter (event_id, company_id, next_ticket, served_upto)
+                VALUES (:e, :c, 1, 0)
+                ON CONFLICT(event_id, company_id) DO UPDATE SET next_ticket = next_ticket + 1"""),
+        {"e": event_id, "c": company_id}
+    )
+    ticket = conn.execute(
+        text("SELECT next_ticket FROM walkin_counter WHERE event_id = :e AND company_id = :c"),
+        {"e": event_id, "c": company_id}
+    ).scalar()
+    conn.execute(
+        text("""INSERT INTO walkin_queue (event_id, company_id, student, ticket, created_at)
+                VALUES (:e, :c, :s, :t, :now)"""),
+        {"e": event_id, "c": company_id, "s": student, "t": ticket, "now": clock.utcnow().isoformat()}
+    )
+    return walkin_position(conn, event_id, company_id, student)
+
+def walkin_leave(conn, event_id, company_id, student):
+    conn.execute(
+        text("""UPDATE walkin_queue SET status = 'left'
+                WHERE event_id = :e AND company_id = :c AND student = :s AND status = 'waiting'"""),
+        {"e": event_id, "c": company_id, "s": student}
+    )
+
+def walkin_waiting(conn, event_id, company_id) -> int:
+    return conn.execute(
+        text("""SELECT COUNT(*) FROM walkin_queue
+                WHERE event_id = :e AND company_id = :c AND status = 'waiting'"""),
+        {"e": event_id, "c": company_id}
+    ).scalar()
+
+def get_student_walkins(conn, event_id, student):
+    q = text(f"""
+        SELECT q.company_id, c.name AS company, q.status,
+               CASE WHEN q.status = 'waiting' THEN {_WALKIN_RANK_SQL} END AS position
+        FROM walkin_queue q
+        JOIN company c ON c.id = q.company_id
+        WHERE q.event_id = :e AND q.student = :s AND q.status IN ('waiting', 'called', 'active')
+        ORDER BY c.name
+    """)
+    return list(conn.execute(q, {"e": event_id, "s": student}).mappings())
+
+def walkin_current(conn, event_id, company_id, lane=None):
+    """
+    Walk-in chiamato o in corso per l'azienda; con `lane` solo quello della linea
+    (i walk-in chiamati prima delle linee, senza lane, valgono per tutte).
+    """
+    return conn.execute(
+        text(f"""SELECT id, student, ticket, status, called_at, start_time, lane
+                 FROM walkin_queue
+                 WHERE event_id = :e AND company_id = :c AND status IN ('called', 'active')
+                   {"AND (lane = :lane OR lane IS NULL)" if lane is not None else ""}
+                 ORDER BY ticket LIMIT 1"""),
+        {"e": event_id, "c": company_id, "lane": lane}
+    ).mappings().first()
+
+def booked_student_due(conn, event_id, company_id, lane=None,
+                       gap_minutes: int = WALKIN_MIN_GAP_MINUTES) -> bool:
+    """
+    True se un prenotato non ancora concluso inizia entro `gap_minutes` (o è già in ritardo);
+    con `lane` guarda solo quella linea.
+    """
+    limit = (clock.now() + timedelta(minutes=gap_minutes)).strftime("%H:%M")
+    return conn.execute(
+        text(f"""SELECT 1 FROM booking b
+                 LEFT JOIN interview_log il ON il.booking_id = b.id
+                 WHERE b.event_id = :e AND b.company_id = :c AND b.slot <= :limit
+                   {"AND b.lane = :lane" if lane is not None else ""}
+                   AND (il.status IS NULL OR il.status IN ('pending', 'active'))
+                 LIMIT 1"""),
+        {"e": event_id, "c": company_id, "limit": limit, "lane": lane}
+    ).first() is not None
+
+def walkin_pop(conn, event_id, company_id, lane=None):
+    """
+    Chiama il prossimo walk-in sulla linea `lane`: avanza il contatore e avvisa il chiamato e chi arriva
+    alle posizioni WALKIN_NOTIFY_AT. Restituisce la riga chiamata (o None).
+    """
+    served = conn.execute(
+        text("SELECT served_upto FROM walkin_counter WHERE event_id = :e AND company_id = :c"),
+        {"e": event_id, "c": company_id}
+    ).scalar()
+    if served is None:
+        return None
+    nxt = conn.execute(
+        text("""SELECT id, student, ticket FROM walkin_queue
+                WHERE event_id = :e AND company_id = :c AND ticket > :served AND status = 'waiting'
+                ORDER BY ticket LIMIT 1"""),
+        {"e": event_id, "c": company_id, "served": served}
+    ).mappings().first()
+    if not nxt:
+        return None
+    claimed = conn.execute(
+        text("""UPDATE walkin_queue SET status = 'called', called_at = :t, lane = :lane
+                WHERE id = :id AND status = 'waiting'"""),
+        {"t": clock.utcnow().isoformat(), "lane": lane, "id": nxt["id"]}
+    ).rowcount
+    if not claimed:
+        return None
+    conn.execute(
+        text("""UPDATE walkin_counter SET served_upto = MAX(served_upto, :t)
+                WHERE event_id = :e AND company_id = :c"""),
+        {"t": nxt["ticket"], "e": event_id, "c": company_id}
+    )
+
+    company = conn.execute(text("SELECT name FROM company WHERE id = :c"), {"c": company_id}).scalar()
+    now_hm = _now_hm()
+    add_notification(conn, event_id, company_id, nxt["student"], now_hm, "walkin_called",
+                     f"It's your turn: {company} is ready for your walk-in interview now.")
+    # i prossimi ancora in attesa, in ordine: la posizione è il loro rango reale
+    ahead = conn.execute(
+        text("""SELECT student FROM walkin_queue
+                WHERE event_id = :e AND company_id = :c AND status = 'waiting'
+                ORDER BY ticket LIMIT :n"""),
+        {"e": event_id, "c": company_id, "n": max(WALKIN_NOTIFY_AT)}
+    ).scalars().all()
+    for position, student in enumerate(ahead, start=1):
+        if position not in WALKIN_NOTIFY_AT:
+            continue
+        msg = (f"You are next in the walk-in queue at {company}." if position == 1
+               else f"Walk-in queue at {company}: you are now #{position}.")
+        add_notification(conn, event_id, company_id, student, now_hm, "walkin_position", msg)
+    return nxt
+
+def walkin_start(conn, walkin_id):
+    conn.execute(
+        text("UPDATE walkin_queue SET status = 'active', start_time = :t WHERE id = :id AND status = 'called'"),
+        {"t": clock.utcnow().isoformat(), "id": walkin_id}
+    )
+
+def walkin_finish(conn, walkin_id, status: str = "done"):
+    """Chiude il walk-in: 'done' oppure 'no-show' se lo studente non si è presentato."""
+    conn.execute(
+        text("""UPDATE walkin_queue SET status = :st, end_time = :t
+                WHERE id = :id AND status IN ('called', 'active')"""),
+        {"st": status, "t": clock.utcnow().isoformat(), "id": walkin_id}
+    )
+
+def pull_walkin_if_free(conn, event_id, company_id, lane=None):
+    """Se nessun prenotato è atteso a breve e la linea non ha già un walk-in, chiama il prossimo."""
+    if walkin_current(conn, event_id, company_id, lane) or booked_student_due(conn, event_id, company_id, lane):
+        return None
+    return walkin_pop(conn, event_id, company_id, lane)
 
 # Interviews
 def get_next_booking(conn, event_id, company_id):
-    now = datetime.now().strftime("%H:%M")
+    now = clock.now().strftime("%H:%M")
     q = text("""SELECT b.id, b.slot, b.student
                 FROM booking b
                 WHERE b.event_id=:e AND b.company_id=:c AND b.slot >= :now
@@ -394,43 +1452,219 @@ def start_interview(conn, booking_id):
         text("""INSERT INTO interview_log (booking_id, start_time, status) 
                 VALUES (:b,:t,'active')
                 ON CONFLICT(booking_id) DO UPDATE SET start_time=:t, status='active'"""),
-        {"b": booking_id, "t": datetime.utcnow().isoformat()}
+        {"b": booking_id, "t": clock.utcnow().isoformat()}
     )
 
 def end_interview(conn, booking_id):
-    now_iso = datetime.utcnow().isoformat()
+    now_iso = clock.utcnow().isoformat()
     conn.execute(
         text("UPDATE interview_log SET end_time=:t, status='done' WHERE booking_id=:b"),
         {"b": booking_id, "t": now_iso}
     )
+    record_interview_stats(conn, booking_id)
     b = get_booking_by_id(conn, booking_id)
     if not b:
         return
     slot_start = datetime.strptime(b["slot"], "%H:%M")
     slot_end = slot_start + timedelta(minutes=15)
-    now_hm = datetime.strptime(datetime.now().strftime("%H:%M"), "%H:%M")
+    now_hm = datetime.strptime(clock.now().strftime("%H:%M"), "%H:%M")
     if now_hm < slot_end:
         next_slot = (slot_start + timedelta(minutes=15)).strftime("%H:%M")
         nxt = conn.execute(
             text("""SELECT student FROM booking 
-                    WHERE event_id=:e AND company_id=:c AND slot=:s"""),
-            {"e": b["event_id"], "c": b["company_id"], "s": next_slot}
+                    WHERE event_id=:e AND company_id=:c AND lane=:l AND slot=:s"""),
+            {"e": b["event_id"], "c": b["company_id"], "l": b["lane"], "s": next_slot}
         ).mappings().first()
         if nxt:
             msg = f"Lo slot precedente ({b['slot']}) con l'azienda è terminato in anticipo. Puoi presentarti ora."
             add_notification(conn, b["event_id"], b["company_id"], nxt["student"], b["slot"], "early_finish", msg)
 
-def mark_no_show(conn, booking_id):
+# ------------------- Statistiche dei colloqui (per azienda, incrementali) -------------------
+# Per ogni (evento, azienda) e metrica ('duration' = durata, 'lateness' = inizio - slot, in
+# minuti) teniamo n, media e M2 di Welford più un istogramma a bucket di un minuto per i
+# percentili: ogni colloquio concluso è un aggiornamento O(1) di due righe, senza rileggere
+# interview_log. Le righe degli eventi passati restano e fanno da base a inizio giornata.
+STATS_METRICS = ("duration", "lateness")
+STATS_HIST_MAX = 60        # l'ultimo bucket raccoglie tutto ciò che supera un'ora
+STATS_MIN_SAMPLES = 5      # sotto questa soglia l'evento corrente si somma allo storico
+STATS_MAX_DURATION = 120   # minuti, oltre il campione viene scartato
+
+def utc_offset() -> timedelta:
+    return timedelta(minutes=round((clock.now() - clock.utcnow()).total_seconds() / 60))
+
+def interview_sample(slot: str, start_iso, end_iso) -> dict | None:
+    """Durata e ritardo d'inizio (minuti) di un colloquio; i log sono in UTC, gli slot in ora locale."""
+    try:
+        start = datetime.fromisoformat(str(start_iso))
+        end = datetime.fromisoformat(str(end_iso))
+    except (TypeError, ValueError):
+        return None
+    duration = (end - start).total_seconds() / 60
+    if not 0 < duration <= STATS_MAX_DURATION:
+        return None  # Termina dimenticato o orologi sballati: non è una durata credibile
+    local = start + utc_offset()
+    slot_min = int(slot[:2]) * 60 + int(slot[3:5])
+    return {
+        "duration": duration,
+        "lateness": local.hour * 60 + local.minute + local.second / 60 - slot_min,
+    }
+
+def _stats_add(stat: dict, x: float) -> dict:
+    n = stat["n"] + 1
+    delta = x - stat["mean"]
+    mean = stat["mean"] + delta / n
+    hist = list(stat["hist"])
+    hist[min(max(int(x), 0), STATS_HIST_MAX)] += 1
+    return {"n": n, "mean": mean, "m2": stat["m2"] + delta * (x - mean), "hist": hist}
+
+def _stats_merge(a: dict, b: dict) -> dict:
+    """Combinazione di due riassunti (Chan et al.), per sommare storico ed evento corrente."""
+    n = a["n"] + b["n"]
+    if not n:
+        return a
+    delta = b["mean"] - a["mean"]
+    return {
+        "n": n,
+        "mean": a["mean"] + delta * b["n"] / n,
+        "m2": a["m2"] + b["m2"] + delta * delta * a["n"] * b["n"] / n,
+        "hist": [x + y for x, y in zip(a["hist"], b["hist"])],
+    }
+
+def _stats_empty() -> dict:
+    return {"n": 0, "mean": 0.0, "m2": 0.0, "hist": [0] * (STATS_HIST_MAX + 1)}
+
+def hist_percentile(hist, p: float) -> float | None:
+    total = sum(hist)
+    if not total:
+        return None
+    target, acc = p / 100 * total, 0
+    for minute, count in enumerate(hist):
+        acc += count
+        if acc >= target:
+            return float(minute)
+    return float(STATS_HIST_MAX)
+
+def _load_stats(conn, where: str, params: dict) -> dict:
+    out = {}
+    for r in conn.execute(
+        text(f"SELECT event_id, company_id, metric, n, mean, m2, hist FROM interview_stats WHERE {where}"),
+        params
+    ).mappings():
+        out[(r["event_id"], r["company_id"], r["metric"])] = {
+            "n": r["n"], "mean": r["mean"], "m2": r["m2"], "hist": json.loads(r["hist"]),
+        }
+    return out
+
+def _save_stats(conn, rows: list):
     conn.execute(
-        text("UPDATE interview_log SET status='no-show' WHERE booking_id=:b"),
+        text("""INSERT INTO interview_stats (event_id, company_id, metric, n, mean, m2, hist, updated_at)
+                VALUES (:e, :c, :metric, :n, :mean, :m2, :hist, :t)
+                ON CONFLICT(event_id, company_id, metric) DO UPDATE
+                SET n = excluded.n, mean = excluded.mean, m2 = excluded.m2,
+                    hist = excluded.hist, updated_at = excluded.updated_at"""),
+        rows
+    )
+
+def record_interview_stats(conn, booking_id):
+    """Aggiunge il colloquio appena concluso alle statistiche della sua azienda."""
+    r = conn.execute(
+        text("""SELECT b.event_id, b.company_id, b.slot, il.start_time, il.end_time
+                FROM booking b JOIN interview_log il ON il.booking_id = b.id
+                WHERE b.id = :b AND il.status = 'done'"""),
         {"b": booking_id}
+    ).mappings().first()
+    sample = r and interview_sample(r["slot"], r["start_time"], r["end_time"])
+    if not sample:
+        return
+    e, c = r["event_id"], r["company_id"]
+    current = _load_stats(conn, "event_id = :e AND company_id = :c", {"e": e, "c": c})
+    now_iso = clock.utcnow().isoformat()
+    rows = []
+    for metric in STATS_METRICS:
+        v = _stats_add(current.get((e, c, metric), _stats_empty()), sample[metric])
+        rows.append({"e": e, "c": c, "metric": metric, "n": v["n"], "mean": v["mean"],
+                     "m2": v["m2"], "hist": json.dumps(v["hist"]), "t": now_iso})
+    _save_stats(conn, rows)
+
+def rebuild_interview_stats(conn, event_id=None):
+    """Ricalcola da zero (da interview_log) le statistiche di un evento o di tutti."""
+    where = "AND b.event_id = :e" if event_id else ""
+    acc = {}
+    for r in conn.execute(
+        text(f"""SELECT b.event_id, b.company_id, b.slot, il.start_time, il.end_time
+                 FROM booking b JOIN interview_log il ON il.booking_id = b.id
+                 WHERE il.status = 'done' {where}"""),
+        {"e": event_id}
+    ).mappings():
+        sample = interview_sample(r["slot"], r["start_time"], r["end_time"])
+        if not sample:
+            continue
+        for metric in STATS_METRICS:
+            key = (r["event_id"], r["company_id"], metric)
+            acc[key] = _stats_add(acc.get(key, _stats_empty()), sample[metric])
+    if event_id:
+        conn.execute(text("DELETE FROM interview_stats WHERE event_id = :e"), {"e": event_id})
+    else:
+        conn.execute(text("DELETE FROM interview_stats"))
+    now_iso = clock.utcnow().isoformat()
+    if acc:
+        _save_stats(conn, [
+            {"e": e, "c": c, "metric": m, "n": v["n"], "mean": v["mean"], "m2": v["m2"],
+             "hist": json.dumps(v["hist"]), "t": now_iso}
+            for (e, c, m), v in acc.items()
+        ])
+
+@traced()
+def get_company_estimates(conn, event_id) -> dict:
+    """
+    Previsioni per azienda dell'evento: {company_id: {"n", "duration", "duration_sd",
+    "duration_p90", "lateness_p50"}}. Con meno di STATS_MIN_SAMPLES colloqui nell'evento
+    corrente si usano anche quelli degli eventi passati.
+    """
+    stats = _load_stats(
+        conn, "company_id IN (SELECT company_id FROM event_company WHERE event_id = :e)", {"e": event_id}
     )
+    by_company = {}
+    for (e, c, metric), v in stats.items():
+        entry = by_company.setdefault(c, {}).setdefault(metric, {"current": _stats_empty(), "past": _stats_empty()})
+        which = "current" if e == event_id else "past"
+        entry[which] = _stats_merge(entry[which], v)
 
-def get_bookings_with_logs(conn, event_id, company_id):
-    q = text("""
+    out = {}
+    for c, metrics in by_company.items():
+        pick = {}
+        for metric, v in metrics.items():
+            pick[metric] = v["current"] if v["current"]["n"] >= STATS_MIN_SAMPLES else _stats_merge(v["current"], v["past"])
+        d, l = pick.get("duration", _stats_empty()), pick.get("lateness", _stats_empty())
+        if not d["n"]:
+            continue
+        out[c] = {
+            "n": d["n"],
+            "duration": d["mean"],
+            "duration_sd": (d["m2"] / (d["n"] - 1)) ** 0.5 if d["n"] > 1 else 0.0,
+            "duration_p90": hist_percentile(d["hist"], 90),
+            "lateness_p50": hist_percentile(l["hist"], 50) or 0.0,
+        }
+    return out
+
+def mark_no_show(conn, booking_id) -> str | None:
+    """Segna lo studente assente e cede lo slot alla lista d'attesa; ritorna chi è subentrato."""
+    conn.execute(
+        text("""INSERT INTO interview_log (booking_id, end_time, status) VALUES (:b, :t, 'no-show')
+                ON CONFLICT(booking_id) DO UPDATE SET end_time=:t, status='no-show'"""),
+        {"b": booking_id, "t": clock.utcnow().isoformat()}
+    )
+    return release_booking(conn, booking_id, "no-show")
+
+@traced()
+def get_bookings_with_logs(conn, event_id, company_id, booking_ids=None):
+    """Prenotazioni dell'azienda con lo stato del colloquio; `booking_ids` limita ad alcune."""
+    only = "AND b.id IN :ids" if booking_ids is not None else ""
+    q = text(f"""
         SELECT 
             b.id,
             b.slot,
+            b.lane,
             b.student,
             b.cv_path,
             COALESCE(il.status, 'pending') AS status,
@@ -438,10 +1672,16 @@ def get_bookings_with_logs(conn, event_id, company_id):
             il.end_time
         FROM booking b
         LEFT JOIN interview_log il ON il.booking_id = b.id
-        WHERE b.event_id = :e AND b.company_id = :c
-        ORDER BY b.slot
+        WHERE b.event_id = :e AND b.company_id = :c {only}
+        ORDER BY b.slot, b.lane
     """)
-    raw_rows = list(conn.execute(q, {"e": event_id, "c": company_id}).mappings())
+    params = {"e": event_id, "c": company_id}
+    if booking_ids is not None:
+        if not booking_ids:
+            return []
+        q = q.bindparams(bindparam("ids", expanding=True))
+        params["ids"] = list(booking_ids)
+    raw_rows = list(conn.execute(q, params).mappings())
 
     def fmt(ts: str | None) -> str:
         if not ts:
@@ -453,6 +1693,7 @@ def get_bookings_with_logs(conn, event_id, company_id):
         rows.append({
             "id": r["id"],
             "slot": r["slot"],
+            "lane": r["lane"],
             "student": r["student"],
             "cv_path": r["cv_path"],        # importante: conserviamo il path reale
             "CV": "✅" if r["cv_path"] else "—",  # per la tabella
@@ -507,6 +1748,85 @@ def save_student_matricola(conn, givenName, sn, email, matricola, plenary=0, pas
     )
 
 
+# ------------------- Ricerca studenti (admin) -------------------
+STUDENT_SEARCH_LIMIT = 200
+
+def _student_search_terms(user_query: str) -> tuple[list[str], list[str]]:
+    """Divide la query in termini da >= 3 caratteri (indice trigram) e termini corti (LIKE)."""
+    terms = [t for t in re.split(r"\s+", (user_query or "").lower()) if t]
+    if not HAS_STUDENT_FTS:
+        return [], terms
+    return [t for t in terms if len(t) >= 3], [t for t in terms if len(t) < 3]
+
+def _like_escape(term: str) -> str:
+    return "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+@traced()
+def search_students(conn, event_id, user_query: str, limit: int = STUDENT_SEARCH_LIMIT) -> dict:
+    """
+    Studenti che corrispondono a tutti i termini (nome, cognome, email, matricola)
+    con le loro prenotazioni nell'evento, in una sola query.
+    Comprende anche le prenotazioni manuali ("Nome <email>") senza studente registrato.
+
+    Ritorna {"students": [...], "student_ids": set, "emails": set, "booking_ids": set};
+    ogni studente ha la lista "bookings" [{id, company_id, slot}].
+    """
+    fts_terms, like_terms = _student_search_terms(user_query)
+    params = {"e": event_id, "n": limit}
+    student_where, booking_where = [], []
+    if fts_terms:
+        student_where.append("s.id IN (SELECT rowid FROM student_fts WHERE student_fts MATCH :m)")
+        params["m"] = " AND ".join('"' + t.replace('"', '""') + '"' for t in fts_terms)
+    for i, t in enumerate(fts_terms + like_terms):
+        params[f"t{i}"] = _like_escape(t)
+        if i >= len(fts_terms):
+            student_where.append(
+                f"LOWER(s.givenName || ' ' || s.sn || ' ' || s.email || ' ' || s.matricola) "
+                f"LIKE :t{i} ESCAPE '\\'"
+            )
+        booking_where.append(f"LOWER(b.student) LIKE :t{i} ESCAPE '\\'")
+    if not student_where:
+        return {"students": [], "student_ids": set(), "emails": set(), "booking_ids": set()}
+
+    q = text(f"""
+        WITH hits AS (
+            SELECT s.id, s.email, s.givenName, s.sn, s.matricola
+            FROM student s
+            WHERE {" AND ".join(student_where)}
+            ORDER BY s.sn COLLATE NOCASE, s.givenName COLLATE NOCASE
+            LIMIT :n
+        )
+        SELECT h.id AS student_id, h.email, h.givenName, h.sn, h.matricola,
+               b.id AS booking_id, b.company_id, b.slot
+        FROM hits h
+        LEFT JOIN booking b ON b.event_id = :e AND b.student = h.email
+        UNION ALL
+        SELECT NULL, LOWER(b.student), NULL, NULL, b.matricola, b.id, b.company_id, b.slot
+        FROM booking b
+        WHERE b.event_id = :e
+          AND {" AND ".join(booking_where)}
+          AND NOT EXISTS (SELECT 1 FROM student s WHERE s.email = b.student)
+    """)
+
+    students = {}
+    for r in conn.execute(q, params).mappings():
+        key = r["student_id"] if r["student_id"] is not None else r["email"]
+        st_row = students.setdefault(key, {
+            "id": r["student_id"], "email": r["email"], "givenName": r["givenName"],
+            "sn": r["sn"], "matricola": r["matricola"], "bookings": [],
+        })
+        if r["booking_id"] is not None:
+            st_row["bookings"].append({"id": r["booking_id"], "company_id": r["company_id"], "slot": r["slot"]})
+
+    found = list(students.values())
+    return {
+        "students": found,
+        "student_ids": {s["id"] for s in found if s["id"] is not None},
+        "emails": {(s["email"] or "").lower() for s in found},
+        "booking_ids": {b["id"] for s in found for b in s["bookings"]},
+    }
+
+
 # ------------------- QR helpers (admin) -------------------
 try:
     import cv2
@@ -572,7 +1892,7 @@ def parse_name_from_qr_text(qr_text: str) -> tuple[str, str, str]:
 
 def append_attendance_csv(event_id: int, full_name: str, first_name: str, last_name: str, raw_qr: str):
     row = {
-        "timestamp": datetime.utcnow().isoformat(),
+        "timestamp": clock.utcnow().isoformat(),
         "event_id": event_id,
         "full_name": full_name,
         "first_name": first_name,
@@ -592,46 +1912,77 @@ def append_attendance_csv(event_id: int, full_name: str, first_name: str, last_n
     df.to_csv(ATTENDANCE_CSV, index=False)
 
 # --- Running-late notifications (avoid duplicates/spam) ---
-def _find_running_late_notif(conn, event_id, company_id, student, slot_from):
-    q = text("""SELECT id, message, created_at
-                FROM notification
-                WHERE event_id=:e AND company_id=:c AND student=:s
-                  AND slot_from=:slot AND kind='running_late'
-                  AND read_at IS NULL
-                ORDER BY created_at DESC
-                LIMIT 1""")
-    return conn.execute(q, {"e": event_id, "c": company_id, "s": student, "slot": slot_from}).mappings().first()
+def running_late_message(prev_slot: str, minutes_late: int) -> str:
+    return f"The previos slot ({prev_slot}) is late by {max(1, int(minutes_late))} min."
 
 def upsert_running_late_notification(conn, event_id, company_id, prev_slot, next_student, minutes_late: int):
     """Crea o aggiorna una notifica 'running_late' per il prossimo studente."""
-    minutes_late = max(1, int(minutes_late))
-    msg = f"The previos slot ({prev_slot}) is late by {minutes_late} min."
+    upsert_running_late_notifications(conn, [{
+        "event_id": event_id, "company_id": company_id, "prev_slot": prev_slot,
+        "student": next_student, "minutes_late": minutes_late,
+    }])
 
-    existing = _find_running_late_notif(conn, event_id, company_id, next_student, prev_slot)
-    now_iso = datetime.utcnow().isoformat()
+def upsert_running_late_notifications(conn, items: list) -> int:
+    """
+    Versione a batch: items = dict con event_id, company_id, prev_slot, student, minutes_late.
+    Una SELECT sulle notifiche 'running_late' non lette degli eventi coinvolti, poi un
+    UPDATE e un INSERT multipli. Restituisce quante righe ha scritto.
+    """
+    if not items:
+        return 0
+    now = clock.utcnow()
+    now_iso = now.isoformat()
+    existing = {}
+    for r in conn.execute(
+        text("""SELECT id, event_id, company_id, student, slot_from, message, created_at
+                FROM notification
+                WHERE event_id IN :events AND kind='running_late' AND read_at IS NULL
+                ORDER BY created_at""").bindparams(bindparam("events", expanding=True)),
+        {"events": sorted({i["event_id"] for i in items})}
+    ).mappings():
+        existing[(r["event_id"], r["company_id"], r["student"], r["slot_from"])] = r  # vince la più recente
 
-    if existing:
-        # Aggiorna messaggio e timestamp solo se è cambiato il valore o se è 'vecchia' (>60s)
-        try:
-            last_ts = datetime.fromisoformat(str(existing["created_at"]))
-        except Exception:
-            last_ts = None
-        should_update = (existing["message"] != msg)
-        if last_ts:
-            dt = datetime.utcnow() - last_ts
-            if dt.total_seconds() > 60:
-                should_update = True
-        if should_update:
-            conn.execute(
-                text("UPDATE notification SET message=:m, created_at=:t WHERE id=:id"),
-                {"m": msg, "t": now_iso, "id": existing["id"]}
-            )
-    else:
+    updates, inserts = [], []
+    for i in items:
+        msg = running_late_message(i["prev_slot"], i["minutes_late"])
+        row = existing.get((i["event_id"], i["company_id"], i["student"], i["prev_slot"]))
+        if row:
+            # Aggiorna messaggio e timestamp solo se è cambiato il valore o se è 'vecchia' (>60s)
+            try:
+                stale = (now - datetime.fromisoformat(str(row["created_at"]))).total_seconds() > 60
+            except Exception:
+                stale = False
+            if row["message"] != msg or stale:
+                updates.append({"m": msg, "t": now_iso, "id": row["id"]})
+        else:
+            inserts.append({"e": i["event_id"], "c": i["company_id"], "s": i["student"],
+                            "slot": i["prev_slot"], "m": msg, "t": now_iso})
+    if updates:
+        conn.execute(text("UPDATE notification SET message=:m, created_at=:t WHERE id=:id"), updates)
+    if inserts:
         conn.execute(
             text("""INSERT INTO notification
                     (event_id, company_id, student, slot_from, kind, message, created_at)
                     VALUES (:e,:c,:s,:slot,'running_late',:m,:t)"""),
-            {"e": event_id, "c": company_id, "s": next_student,
-             "slot": prev_slot, "m": msg, "t": now_iso}
+            inserts
         )
+    return len(updates) + len(inserts)
+
+
+# ------------------- Lease tra processi -------------------
+# Worker che devono girare una sola volta per deployment (non per processo) si
+# contendono una riga di `worker_lease`: vince chi la inserisce o la trova scaduta.
+def acquire_lease(conn, name: str, owner: str, seconds: int) -> bool:
+    """Prende o rinnova il lease `name`; True se ora appartiene a `owner`."""
+    now = datetime.utcnow()
+    conn.execute(
+        text("""INSERT INTO worker_lease (name, owner, expires_at) VALUES (:n, :o, :exp)
+                ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+                WHERE worker_lease.owner = excluded.owner OR worker_lease.expires_at < :now"""),
+        {"n": name, "o": owner, "exp": (now + timedelta(seconds=seconds)).isoformat(), "now": now.isoformat()}
+    )
+    return conn.execute(text("SELECT owner FROM worker_lease WHERE name = :n"), {"n": name}).scalar() == owner
+
+def release_lease(conn, name: str, owner: str):
+    conn.execute(text("DELETE FROM worker_lease WHERE name = :n AND owner = :o"), {"n": name, "o": owner})
     
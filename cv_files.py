@@ -0,0 +1,184 @@
+# cv_files.py
+"""
+Accesso ai CV lato azienda.
+
+Le pagine non leggono più i PDF ad ogni rerun: usano solo i metadati
+(esistenza, dimensione) tenuti in cache, e il file viene aperto soltanto
+quando il recruiter chiede quel CV.
+"""
+import csv
+import glob
+import hashlib
+import io
+import os
+import zipfile
+
+import streamlit as st
+from sqlalchemy import text
+
+from core import CV_DIR, ensure_dirs, sanitize_filename
+from tracing import traced
+
+CV_CHUNK_SIZE = 64 * 1024
+CV_META_TTL = 60  # secondi
+BUNDLE_DIR = os.path.join(CV_DIR, "_bundles")
+
+
+def is_cv_link(cv_path) -> bool:
+    return isinstance(cv_path, str) and cv_path.strip().lower().startswith("http")
+
+
+@st.cache_data(ttl=CV_META_TTL, show_spinner=False)
+@traced()
+def cv_file_meta(cv_path: str) -> dict:
+    """Metadati del file CV (niente contenuto): {"exists", "size", "mtime"}."""
+    try:
+        stt = os.stat(cv_path)
+    except OSError:
+        return {"exists": False, "size": 0, "mtime": None}
+    return {"exists": True, "size": stt.st_size, "mtime": stt.st_mtime}
+
+
+def iter_cv_chunks(cv_path: str, chunk_size: int = CV_CHUNK_SIZE):
+    """Legge il CV a pezzi, senza mai tenerlo tutto in memoria."""
+    with open(cv_path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+def open_cv_stream(cv_path: str):
+    """File object bufferizzato sul CV (da chiudere a cura del chiamante)."""
+    return open(cv_path, "rb", buffering=CV_CHUNK_SIZE)
+
+
+def format_size(n: int) -> str:
+    if n < 1024:
+        return f"{n} B"
+    if n < 1024 * 1024:
+        return f"{n / 1024:.0f} KB"
+    return f"{n / (1024 * 1024):.1f} MB"
+
+
+# ------------------- ZIP di tutti i CV di un'azienda -------------------
+def company_cv_rows(conn, event_id, company_id):
+    q = text("""
+        SELECT b.id, b.slot, b.student, b.cv_path, b.cv_uploaded_at,
+               s.givenName, s.sn, s.matricola
+        FROM booking b
+        LEFT JOIN student s ON s.email = b.student
+        WHERE b.event_id = :e AND b.company_id = :c AND b.cv_path IS NOT NULL AND b.cv_path != ''
+        ORDER BY b.slot
+    """)
+    return list(conn.execute(q, {"e": event_id, "c": company_id}).mappings())
+
+
+def company_bookings_version(conn, event_id, company_id) -> str:
+    """Impronta delle prenotazioni/CV dell'azienda: cambia se cambia qualcosa nel bundle."""
+    row = conn.execute(
+        text("""
+            SELECT COUNT(*) AS n,
+                   GROUP_CONCAT(id || ':' || slot || ':' || COALESCE(cv_path, '')
+                                || ':' || COALESCE(cv_uploaded_at, ''), '|') AS sig
+            FROM (SELECT id, slot, cv_path, cv_uploaded_at FROM booking
+                  WHERE event_id = :e AND company_id = :c ORDER BY id)
+        """),
+        {"e": event_id, "c": company_id}
+    ).mappings().first()
+    return hashlib.sha1(f"{row['n']}|{row['sig'] or ''}".encode()).hexdigest()[:16]
+
+
+class _ZipSink:
+    """Stream non seekable: zipfile ci scrive, il generatore svuota il buffer."""
+
+    def __init__(self):
+        self._buf = io.BytesIO()
+
+    def write(self, b):
+        return self._buf.write(b)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = self._buf.getvalue()
+        self._buf.seek(0)
+        self._buf.truncate()
+        return data
+
+
+def _bundle_entry_name(r) -> str:
+    who = f"{r['sn'] or ''} {r['givenName'] or ''}".strip() or r["student"] or "studente"
+    return f"{(r['slot'] or '').replace(':', '')}_{sanitize_filename(who)}.pdf"
+
+
+def iter_cv_zip(rows, chunk_size: int = CV_CHUNK_SIZE):
+    """
+    Genera lo ZIP dei CV a blocchi: ogni PDF è copiato a pezzi, quindi in memoria
+    c'è al massimo un chunk. I CV-link (http) e i file mancanti finiscono nel manifest.
+    """
+    sink = _ZipSink()
+    manifest = io.StringIO()
+    w = csv.writer(manifest)
+    w.writerow(["slot", "student", "matricola", "type", "file_or_url"])
+
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED) as zf:
+        used = set()
+        for r in rows:
+            cv = r["cv_path"]
+            if is_cv_link(cv):
+                w.writerow([r["slot"], r["student"], r["matricola"] or "", "link", cv.strip()])
+                continue
+            if not os.path.exists(cv):
+                w.writerow([r["slot"], r["student"], r["matricola"] or "", "missing", ""])
+                continue
+
+            name = _bundle_entry_name(r)
+            if name in used:
+                name = f"{name[:-4]}_{r['id']}.pdf"
+            used.add(name)
+
+            # i PDF sono già compressi: li salviamo "stored"
+            with zf.open(zipfile.ZipInfo(name, date_time=(2025, 1, 1, 0, 0, 0)), "w") as dst:
+                for chunk in iter_cv_chunks(cv, chunk_size):
+                    dst.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            w.writerow([r["slot"], r["student"], r["matricola"] or "", "file", name])
+
+        zf.writestr("manifest.csv", manifest.getvalue(), compress_type=zipfile.ZIP_DEFLATED)
+    yield sink.drain()
+
+
+@traced()
+def build_company_cv_bundle(conn, event_id, company_id) -> tuple[str, int]:
+    """
+    Restituisce (path, n_righe) dello ZIP dei CV dell'azienda, costruendolo
+    solo se le prenotazioni sono cambiate dall'ultima volta.
+    """
+    version = company_bookings_version(conn, event_id, company_id)
+    ensure_dirs()
+    os.makedirs(BUNDLE_DIR, exist_ok=True)
+    prefix = os.path.join(BUNDLE_DIR, f"e{event_id}_c{company_id}_")
+    path = f"{prefix}{version}.zip"
+    rows = company_cv_rows(conn, event_id, company_id)
+    if os.path.exists(path):
+        return path, len(rows)
+
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, "wb") as out:
+        for data in iter_cv_zip(rows):
+            out.write(data)
+    os.replace(tmp, path)
+
+    # le versioni precedenti non servono più
+    for old in glob.glob(f"{prefix}*.zip"):
+        if old != path:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+    return path, len(rows)
@@ -0,0 +1,146 @@
+# cv_index.py
+"""
+Indicizzazione full-text dei CV caricati.
+
+book_slot accoda un job in `cv_index_job` per ogni prenotazione con un PDF;
+questo worker (uno per processo) estrae il testo una sola volta per contenuto
+(`cv_text`, chiave = digest del blob) e lo inserisce in `cv_fts` con lo scope
+evento/azienda, così la ricerca lato azienda è una sola query FTS5.
+"""
+import threading
+from datetime import datetime
+
+from sqlalchemy import text
+
+import core
+from core import engine, read_secret, cv_scope
+
+try:
+    from pypdf import PdfReader
+    HAS_PYPDF = True
+except Exception:
+    HAS_PYPDF = False
+
+CV_INDEX_ENABLED = str(read_secret("CV_INDEX_WORKER", "1")).lower() not in ("0", "false", "no")
+CV_INDEX_BATCH = 20
+CV_INDEX_POLL_SECONDS = 5
+CV_TEXT_MAX_CHARS = 200_000
+
+
+def extract_pdf_text(path: str) -> str:
+    reader = PdfReader(path)
+    parts, total = [], 0
+    for page in reader.pages:
+        t = page.extract_text() or ""
+        parts.append(t)
+        total += len(t)
+        if total > CV_TEXT_MAX_CHARS:
+            break
+    return "\n".join(parts)[:CV_TEXT_MAX_CHARS]
+
+
+def _ensure_text(digest: str, db_engine) -> str | None:
+    """Testo del blob: dalla cache `cv_text` oppure estratto ora (fuori transazione)."""
+    with db_engine.begin() as conn:
+        row = conn.execute(
+            text("SELECT status, body FROM cv_text WHERE digest = :d"), {"d": digest}
+        ).mappings().first()
+        if row and row["status"] != "pending":
+            return row["body"]
+        path = conn.execute(text("SELECT path FROM cv_blob WHERE digest = :d"), {"d": digest}).scalar()
+
+    body, status, err = None, "done", None
+    if not HAS_PYPDF:
+        status, err = "skipped", "pypdf non installato"
+    elif not path:
+        status, err = "error", "blob non trovato"
+    else:
+        try:
+            body = extract_pdf_text(path)
+        except Exception as e:
+            status, err = "error", str(e)[:500]
+
+    with db_engine.begin() as conn:
+        conn.execute(
+            text("""INSERT INTO cv_text (digest, status, body, error, extracted_at)
+                    VALUES (:d, :s, :b, :err, :t)
+                    ON CONFLICT(digest) DO UPDATE
+                    SET status = excluded.status, body = excluded.body,
+                        error = excluded.error, extracted_at = excluded.extracted_at"""),
+            {"d": digest, "s": status, "b": body, "err": err, "t": datetime.utcnow().isoformat()}
+        )
+    return body
+
+
+def index_pending(db_engine=None, limit=CV_INDEX_BATCH) -> int:
+    """Processa fino a `limit` job; restituisce quanti ne ha gestiti."""
+    db_engine = db_engine or engine
+    with db_engine.begin() as conn:
+        jobs = list(conn.execute(
+            text("""SELECT j.booking_id, j.digest, b.event_id, b.company_id
+                    FROM cv_index_job j
+                    LEFT JOIN booking b ON b.id = j.booking_id
+                    ORDER BY j.created_at
+                    LIMIT :n"""),
+            {"n": limit}
+        ).mappings())
+    if not jobs:
+        return 0
+
+    bodies = {}
+    for j in jobs:
+        if j["digest"] not in bodies:
+            bodies[j["digest"]] = _ensure_text(j["digest"], db_engine)
+
+    with db_engine.begin() as conn:
+        rows = [
+            {"b": j["booking_id"], "scope": cv_scope(j["event_id"], j["company_id"]), "body": bodies[j["digest"]]}
+            for j in jobs if j["event_id"] is not None and bodies[j["digest"]]
+        ]
+        if rows and core.HAS_FTS:
+            conn.execute(text("DELETE FROM cv_fts WHERE rowid = :b"), [{"b": r["b"]} for r in rows])
+            conn.execute(text("INSERT INTO cv_fts (rowid, scope, body) VALUES (:b, :scope, :body)"), rows)
+        conn.execute(
+            text("DELETE FROM cv_index_job WHERE booking_id = :b AND digest = :d"),
+            [{"b": j["booking_id"], "d": j["digest"]} for j in jobs]
+        )
+    return len(jobs)
+
+
+class CvIndexWorker(threading.Thread):
+    def __init__(self, poll_seconds=CV_INDEX_POLL_SECONDS, db_engine=None):
+        super().__init__(name="cv-index", daemon=True)
+        self.poll_seconds = poll_seconds
+        self.engine = db_engine or engine
+        self._stop_event = threading.Event()
+        self.indexed = 0
+        self.last_error = None
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                n = index_pending(self.engine)
+                self.indexed += n
+            except Exception as e:
+                self.last_error = str(e)[:500]
+                n = 0
+            if n < CV_INDEX_BATCH:
+                self._stop_event.wait(self.poll_seconds)
+
+    def stop(self):
+        self._stop_event.set()
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+def start_cv_index_worker() -> CvIndexWorker | None:
+    """Avvia (una sola volta per processo) il worker di indicizzazione dei CV."""
+    global _worker
+    if not CV_INDEX_ENABLED or not core.HAS_FTS:
+        return None
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = CvIndexWorker()
+            _worker.start()
+        return _worker
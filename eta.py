@@ -0,0 +1,149 @@
+# eta.py
+"""
+Orari di inizio previsti per tutta la coda di un'azienda.
+
+running_late avvisa solo lo studente dello slot successivo; quando il ritardo si
+accumula, chi viene dopo vede ancora l'orario nominale. project_lane() scorre in
+un solo passaggio le prenotazioni ordinate di una linea (con lo stato da
+interview_log) e proietta l'inizio di ciascun colloquio ancora da fare:
+
+    inizio = max(slot nominale, fine prevista del colloquio precedente, adesso)
+
+refresh_etas() lo fa per tutte le aziende dell'evento attivo con una query e
+scrive a batch una notifica 'expected_start' per studente, solo se l'orario
+previsto si è spostato di almeno ETA_NOTIFY_MINUTES dall'ultimo comunicato
+(`booking_eta`; all'inizio è lo slot nominale). Durata attesa e ritardo tipico
+di ogni azienda vengono dalle statistiche incrementali di core (interview_stats).
+"""
+from datetime import datetime, timedelta
+from itertools import groupby
+
+from sqlalchemy import text
+
+import clock
+from core import read_secret, get_company_estimates, utc_offset
+
+ETA_NOTIFY_MINUTES = int(read_secret("ETA_NOTIFY_MINUTES", 5))
+SLOT_MINUTES = 15
+
+QUEUE_SQL = text("""
+    SELECT b.id, b.event_id, b.company_id, b.lane, b.student, b.slot, c.name AS company,
+           COALESCE(il.status, 'pending') AS status, il.start_time,
+           be.eta AS last_eta, n.id AS notif_id
+    FROM booking b
+    JOIN event e ON e.id = b.event_id AND e.is_active = 1
+    JOIN company c ON c.id = b.company_id
+    LEFT JOIN interview_log il ON il.booking_id = b.id
+    LEFT JOIN booking_eta be ON be.booking_id = b.id
+    LEFT JOIN notification n ON n.id = (
+        SELECT MAX(id) FROM notification
+        WHERE event_id = b.event_id AND company_id = b.company_id AND student = b.student
+          AND slot_from = b.slot AND kind = 'expected_start'
+    )
+    ORDER BY b.event_id, b.company_id, b.lane, b.slot
+""")
+
+
+def hm_to_min(hm: str) -> int:
+    return int(hm[:2]) * 60 + int(hm[3:5])
+
+
+def min_to_hm(m: float) -> str:
+    m = int(round(m))
+    return f"{m // 60 % 24:02d}:{m % 60:02d}"
+
+
+def project_lane(rows, now_min: float, duration: float = SLOT_MINUTES, lateness: float = 0.0,
+                 utc_offset=timedelta(0)) -> dict:
+    """
+    rows: prenotazioni di una linea in ordine di slot, con status e start_time (UTC ISO).
+    duration/lateness: durata attesa e ritardo d'inizio tipico dell'azienda (minuti).
+    Restituisce {booking_id: inizio previsto in minuti dalla mezzanotte} per i colloqui
+    ancora da iniziare. Su una linea mai avviata (nessun log) non propaghiamo ritardi,
+    l'azienda potrebbe non usare Inizia/Termina: resta slot + ritardo tipico. I pending
+    prima dell'ultimo colloquio avviato sono stati saltati e non occupano tempo.
+    """
+    touched = [i for i, r in enumerate(rows) if r["status"] != "pending"]
+    if not touched:
+        return {r["id"]: hm_to_min(r["slot"]) + lateness for r in rows}
+    cursor = now_min
+    out = {}
+    for r in rows[touched[-1]:]:
+        if r["status"] == "active":
+            try:
+                started = datetime.fromisoformat(str(r["start_time"])) + utc_offset
+                started_min = started.hour * 60 + started.minute + started.second / 60
+            except Exception:
+                started_min = hm_to_min(r["slot"])
+            # se sfora la durata attesa, finirà comunque non prima di adesso
+            cursor = max(cursor, started_min + duration)
+        elif r["status"] == "pending":
+            start = max(hm_to_min(r["slot"]) + lateness, cursor)
+            out[r["id"]] = start
+            cursor = start + duration
+    return out
+
+
+def refresh_etas(conn, now: datetime | None = None, estimates: dict | None = None) -> int:
+    """
+    Ricalcola gli ETA di tutte le code dell'evento attivo e notifica gli spostamenti.
+    estimates: {company_id: {"duration", "lateness_p50"}}, di default dalle statistiche
+    incrementali (core.get_company_estimates); senza dati, slot da SLOT_MINUTES in orario.
+    Restituisce quanti studenti sono stati avvisati.
+    """
+    now = now or clock.now()
+    now_min = now.hour * 60 + now.minute + now.second / 60
+    rows = conn.execute(QUEUE_SQL).mappings().all()
+    if estimates is None:
+        estimates = {}
+        for event_id in {r["event_id"] for r in rows}:
+            estimates.update(get_company_estimates(conn, event_id))
+
+    offset = utc_offset()
+    now_iso = clock.utcnow().isoformat()
+    etas, updates, inserts = [], [], []
+    for (_, company_id, _), lane_rows in groupby(rows, key=lambda r: (r["event_id"], r["company_id"], r["lane"])):
+        lane_rows = list(lane_rows)
+        est = estimates.get(company_id, {})
+        projected = project_lane(
+            lane_rows, now_min,
+            duration=est.get("duration", SLOT_MINUTES),
+            lateness=max(est.get("lateness_p50", 0.0), 0.0),
+            utc_offset=offset,
+        )
+        for r in lane_rows:
+            if r["id"] not in projected:
+                continue
+            eta = min_to_hm(projected[r["id"]])
+            last = r["last_eta"] or r["slot"]
+            if abs(hm_to_min(eta) - hm_to_min(last)) < ETA_NOTIFY_MINUTES:
+                continue
+            etas.append({"b": r["id"], "eta": eta, "t": now_iso})
+            msg = (f"Your interview with {r['company']} ({r['slot']}) is now expected to start at {eta}."
+                   if eta != r["slot"] else
+                   f"Your interview with {r['company']} is back on schedule ({r['slot']}).")
+            if r["notif_id"]:
+                updates.append({"id": r["notif_id"], "m": msg, "t": now_iso})
+            else:
+                inserts.append({"e": r["event_id"], "c": r["company_id"], "s": r["student"],
+                                "slot": r["slot"], "m": msg, "t": now_iso})
+
+    if etas:
+        conn.execute(
+            text("""INSERT INTO booking_eta (booking_id, eta, updated_at) VALUES (:b, :eta, :t)
+                    ON CONFLICT(booking_id) DO UPDATE SET eta = excluded.eta, updated_at = excluded.updated_at"""),
+            etas
+        )
+    if updates:
+        # una sola notifica per prenotazione: torna "non letta" con il nuovo orario
+        conn.execute(
+            text("UPDATE notification SET message=:m, created_at=:t, read_at=NULL WHERE id=:id"), updates
+        )
+    if inserts:
+        conn.execute(
+            text("""INSERT INTO notification
+                    (event_id, company_id, student, slot_from, kind, message, created_at)
+                    VALUES (:e,:c,:s,:slot,'expected_start',:m,:t)"""),
+            inserts
+        )
+    return len(etas)
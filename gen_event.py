@@ -0,0 +1,336 @@
+# gen_event.py
+"""
+Generatore di un evento sintetico completo, per benchmark e prove su dati realistici.
+
+    python gen_event.py --db synthetic.db --students 3000 --companies 60
+    python gen_event.py --db synthetic.db --students 5000 --companies 100 --at 15:10 --force
+    DB_URL=sqlite:///synthetic.db CV_DIR=synthetic_cv streamlit run app.py
+
+Crea il DB con lo SCHEMA vero (init_db + migrate_db) e lo riempie con insert a
+blocchi in una transazione:
+- studenti con password comune (--password), presenza in plenaria e check-in;
+  solo una parte (--book-share) prenota colloqui;
+- aziende (prima quelle del seed, poi "Azienda N"), alcune con più linee, e un
+  utente hr{c}@azienda.it per azienda;
+- prenotazioni: popolarità delle aziende sbilanciata, riempimento per azienda
+  attorno a --fill, al massimo --quota colloqui per studente e mai due a meno
+  di 15 minuti; una parte con CV (PDF piccoli veri nello store a blob, con i
+  job di indicizzazione per cv_index.py);
+- round table entro ROUNDTABLE_BOOKABLE_SHARE della capienza;
+- la giornata simulata fino a --at (default: conclusa): per ogni linea durate
+  lognormali con media per azienda, arrivi rumorosi, no-show, quindi
+  interview_log con ritardi che si accumulano, interview_stats ricostruite, e
+  le notifiche "running late" / "early finish" che la giornata avrebbe generato.
+
+Stesso seed, stessi dati (anche i digest dei CV); cambiano solo i sali delle
+password e updated_at di interview_stats. Gli orari dei log sono in UTC
+come quelli scritti dall'app, gli slot in ora locale del --date indicato.
+"""
+import argparse
+import io
+import os
+import shutil
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import create_engine, text
+from werkzeug.security import generate_password_hash
+
+import core
+from auth import make_hash
+
+GIVEN = ("Luca", "Giulia", "Marco", "Sara", "Matteo", "Chiara", "Andrea", "Francesca", "Davide", "Elena",
+         "Alessandro", "Martina", "Simone", "Anna", "Federico", "Laura", "Stefano", "Valentina", "Paolo", "Irene")
+SURNAMES = ("Rossi", "Bianchi", "Ferrari", "Esposito", "Romano", "Colombo", "Ricci", "Marino", "Greco", "Bruno",
+            "Gallo", "Conti", "Moser", "Dallapiccola", "Pedrotti", "Bertoldi", "Zanella", "Fontana", "Gatti", "Leoni")
+SKILLS = ("matlab", "python", "simulink", "solidworks", "catia", "ansys", "labview", "plc", "autocad", "c++",
+          "sap", "lean", "six sigma", "cfd", "fem", "robotics", "ros", "machine learning", "supply chain")
+
+NO_SHOW_P = 0.05
+MULTI_LANE_P = 0.15      # aziende con due recruiter
+SLOT_MINUTES = 15
+
+
+def minutes(hm: str) -> int:
+    return int(hm[:2]) * 60 + int(hm[3:5])
+
+
+def fake_pdf(lines) -> bytes:
+    """PDF minimo valido (una pagina, Helvetica) con testo estraibile da pypdf."""
+    body = "BT /F1 11 Tf 50 780 Td 14 TL " + " ".join(
+        "(" + ln.replace("\\", "").replace("(", "").replace(")", "") + ") '" for ln in lines
+    ) + " ET"
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents 4 0 R "
+        "/Resources << /Font << /F1 5 0 R >> >> >>",
+        f"<< /Length {len(body)} >>\nstream\n{body}\nendstream",
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for i, obj in enumerate(objects, 1):
+        offsets.append(out.tell())
+        out.write(f"{i} 0 obj\n{obj}\nendobj\n".encode("latin-1"))
+    xref = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+    for off in offsets:
+        out.write(f"{off:010d} 00000 n \n".encode())
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+    return out.getvalue()
+
+
+def _bulk(conn, sql, rows):
+    """executemany di `rows`; una lista vuota per SQLAlchemy non è un batch vuoto ma un errore."""
+    if rows:
+        conn.execute(text(sql), rows)
+
+
+def _companies(conn, n_companies, rng):
+    """ID delle aziende dell'evento 1: le seed, poi "Azienda N" fino a n_companies."""
+    seeded = [r[0] for r in conn.execute(text("SELECT id FROM company ORDER BY id"))]
+    extra = n_companies - len(seeded)
+    if extra > 0:
+        conn.execute(text("INSERT INTO company (id, name) VALUES (:id, :n)"),
+                     [{"id": 1000 + c, "n": f"Azienda {c}"} for c in range(extra)])
+    ids = (seeded + [1000 + c for c in range(max(extra, 0))])[:n_companies]
+    lanes = np.where(rng.random(len(ids)) < MULTI_LANE_P, 2, 1)
+    conn.execute(text("DELETE FROM event_company WHERE event_id = 1"))
+    conn.execute(text("INSERT INTO event_company (event_id, company_id, lanes) VALUES (1, :c, :l)"),
+                 [{"c": c, "l": int(l)} for c, l in zip(ids, lanes)])
+    return ids, lanes
+
+
+def _assign(rng, bookers, ids, lanes, slots, fill, quota):
+    """Celle (azienda, linea, slot) riempite con studenti compatibili: una riga per prenotazione."""
+    n = len(ids)
+    popularity = 1.0 / np.arange(1, n + 1) ** 0.8
+    rng.shuffle(popularity)
+    # le aziende più richieste si riempiono, le altre restano in parte vuote
+    rank = np.argsort(np.argsort(-popularity))
+    fill_c = np.clip(fill + (0.5 - rank / max(n - 1, 1)) * 0.6, 0.05, 1.0)
+    slot_min = np.array([minutes(s) for s in slots])
+    taken = {int(s): [] for s in bookers}  # minuti degli slot già presi
+    with_company = {int(s): set() for s in bookers}
+    # ogni studente vuole 1-3 colloqui: la domanda è una lista consumata man mano
+    wanted = np.minimum(rng.choice([1, 2, 3], p=[0.4, 0.35, 0.25], size=len(bookers)), quota)
+    demand = [int(s) for s in rng.permutation(np.repeat(bookers, wanted))]
+    rows = []
+    for ci in np.argsort(-popularity):
+        for lane in range(1, int(lanes[ci]) + 1):
+            for si in np.flatnonzero(rng.random(len(slots)) < fill_c[ci]):
+                m = slot_min[si]
+                for k, s in enumerate(demand[:50]):  # i primi candidati compatibili
+                    if ci not in with_company[s] and all(abs(m - t) > SLOT_MINUTES for t in taken[s]):
+                        taken[s].append(m)
+                        with_company[s].add(ci)
+                        rows.append((ids[ci], lane, s, slots[si]))
+                        del demand[k]
+                        break
+    return rows
+
+
+def _simulate_day(rng, bookings, ids, at_min, day, utc_off):
+    """interview_log e notifiche di una giornata, linea per linea, fino ad at_min (minuti locali)."""
+    dur_mean = dict(zip(ids, np.clip(rng.normal(14.0, 2.0, len(ids)), 9.0, 20.0)))
+    by_lane = {}
+    for b in bookings:
+        by_lane.setdefault((b["company_id"], b["lane"]), []).append(b)
+    logs, notifs = [], []
+
+    def stamp(m):  # minuti locali del giorno -> ISO UTC come utcnow()
+        return (day + timedelta(minutes=float(m)) - utc_off).isoformat()
+
+    for (company, _), queue in sorted(by_lane.items()):
+        queue.sort(key=lambda b: b["slot"])
+        free_at = minutes(queue[0]["slot"]) + max(rng.normal(2.0, 3.0), -2.0)
+        sigma = 0.25
+        mu = np.log(dur_mean[company]) - sigma ** 2 / 2
+        prev = None
+        for b in queue:
+            slot_m = minutes(b["slot"])
+            if prev is not None and prev["end"] is not None and slot_m + 5 <= at_min:
+                late = prev["end"] - slot_m
+                if late >= 5:
+                    notifs.append({"c": company, "s": b["student"], "slot": prev["slot"], "k": "running_late",
+                                   "m": core.running_late_message(prev["slot"], int(late)),
+                                   "t": stamp(slot_m + 5), "read": rng.random() < 0.6, "at": slot_m + 5})
+                elif late <= -3 and prev["end"] < at_min:
+                    notifs.append({"c": company, "s": b["student"], "slot": prev["slot"], "k": "early_finish",
+                                   "m": f"Lo slot precedente ({prev['slot']}) con l'azienda è terminato in anticipo. "
+                                        "Puoi presentarti ora.",
+                                   "t": stamp(prev["end"]), "read": rng.random() < 0.6, "at": prev["end"]})
+            if slot_m >= at_min:
+                break  # giornata non ancora arrivata qui
+            if rng.random() < NO_SHOW_P:
+                logs.append({"b": b["id"], "start": None, "end": None, "status": "no-show"})
+                continue
+            start = max(slot_m + rng.normal(0.0, 1.5), free_at + 0.5)
+            if start >= at_min:
+                break
+            end = start + rng.lognormal(mu, sigma)
+            if end > at_min:
+                logs.append({"b": b["id"], "start": stamp(start), "end": None, "status": "active"})
+                break
+            logs.append({"b": b["id"], "start": stamp(start), "end": stamp(end), "status": "done"})
+            free_at = end
+            prev = {"slot": b["slot"], "end": end}
+    return logs, notifs
+
+
+def generate(eng, n_students=3000, n_companies=60, seed=1, fill=0.8, quota=3, book_share=0.3, cv_share=0.6,
+             rt_share=0.7, at=None, date="2025-11-12", password="synthetic-pw", cv_dir=None) -> dict:
+    """Popola l'evento 1 di `eng` (DB appena creato); ritorna i conteggi per tabella."""
+    rng = np.random.default_rng(seed)
+    core.init_db(eng)
+    core.migrate_db(eng)
+    slots = core.generate_slots()
+    day = datetime.fromisoformat(date)
+    utc_off = core.utc_offset()
+    at_min = minutes(at) if at else 24 * 60
+    morning = (day + timedelta(hours=9) - utc_off).isoformat()
+    # un hash per tutti: werkzeug per gli studenti, bcrypt (make_hash) per le aziende, come in auth
+    pw_hash = generate_password_hash(password)
+    company_hash = make_hash(password)
+    counts = {}
+
+    with eng.begin() as conn:
+        emails = [f"s{i}@studenti.unitn.it" for i in range(n_students)]
+        matricole = [str(200000 + i) for i in range(n_students)]
+        plenary = rng.random(n_students) < 0.8
+        conn.execute(
+            text("""INSERT INTO student (email, givenName, sn, matricola, password, plenary_attendance,
+                                         plenary_confirmed)
+                    VALUES (:e, :g, :sn, :m, :pw, :p, :pc)"""),
+            [{"e": emails[i], "g": GIVEN[g], "sn": SURNAMES[s], "m": matricole[i], "pw": pw_hash,
+              "p": int(plenary[i]), "pc": int(plenary[i] and at_min >= minutes("11:00"))}
+             for i, (g, s) in enumerate(zip(rng.integers(0, len(GIVEN), n_students),
+                                            rng.integers(0, len(SURNAMES), n_students)))]
+        )
+        _bulk(conn, "INSERT INTO checkin (event_id, student, created_at) VALUES (1, :s, :t)",
+              [{"s": emails[i], "t": morning} for i in np.flatnonzero(plenary)])
+        counts["student"] = n_students
+
+        ids, lanes = _companies(conn, n_companies, rng)
+        conn.execute(text("INSERT INTO company_user (company_id, email, password) VALUES (:c, :e, :pw)"),
+                     [{"c": c, "e": f"hr{k}@azienda.it", "pw": company_hash} for k, c in enumerate(ids)])
+        counts["company"] = len(ids)
+
+        # chi prenota colloqui; il CV (uno per studente) è condiviso da tutte le sue prenotazioni
+        bookers = rng.permutation(n_students)[:max(1, int(n_students * book_share))]
+        cvs = {}
+        if cv_dir:
+            for i in np.sort(bookers[rng.random(len(bookers)) < cv_share]):
+                skills = rng.choice(len(SKILLS), size=5, replace=False)
+                lines = [f"Curriculum vitae - {emails[i]}", "Master degree in Industrial Engineering, Trento",
+                         "Skills: " + ", ".join(SKILLS[k] for k in skills)]
+                digest, path, _ = core.store_cv_blob(conn, io.BytesIO(fake_pdf(lines)), base_dir=cv_dir)
+                cvs[int(i)] = (digest, path)
+        counts["cv_blob"] = len(cvs)
+
+        cells = _assign(rng, bookers, ids, lanes, slots, fill, quota)
+        uploaded = (day - timedelta(days=3) - utc_off).isoformat()
+        _bulk(
+            conn,
+            """INSERT INTO booking (event_id, company_id, lane, student, slot, cv_path, cv_digest,
+                                    cv_uploaded_at, status, matricola)
+               VALUES (1, :c, :l, :s, :slot, :p, :d, :u, 'manual', :m)""",
+            [{"c": c, "l": lane, "s": emails[s], "slot": slot, "m": matricole[s],
+              "p": cvs.get(s, (None, None))[1], "d": cvs.get(s, (None, None))[0],
+              "u": uploaded if s in cvs else None} for c, lane, s, slot in cells]
+        )
+        bookings = list(conn.execute(
+            text("SELECT id, company_id, lane, student, slot, cv_digest FROM booking WHERE event_id = 1")
+        ).mappings())
+        conn.execute(text("""UPDATE cv_blob SET created_at = :u, refcount = (SELECT COUNT(*) FROM booking b
+                                                                              WHERE b.cv_digest = cv_blob.digest)"""),
+                     {"u": uploaded})
+        _bulk(conn, "INSERT INTO cv_index_job (booking_id, digest, created_at) VALUES (:b, :d, :t)",
+              [{"b": b["id"], "d": b["cv_digest"], "t": uploaded} for b in bookings if b["cv_digest"]])
+        counts["booking"] = len(bookings)
+
+        conn.execute(
+            text("INSERT INTO roundtable (event_id, name, room) VALUES (1, :n, :r) ON CONFLICT DO NOTHING"),
+            [{"n": name, "r": f"Aula {k}"} for k, name in enumerate(core.ROUNDTABLE_CAPACITY, 1)]
+        )
+        tables = list(conn.execute(text("SELECT id, name FROM roundtable WHERE event_id = 1 ORDER BY id")))
+        room = {rt_id: int(core.roundtable_capacity(name) * core.ROUNDTABLE_BOOKABLE_SHARE) for rt_id, name in tables}
+        weights = np.array([room[rt_id] for rt_id, _ in tables], dtype=float)
+        rt_rows = []
+        for i in np.flatnonzero(rng.random(n_students) < rt_share):
+            free = np.array([room[rt_id] > 0 for rt_id, _ in tables])
+            if not free.any():
+                break
+            p = weights * free
+            rt_id = tables[int(rng.choice(len(tables), p=p / p.sum()))][0]
+            room[rt_id] -= 1
+            rt_rows.append({"rt": rt_id, "s": emails[i], "m": matricole[i], "t": uploaded,
+                            "a": int(at_min >= minutes("16:30") and rng.random() < 0.85)})
+        _bulk(
+            conn,
+            """INSERT INTO roundtable_booking (event_id, roundtable_id, student, created_at, attended, matricola)
+               VALUES (1, :rt, :s, :t, :a, :m)""",
+            rt_rows
+        )
+        counts["roundtable_booking"] = len(rt_rows)
+
+        logs, notifs = _simulate_day(rng, bookings, ids, at_min, day, utc_off)
+        _bulk(conn, "INSERT INTO interview_log (booking_id, start_time, end_time, status) "
+                    "VALUES (:b, :start, :end, :status)", logs)
+        _bulk(
+            conn,
+            """INSERT INTO notification (event_id, company_id, student, slot_from, kind, message, created_at, read_at)
+               VALUES (1, :c, :s, :slot, :k, :m, :t, :r)""",
+            [{**{k: n[k] for k in ("c", "s", "slot", "k", "m", "t")},
+              "r": (day + timedelta(minutes=n["at"] + 4) - utc_off).isoformat() if n["read"] else None}
+             for n in notifs]
+        )
+        core.rebuild_interview_stats(conn, 1)
+        counts["interview_log"] = len(logs)
+        counts["notification"] = len(notifs)
+    return counts
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Genera un evento sintetico nel DB indicato")
+    ap.add_argument("--db", default="synthetic.db", help="file SQLite da creare")
+    ap.add_argument("--cv-dir", help="cartella dei CV (default: <db>_cv)")
+    ap.add_argument("--students", type=int, default=3000)
+    ap.add_argument("--companies", type=int, default=60)
+    ap.add_argument("--fill", type=float, default=0.8, help="riempimento medio degli slot")
+    ap.add_argument("--quota", type=int, default=3, help="colloqui massimi per studente")
+    ap.add_argument("--book-share", type=float, default=0.3, help="studenti che prenotano colloqui")
+    ap.add_argument("--cv-share", type=float, default=0.6, help="quota di chi prenota che carica un CV")
+    ap.add_argument("--no-cv-files", action="store_true", help="prenotazioni senza CV (più veloce)")
+    ap.add_argument("--rt-share", type=float, default=0.7, help="studenti iscritti a una round table")
+    ap.add_argument("--at", help="ora locale HH:MM a cui fermare la giornata (default: conclusa)")
+    ap.add_argument("--date", default="2025-11-12", help="giorno dell'evento (YYYY-MM-DD)")
+    ap.add_argument("--password", default="synthetic-pw", help="password di studenti e aziende")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--force", action="store_true", help="sovrascrive DB e cartella CV esistenti")
+    args = ap.parse_args()
+
+    cv_dir = None if args.no_cv_files else (args.cv_dir or os.path.splitext(args.db)[0] + "_cv")
+    if os.path.exists(args.db) or (cv_dir and os.path.exists(cv_dir)):
+        if not args.force:
+            raise SystemExit(f"{args.db} o {cv_dir} esiste già: usa --force per ricrearli")
+        if os.path.exists(args.db):
+            os.remove(args.db)
+        if cv_dir:
+            shutil.rmtree(cv_dir, ignore_errors=True)
+
+    eng = create_engine(f"sqlite:///{args.db}", future=True)
+    t0 = time.perf_counter()
+    try:
+        counts = generate(eng, args.students, args.companies, args.seed, args.fill, args.quota,
+                          args.book_share, args.cv_share, args.rt_share, args.at, args.date, args.password, cv_dir)
+    finally:
+        eng.dispose()
+    print(" • ".join(f"{k} {v}" for k, v in counts.items()))
+    print(f"✅ {args.db} in {time.perf_counter() - t0:.1f}s (login: s0@studenti.unitn.it, hr0@azienda.it, "
+          f"password {args.password!r})")
+    if cv_dir:
+        print(f"   DB_URL=sqlite:///{args.db} CV_DIR={cv_dir} streamlit run app.py")
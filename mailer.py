@@ -0,0 +1,304 @@
+# mailer.py
+"""
+Invio mail in background.
+
+Le pagine non parlano mai con l'SMTP: accodano una riga in `email_outbox`
+(nella stessa transazione della prenotazione) e un worker per processo
+svuota la coda su una connessione SMTP persistente, a batch, con retry
+e backoff esponenziale.
+"""
+import smtplib
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from sqlalchemy import text
+
+from core import engine, read_secret, enqueue_email, get_student_bookings
+from tracing import end_trace, span, start_trace, traced
+
+# ------------------- CONFIG -------------------
+SMTP_HOST = read_secret("SMTP_HOST", "smtp.unitn.it")
+SMTP_PORT = int(read_secret("SMTP_PORT", 587))
+SMTP_STARTTLS = str(read_secret("SMTP_STARTTLS", "1")).lower() not in ("0", "false", "no")
+SMTP_USER = read_secret("SMTP_USER")
+SMTP_PASS = read_secret("SMTP_PASS")
+MAIL_SENDER = read_secret("MAIL_SENDER", "noreply@unitn.it")
+
+OUTBOX_ENABLED = str(read_secret("OUTBOX_WORKER", "1")).lower() not in ("0", "false", "no")
+OUTBOX_BATCH = 25               # mail per batch
+OUTBOX_POLL_SECONDS = 5         # attesa quando la coda è vuota
+OUTBOX_MAX_ATTEMPTS = 6         # poi la riga resta 'failed'
+OUTBOX_BACKOFF_SECONDS = 30     # 30s, 60s, 120s, ... (max 1h)
+OUTBOX_LEASE_SECONDS = 300      # righe 'sending' orfane tornano disponibili dopo 5 min
+SMTP_IDLE_CHECK_SECONDS = 60    # oltre questo tempo di inattività verifichiamo con NOOP
+
+
+# ------------------- Templates -------------------
+def render_booking_summary(student_name: str, interviews: list, roundtables: list) -> tuple[str, str]:
+    """Restituisce (subject, body) della mail di riepilogo prenotazioni."""
+    interviews_text = "\n".join(
+        f"- {b['company']} at {b['slot']}" for b in interviews
+    ) if interviews else "None"
+
+    roundtables_text = "\n".join(
+        f"- {name}" for name in roundtables
+    ) if roundtables else "None"
+
+    body = f"""
+    Dear {student_name},
+
+    Here is a summary of your current bookings for Industrial Engineering Day 2025:
+
+    🏛️ Plenary session: confirmed
+
+    🏢 Company interviews:
+    {interviews_text}
+
+    💬 Round tables:
+    {roundtables_text}
+
+    Please make sure to attend all booked sessions.
+    Thank you for participating!
+
+    Best regards,
+    Industrial Engineering Day Team
+    """
+    return "Your Industrial Engineering Day 2025 Bookings", body
+
+
+def enqueue_booking_summary(conn, event, student):
+    """Accoda il riepilogo prenotazioni dello studente usando la transazione `conn`."""
+    email = student["email"]
+    interviews = get_student_bookings(conn, event["id"], email)
+    roundtables = [
+        r["name"] for r in conn.execute(
+            text("""SELECT r.name
+                    FROM roundtable_booking rb
+                    JOIN roundtable r ON r.id = rb.roundtable_id
+                    WHERE rb.event_id = :e AND rb.student = :s
+                    ORDER BY r.id"""),
+            {"e": event["id"], "s": email}
+        ).mappings()
+    ]
+    subject, body = render_booking_summary(
+        f"{student['givenName']} {student['sn']}", interviews, roundtables
+    )
+    enqueue_email(conn, email, subject, body, "booking_summary", event_id=event["id"])
+
+
+def build_message(recipient: str, subject: str, body: str) -> MIMEMultipart:
+    msg = MIMEMultipart()
+    msg["From"] = MAIL_SENDER
+    msg["To"] = recipient
+    msg["Subject"] = subject
+    msg.attach(MIMEText(body, "plain"))
+    return msg
+
+
+# ------------------- SMTP -------------------
+class SmtpConnection:
+    """Connessione SMTP riusata tra un invio e l'altro; si riconnette da sola."""
+
+    def __init__(self, host=None, port=None, starttls=None, user=None, password=None, timeout=30):
+        self.host = host or SMTP_HOST
+        self.port = int(port or SMTP_PORT)
+        self.starttls = SMTP_STARTTLS if starttls is None else starttls
+        self.user = user if user is not None else SMTP_USER
+        self.password = password if password is not None else SMTP_PASS
+        self.timeout = timeout
+        self._server = None
+        self._last_used = 0.0
+        self.connects = 0
+
+    @traced("smtp.connect")
+    def _connect(self):
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            server.starttls()
+        if self.user:
+            server.login(self.user, self.password)
+        self._server = server
+        self.connects += 1
+
+    def _alive(self) -> bool:
+        if self._server is None:
+            return False
+        if time.monotonic() - self._last_used < SMTP_IDLE_CHECK_SECONDS:
+            return True
+        try:
+            return self._server.noop()[0] == 250
+        except OSError:  # include SMTPException
+            return False
+
+    def send(self, msg):
+        if not self._alive():
+            self.close()
+            self._connect()
+        try:
+            self._server.send_message(msg)
+        except smtplib.SMTPResponseException:
+            # risposta 4xx/5xx: la connessione è ancora buona, decide il chiamante
+            self._last_used = time.monotonic()
+            raise
+        except OSError:
+            # il server ha chiuso la connessione (SMTPServerDisconnected, reset, ...):
+            # un solo nuovo tentativo
+            self.close()
+            self._connect()
+            self._server.send_message(msg)
+        self._last_used = time.monotonic()
+
+    def close(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except Exception:
+                pass
+        self._server = None
+
+
+# ------------------- Worker -------------------
+def _backoff(attempts: int) -> timedelta:
+    return timedelta(seconds=min(3600, OUTBOX_BACKOFF_SECONDS * 2 ** max(0, attempts - 1)))
+
+
+class OutboxWorker(threading.Thread):
+    """Svuota `email_outbox` a batch su una sola connessione SMTP."""
+
+    def __init__(self, smtp: SmtpConnection | None = None, batch_size=OUTBOX_BATCH,
+                 poll_seconds=OUTBOX_POLL_SECONDS, db_engine=None):
+        super().__init__(name="email-outbox", daemon=True)
+        self.smtp = smtp or SmtpConnection()
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self.engine = db_engine or engine
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self.metrics = {
+            "sent": 0, "failed": 0, "retried": 0, "batches": 0,
+            "send_seconds": 0.0, "last_error": None, "started_at": None,
+        }
+
+    def _claim_batch(self):
+        now = datetime.utcnow()
+        token = uuid.uuid4().hex
+        with self.engine.begin() as conn:
+            # un solo UPDATE: in SQLite è atomico anche tra processi diversi
+            conn.execute(
+                text("""UPDATE email_outbox
+                        SET status='sending', claim_token=:tok, next_attempt_at=:lease
+                        WHERE id IN (
+                            SELECT id FROM email_outbox
+                            WHERE status IN ('pending', 'sending') AND next_attempt_at <= :now
+                            ORDER BY id
+                            LIMIT :n
+                        )"""),
+                {"tok": token, "now": now.isoformat(), "n": self.batch_size,
+                 "lease": (now + timedelta(seconds=OUTBOX_LEASE_SECONDS)).isoformat()}
+            )
+            return list(conn.execute(
+                text("""SELECT id, recipient, subject, body, kind, attempts
+                        FROM email_outbox WHERE claim_token=:tok ORDER BY id"""),
+                {"tok": token}
+            ).mappings())
+
+    def drain_once(self) -> int:
+        """Invia un batch; restituisce il numero di righe processate."""
+        rows = self._claim_batch()
+        if not rows:
+            return 0
+
+        trace = start_trace("outbox_batch", batch=len(rows))
+        sent, failed = [], []
+        t0 = time.perf_counter()
+        for r in rows:
+            try:
+                with span("smtp.send", kind=r["kind"]):
+                    self.smtp.send(build_message(r["recipient"], r["subject"], r["body"]))
+                sent.append(r["id"])
+            except Exception as e:
+                failed.append((r, str(e)[:500]))
+        elapsed = time.perf_counter() - t0
+
+        now = datetime.utcnow()
+        with self.engine.begin() as conn:
+            if sent:
+                conn.execute(
+                    text("""UPDATE email_outbox
+                            SET status='sent', sent_at=:t, attempts=attempts+1, claim_token=NULL
+                            WHERE id=:id"""),
+                    [{"id": i, "t": now.isoformat()} for i in sent]
+                )
+            if failed:
+                conn.execute(
+                    text("""UPDATE email_outbox
+                            SET status=:st, attempts=:a, last_error=:err,
+                                next_attempt_at=:next, claim_token=NULL
+                            WHERE id=:id"""),
+                    [{
+                        "id": r["id"],
+                        "a": r["attempts"] + 1,
+                        "st": "failed" if r["attempts"] + 1 >= OUTBOX_MAX_ATTEMPTS else "pending",
+                        "err": err,
+                        "next": (now + _backoff(r["attempts"] + 1)).isoformat(),
+                    } for r, err in failed]
+                )
+
+        with self._lock:
+            m = self.metrics
+            m["batches"] += 1
+            m["sent"] += len(sent)
+            m["send_seconds"] += elapsed
+            m["retried"] += sum(1 for r, _ in failed if r["attempts"] + 1 < OUTBOX_MAX_ATTEMPTS)
+            m["failed"] += sum(1 for r, _ in failed if r["attempts"] + 1 >= OUTBOX_MAX_ATTEMPTS)
+            if failed:
+                m["last_error"] = failed[-1][1]
+        end_trace(trace, sent=len(sent), failed=len(failed))
+        return len(rows)
+
+    def run(self):
+        self.metrics["started_at"] = datetime.utcnow().isoformat()
+        while not self._stop_event.is_set():
+            try:
+                n = self.drain_once()
+            except Exception as e:
+                # DB occupato o simili: riprova al prossimo giro
+                with self._lock:
+                    self.metrics["last_error"] = str(e)[:500]
+                n = 0
+            if n < self.batch_size:
+                # coda vuota (o quasi): aspetta invece di fare polling stretto
+                self._stop_event.wait(self.poll_seconds)
+        self.smtp.close()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            m = dict(self.metrics)
+        m["messages_per_sec"] = round(m["sent"] / m["send_seconds"], 2) if m["send_seconds"] else 0.0
+        m["smtp_connects"] = self.smtp.connects
+        return m
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+def start_outbox_worker() -> OutboxWorker | None:
+    """Avvia (una sola volta per processo) il worker dell'outbox."""
+    global _worker
+    if not OUTBOX_ENABLED:
+        return None
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = OutboxWorker()
+            _worker.start()
+        return _worker
+
+def get_outbox_worker() -> OutboxWorker | None:
+    return _worker
@@ -0,0 +1,207 @@
+# metrics.py
+"""
+Metriche operative in formato testo Prometheus, servite da un thread sidecar.
+
+Durante l'evento si guardavano i log di Apache; qui contatori e istogrammi in
+memoria del processo (nessuna dipendenza esterna) aggiornati dai punti che
+contano: prenotazioni confermate e rifiutate per motivo, durata dei login e dei
+rerun per pagina, sessioni attive, notifiche scritte, errori "database is locked"
+di SQLite. start_metrics_server() apre una volta per processo un endpoint HTTP
+solo su localhost (METRICS_PORT, default 9464; 0 = disattivato):
+
+    curl -s http://127.0.0.1:9464/metrics
+
+Con più processi Streamlit solo il primo ottiene la porta; gli altri raccolgono
+comunque le metriche ma non le espongono.
+
+Il modulo non importa core a livello di modulo (core lo importa per i contatori).
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ACTIVE_SESSION_SECONDS = 300
+
+_registry = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=()) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + list(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, doc, labels=()):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+        _registry.append(self)
+
+    def _key(self, labels) -> tuple:
+        return tuple(str(labels.get(n, "")) for n in self.labels)
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        if not items and not self.labels:
+            items = [((), 0)]
+        return [f"{self.name}{_labels(self.labels, k)} {v}" for k, v in items]
+
+
+class Gauge(_Metric):
+    """Valore calcolato al momento della lettura da `fn`."""
+    kind = "gauge"
+
+    def __init__(self, name, doc, fn):
+        super().__init__(name, doc)
+        self.fn = fn
+
+    def _samples(self):
+        return [f"{self.name} {self.fn()}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, doc, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, (None, 0.0))
+            if counts is None:
+                counts = [0] * (len(self.buckets) + 1)
+            counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def _samples(self):
+        with self._lock:
+            items = sorted((k, (list(c), s)) for k, (c, s) in self._values.items())
+        out = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                out.append(f"{self.name}_bucket{_labels(self.labels, key, [le])} {cumulative}")
+            out.append(f"{self.name}_sum{_labels(self.labels, key)} {total}")
+            out.append(f"{self.name}_count{_labels(self.labels, key)} {cumulative}")
+        return out
+
+
+# ------------------- sessioni attive -------------------
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def touch_session(session_id: str):
+    """Chiamata a ogni rerun: la sessione conta come attiva per ACTIVE_SESSION_SECONDS."""
+    with _sessions_lock:
+        _sessions[session_id] = time.monotonic()
+
+
+def active_sessions() -> int:
+    limit = time.monotonic() - ACTIVE_SESSION_SECONDS
+    with _sessions_lock:
+        for sid in [s for s, t in _sessions.items() if t < limit]:
+            del _sessions[sid]
+        return len(_sessions)
+
+
+# ------------------- metriche dell'app -------------------
+BOOKINGS = Counter("ied_bookings_total", "Prenotazioni colloquio confermate.", ("source",))
+BOOKING_REJECTS = Counter("ied_booking_rejects_total", "Prenotazioni colloquio rifiutate, per motivo.", ("reason",))
+LOGIN_SECONDS = Histogram("ied_login_seconds", "Durata della verifica delle credenziali.", ("role",))
+RERUN_SECONDS = Histogram("ied_rerun_seconds", "Durata di un rerun di app.py, per pagina e modo in cui finisce (done, rerun = interrotto da st.rerun()/st.stop(), error).", ("page", "end"))
+NOTIFICATIONS = Counter("ied_notifications_written_total", "Notifiche studente scritte o aggiornate.", ("kind",))
+SQLITE_BUSY = Counter("ied_sqlite_busy_errors_total", "Query fallite con 'database is locked' dopo il busy timeout.")
+ACTIVE_SESSIONS = Gauge("ied_active_sessions", f"Sessioni con un rerun negli ultimi {ACTIVE_SESSION_SECONDS} s.",
+                        active_sessions)
+
+
+def render() -> str:
+    return "\n".join(line for m in _registry for line in m.render()) + "\n"
+
+
+# ------------------- sidecar HTTP -------------------
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass  # niente log per ogni scrape
+
+
+_server = None
+_server_failed = False
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port: int | None = None, host: str = "127.0.0.1") -> ThreadingHTTPServer | None:
+    """Avvia l'endpoint una sola volta per processo, poi è un no-op."""
+    global _server, _server_failed
+    if port is None:
+        from core import read_secret
+        port = int(read_secret("METRICS_PORT", 9464))
+    if not port:
+        return None
+    with _server_lock:
+        if _server is None and not _server_failed:
+            try:
+                _server = ThreadingHTTPServer((host, port), _Handler)
+            except OSError:
+                # porta già presa (altro processo Streamlit): le metriche di questo restano interne
+                _server_failed = True
+                return None
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+        return _server
+
+
+def get_metrics_server() -> ThreadingHTTPServer | None:
+    return _server
@@ -0,0 +1,147 @@
+# notifier.py
+"""
+Notifiche di ritardo in background.
+
+Il ritardo era calcolato da render_company a ogni rerun della pagina azienda:
+nessun aggiornamento se il recruiter non cliccava, e una scrittura per ogni
+sessione aperta sulla stessa azienda. Qui un solo thread per deployment
+(lease `late_notifier` in `worker_lease`: gli altri processi restano in attesa
+e subentrano se il lease scade) ogni LATE_NOTIFIER_SECONDS legge con una query
+il colloquio corrente di ogni azienda/linea e aggiorna a batch le notifiche
+'running_late' per lo studente dello slot successivo.
+
+Nello stesso giro eta.refresh_etas() riproietta l'orario di inizio di tutta
+la coda e avvisa chi si è spostato di più di ETA_NOTIFY_MINUTES.
+
+Le notifiche di fine anticipata/annullo restano scritte dal click del
+recruiter: sono eventi, non stati da ricalcolare.
+"""
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+import clock
+from core import engine, read_secret, acquire_lease, release_lease, upsert_running_late_notifications
+from eta import refresh_etas
+from metrics import NOTIFICATIONS
+
+LATE_NOTIFIER_ENABLED = str(read_secret("LATE_NOTIFIER", "1")).lower() not in ("0", "false", "no")
+LATE_NOTIFIER_SECONDS = int(read_secret("LATE_NOTIFIER_SECONDS", 30))
+LATE_NOTIFIER_LEASE = "late_notifier"
+SLOT_MINUTES = 15
+
+# Colloquio corrente per (evento attivo, azienda, linea): quello avviato se c'è, altrimenti
+# il primo non concluso, come nella pagina azienda. Solo quelli oltre la fine dello slot,
+# con un prenotato nello slot successivo della stessa linea e su linee già avviate (almeno
+# un colloquio non più in attesa): l'evento non ha data, e prima della giornata o su una
+# linea che non usa Inizia/Termina il primo slot passato non è un ritardo (come in eta.py).
+LATE_INTERVIEWS_SQL = text("""
+    WITH open_b AS (
+        SELECT b.event_id, b.company_id, b.lane, b.slot,
+               ROW_NUMBER() OVER (
+                   PARTITION BY b.event_id, b.company_id, b.lane
+                   ORDER BY COALESCE(il.status, 'pending') = 'active' DESC, b.slot
+               ) AS rn
+        FROM booking b
+        JOIN event e ON e.id = b.event_id AND e.is_active = 1
+        LEFT JOIN interview_log il ON il.booking_id = b.id
+        WHERE COALESCE(il.status, 'pending') IN ('pending', 'active')
+    )
+    SELECT o.event_id, o.company_id, o.slot, n.student
+    FROM open_b o
+    JOIN booking n ON n.event_id = o.event_id AND n.company_id = o.company_id
+                  AND n.lane = o.lane AND n.slot = strftime('%H:%M', o.slot, :step)
+    WHERE o.rn = 1 AND o.slot < :late_from
+      AND EXISTS (
+          SELECT 1 FROM booking t JOIN interview_log tl ON tl.booking_id = t.id
+          WHERE t.event_id = o.event_id AND t.company_id = o.company_id AND t.lane = o.lane
+            AND tl.status <> 'pending'
+      )
+""")
+
+
+def scan_late(conn, now: datetime | None = None) -> int:
+    """Un giro dello scheduler: restituisce quante notifiche ha scritto o aggiornato."""
+    now = now or clock.now()
+    now_hm = datetime.strptime(now.strftime("%H:%M"), "%H:%M")
+    rows = conn.execute(
+        LATE_INTERVIEWS_SQL,
+        {"step": f"+{SLOT_MINUTES} minutes",
+         "late_from": (now_hm - timedelta(minutes=SLOT_MINUTES)).strftime("%H:%M")}
+    ).mappings().all()
+    items = []
+    for r in rows:
+        slot_end = datetime.strptime(r["slot"], "%H:%M") + timedelta(minutes=SLOT_MINUTES)
+        items.append({
+            "event_id": r["event_id"], "company_id": r["company_id"], "prev_slot": r["slot"],
+            "student": r["student"], "minutes_late": (now_hm - slot_end).total_seconds() // 60,
+        })
+    return upsert_running_late_notifications(conn, items)
+
+
+class LateNotifier(threading.Thread):
+    def __init__(self, interval=LATE_NOTIFIER_SECONDS, db_engine=None):
+        super().__init__(name="late-notifier", daemon=True)
+        self.interval = interval
+        self.engine = db_engine or engine
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._stop_event = threading.Event()
+        self.is_leader = False
+        self.scans = 0
+        self.written = 0
+        self.last_error = None
+
+    def tick(self) -> int:
+        with self.engine.begin() as conn:
+            # lease = 3 giri: un leader morto viene sostituito entro pochi intervalli
+            self.is_leader = acquire_lease(conn, LATE_NOTIFIER_LEASE, self.owner, 3 * self.interval)
+            if not self.is_leader:
+                return 0
+            n_late = scan_late(conn)
+            n_eta = refresh_etas(conn)
+        NOTIFICATIONS.inc(n_late, kind="running_late")
+        NOTIFICATIONS.inc(n_eta, kind="expected_start")
+        n = n_late + n_eta
+        self.scans += 1
+        self.written += n
+        return n
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.tick()
+            except Exception as e:
+                # DB occupato o simili: riprova al prossimo giro
+                self.last_error = str(e)[:500]
+            self._stop_event.wait(self.interval)
+        if self.is_leader:
+            try:
+                with self.engine.begin() as conn:
+                    release_lease(conn, LATE_NOTIFIER_LEASE, self.owner)
+            except Exception:
+                pass
+
+    def stop(self):
+        self._stop_event.set()
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+def start_late_notifier() -> LateNotifier | None:
+    """Avvia il thread nel processo; solo quello che detiene il lease lavora davvero."""
+    global _worker
+    if not LATE_NOTIFIER_ENABLED:
+        return None
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = LateNotifier()
+            _worker.start()
+        return _worker
+
+def get_late_notifier() -> LateNotifier | None:
+    return _worker
@@ -1,22 +1,57 @@
 # page_admin.py
 import streamlit as st
 import pandas as pd
-from sqlalchemy import text
+import os
+from datetime import datetime
+from sqlalchemy import bindparam, text
 from core import (
     engine,
     get_active_event,
     get_companies,
     get_bookings_with_logs,
     get_roundtables,
-    generate_slots,
+    get_event_slots,
+    get_outbox_counts,
+    release_cv_blobs,
+    unindex_cv_bookings,
+    search_students,
+    get_booking_settings,
+    set_booking_mode,
+    promote_from_waitlist,
+    get_company_lanes,
+    set_company_lanes,
+    free_lane,
+    get_full_slots,
+    QUERY_STATS_ENABLED,
+    SLOW_QUERY_MS,
+    get_query_stats,
+    get_query_scopes,
+    get_slow_queries,
+    reset_query_stats,
 )
+from mailer import get_outbox_worker
+from profiler import MODES, cancel_profile, get_profile_request, list_profiles, request_profile, top_frames
+from scheduler import DEFAULT_QUOTA, run_scheduler
+from reschedule import parse_ranges, rebook_dropout, shift_bookings
 
 ROUND_TABLE_CAPACITY = {1:140, 2:140, 3:73, 4:130, 5:113, 6:68}
 
 def render_admin(event):
     st.title("Area Admin")
-    tab_plenaria, tab_rosters, tab_roundtables = st.tabs([
-        "Plenaria", "Aziende", "Tavole Rotonde"
+
+    # Ricerca studenti condivisa da tutte le schede (indice su nome, cognome, email, matricola)
+    search_query = st.text_input(
+        "🔎 Cerca studente (nome, cognome, email o matricola)",
+        key="admin_student_search"
+    ).strip()
+    hits = None
+    if search_query:
+        with engine.begin() as conn:
+            hits = search_students(conn, event["id"], search_query)
+        st.caption(f"{len(hits['students'])} studenti trovati • {len(hits['booking_ids'])} prenotazioni colloqui")
+
+    tab_plenaria, tab_rosters, tab_roundtables, tab_prefs, tab_email, tab_queries, tab_profiler = st.tabs([
+        "Plenaria", "Aziende", "Tavole Rotonde", "Preferenze", "Email", "Query", "Profiler"
     ])
 
     # -----------------------------
@@ -27,13 +62,19 @@ def render_admin(event):
         
         with engine.begin() as conn:
             # Recupera gli studenti con eventuale stato di conferma
-            students = list(conn.execute(
-                text("""
-                    SELECT id, givenName, sn, email, matricola, plenary_confirmed
-                    FROM student
-                    ORDER BY sn COLLATE NOCASE, givenName COLLATE NOCASE
-                """)
-            ).mappings())
+            q = text(f"""
+                SELECT id, givenName, sn, email, matricola, plenary_confirmed
+                FROM student
+                {"WHERE id IN :ids" if hits is not None else ""}
+                ORDER BY sn COLLATE NOCASE, givenName COLLATE NOCASE
+            """)
+            if hits is None:
+                students = list(conn.execute(q).mappings())
+            elif hits["student_ids"]:
+                q = q.bindparams(bindparam("ids", expanding=True))
+                students = list(conn.execute(q, {"ids": list(hits["student_ids"])}).mappings())
+            else:
+                students = []
 
         if students:
             st.write("**Studente – Matricola – Presenza effettiva alla plenaria**")
@@ -82,43 +123,118 @@ def render_admin(event):
             with engine.begin() as conn:
                 all_companies = get_companies(conn, event["id"])
 
-            col1, col2 = st.columns([2, 2])
-            with col1:
-                selected_company = st.selectbox(
-                    "Filtra per azienda",
-                    ["Tutte"] + [c["name"] for c in all_companies],
-                    key="filter_company"
-                )
-
-            with col2:
-                search_student = st.text_input(
-                    "Cerca per nome studente o email",
-                    key="filter_student"
-                ).strip().lower()
-
-        with engine.begin() as conn:
-            companies = all_companies if selected_company == "Tutte" else [
-                c for c in all_companies if c["name"] == selected_company
-            ]
+            selected_company = st.selectbox(
+                "Filtra per azienda",
+                ["Tutte"] + [c["name"] for c in all_companies],
+                key="filter_company"
+            )
+            st.caption("Per cercare uno studente usa la ricerca in cima alla pagina.")
 
-            # Recupero tutte le informazioni degli studenti
-            students_info = conn.execute(
-                text("SELECT email, givenName, sn, matricola FROM student")
-            ).mappings()
-            students_map = {s["email"].lower(): s for s in students_info}
+        # --- Spostamento di massa (es. plenaria in ritardo): una transazione, una notifica per studente ---
+        with st.expander("⏩ Sposta colloqui"):
+            with engine.begin() as conn:
+                event_slots = get_event_slots(conn, event["id"])
+            shift_mode = st.radio(
+                "Tipo di spostamento", ["Di N minuti", "Nuovo calendario"], horizontal=True, key="shift_mode"
+            )
+            shift_args = {}
+            if shift_mode == "Di N minuti":
+                shift_args["minutes"] = int(st.number_input(
+                    "Minuti (negativi = anticipa)", min_value=-240, max_value=240, value=30, step=5, key="shift_minutes"
+                ))
+                from_choice = st.selectbox(
+                    "A partire dallo slot", ["Tutta la giornata"] + event_slots, key="shift_from"
+                )
+                shift_args["from_slot"] = None if from_choice == "Tutta la giornata" else from_choice
+                shift_companies = st.multiselect(
+                    "Solo queste aziende (vuoto = tutte, e si sposta anche il calendario)",
+                    [c["name"] for c in all_companies], key="shift_companies"
+                )
+                shift_args["company_ids"] = [c["id"] for c in all_companies if c["name"] in shift_companies]
+            else:
+                ranges_spec = st.text_input(
+                    "Nuovi intervalli (lo slot i-esimo va sull'i-esimo)", value="11:30-13:00, 15:00-17:00",
+                    key="shift_ranges"
+                )
+            st.caption(f"Calendario attuale: {event_slots[0]}–{event_slots[-1]} ({len(event_slots)} slot)"
+                       if event_slots else "Calendario vuoto")
+
+            colA, colB = st.columns(2)
+            preview = colA.button("🔍 Anteprima", key="shift_preview")
+            apply = colB.button("✅ Applica", key="shift_apply")
+            if preview or apply:
+                try:
+                    if shift_mode == "Nuovo calendario":
+                        shift_args["ranges"] = parse_ranges(ranges_spec)
+                    with engine.begin() as conn:
+                        res = shift_bookings(conn, event["id"], dry_run=preview, **shift_args)
+                    if res["conflicts"]:
+                        st.error(f"❌ {res['n_conflicts']} conflitti, nessuna modifica:\n\n- "
+                                 + "\n- ".join(res["conflicts"]))
+                    elif res["written"]:
+                        st.success(f"✅ Spostati {res['moved']} colloqui, avvisati {res['students']} studenti "
+                                   f"({res['elapsed_s']}s)")
+                    else:
+                        st.info(f"🔍 Verrebbero spostati {res['moved']} colloqui di {res['students']} studenti; "
+                                f"nuovo calendario {res['schedule'][0]}–{res['schedule'][-1]}")
+                except ValueError as ex:
+                    st.error(str(ex))
+
+        # --- Azienda che si ritira: i suoi studenti vengono ricollocati in blocco ---
+        with st.expander("🚫 Azienda ritirata"):
+            dropout_name = st.selectbox("Azienda", [c["name"] for c in all_companies], key="dropout_company")
+            dropout_prefs = st.checkbox("Usa le preferenze degli studenti", value=True, key="dropout_prefs")
+            now_hm = datetime.now().strftime("%H:%M")
+            upcoming = [s for s in event_slots if s >= now_hm]
+            dropout_from = st.selectbox(
+                "Ricolloca a partire dallo slot", event_slots,
+                index=event_slots.index(upcoming[0]) if upcoming else 0, key="dropout_from"
+            )
+            st.caption("Ogni studente va sul primo slot libero compatibile da quell'orario in poi; "
+                       "l'azienda esce dall'evento e le sue code si chiudono.")
+            colA, colB = st.columns(2)
+            preview = colA.button("🔍 Anteprima", key="dropout_preview")
+            apply = colB.button("🚫 Ritira e ricolloca", key="dropout_apply")
+            if dropout_name and (preview or apply):
+                dropout_id = next(c["id"] for c in all_companies if c["name"] == dropout_name)
+                with engine.begin() as conn:
+                    res = rebook_dropout(conn, event["id"], dropout_id, use_preferences=dropout_prefs,
+                                         not_before=dropout_from, dry_run=preview)
+                msg = (f"{res['rebooked']}/{res['affected']} colloqui ricollocati "
+                       f"({res['from_preferences']} su aziende nelle preferenze)")
+                if res["written"]:
+                    st.success(f"✅ {msg} in {res['elapsed_s']}s")
+                else:
+                    st.info(f"🔍 {msg}")
+                if res["stranded"]:
+                    st.warning("Senza posto: " + ", ".join(res["stranded"]))
+
+        companies = all_companies if selected_company == "Tutte" else [
+            c for c in all_companies if c["name"] == selected_company
+        ]
+        if hits is not None:
+            # solo le aziende con prenotazioni degli studenti trovati
+            hit_companies = {b["company_id"] for s in hits["students"] for b in s["bookings"]}
+            companies = [c for c in companies if c["id"] in hit_companies]
+            students_map = {s["email"]: s for s in hits["students"] if s["id"] is not None}
+        else:
+            with engine.begin() as conn:
+                # Recupero tutte le informazioni degli studenti
+                students_info = conn.execute(
+                    text("SELECT email, givenName, sn, matricola FROM student")
+                ).mappings()
+                students_map = {s["email"].lower(): s for s in students_info}
 
         df_show_all = []
 
         for c in companies:
             st.markdown(f"### 🏢 {c['name']}")
             with engine.begin() as conn:
-                bookings = get_bookings_with_logs(conn, event["id"], c["id"])
-
-            if search_student:
-                bookings = [
-                    b for b in bookings
-                    if search_student in (b["student"] or "").lower()
-                ]
+                lanes = get_company_lanes(conn, event["id"], c["id"])
+                bookings = get_bookings_with_logs(
+                    conn, event["id"], c["id"],
+                    booking_ids=hits["booking_ids"] if hits is not None else None
+                )
 
             # Prepara lista ordinata per il DataFrame
             df_rows = []
@@ -135,6 +251,7 @@ def render_admin(event):
                     "Matricola": student_data.get("matricola", ""),
                     "Email": email,
                     "Orario": b.get("slot", ""),
+                    "Linea": b.get("lane", 1),
                     "CV / Link": b.get("cv", ""),
                     "Stato": b.get("status", ""),
                     "Inizio": b.get("start_time", ""),
@@ -153,11 +270,27 @@ def render_admin(event):
                     with cols[1]:
                         st.write("")
                     with cols[2]:
-                        st.write(f"🕒 {b['Orario']}")
+                        st.write(f"🕒 {b['Orario']}" + (f" · L{b['Linea']}" if lanes > 1 else ""))
                     with cols[3]:
                         if st.button("❌ Cancella", key=f"del_{c['id']}_{b['Email']}_{b['Orario']}"):
                             try:
                                 with engine.begin() as conn:
+                                    params = {
+                                        "e": event["id"],
+                                        "c": c["id"],
+                                        "slot": b["Orario"],
+                                        "email_pattern": f"%{b['Email'].lower()}%",
+                                    }
+                                    deleted = list(conn.execute(
+                                        text("""
+                                            SELECT id, cv_digest FROM booking
+                                            WHERE event_id = :e
+                                            AND company_id = :c
+                                            AND slot = :slot
+                                            AND LOWER(student) LIKE :email_pattern
+                                        """),
+                                        params,
+                                    ))
                                     conn.execute(
                                         text("""
                                             DELETE FROM booking 
@@ -166,14 +299,14 @@ def render_admin(event):
                                             AND slot = :slot
                                             AND LOWER(student) LIKE :email_pattern
                                         """),
-                                        {
-                                            "e": event["id"],
-                                            "c": c["id"],
-                                            "slot": b["Orario"],
-                                            "email_pattern": f"%{b['Email'].lower()}%",
-                                        },
+                                        params,
                                     )
+                                    release_cv_blobs(conn, [r[1] for r in deleted])
+                                    unindex_cv_bookings(conn, [r[0] for r in deleted])
+                                    promoted = promote_from_waitlist(conn, event["id"], c["id"], b["Orario"]) if deleted else None
                                 st.success(f"🗑️ Prenotazione rimossa per {b['Email']} alle {b['Orario']}")
+                                if promoted:
+                                    st.info(f"📋 Slot assegnato a {promoted} dalla lista d'attesa")
                                 st.rerun()
                             except Exception as ex:
                                 st.error(f"Errore durante la cancellazione: {ex}")
@@ -182,6 +315,20 @@ def render_admin(event):
                 df_show = pd.DataFrame(df_rows).sort_values("Orario")
                 df_show_all.append(df_show)
 
+            # --- Recruiter in parallelo: ogni linea ha il suo calendario di slot ---
+            with st.expander(f"⚙️ Linee parallele per {c['name']} (attuali: {lanes})"):
+                new_lanes = st.number_input(
+                    "Numero di recruiter che fanno colloqui in parallelo",
+                    min_value=1, max_value=10, value=lanes, key=f"lanes_{c['id']}"
+                )
+                if st.button("💾 Salva linee", key=f"save_lanes_{c['id']}"):
+                    try:
+                        with engine.begin() as conn:
+                            set_company_lanes(conn, event["id"], c["id"], new_lanes)
+                        st.rerun()
+                    except ValueError as ex:
+                        st.error(str(ex))
+
             # --- Form per aggiungere prenotazioni manuali ---
             with st.expander(f"➕ Aggiungi prenotazione per {c['name']}"):
                 with st.form(f"add_booking_{c['id']}"):
@@ -191,9 +338,10 @@ def render_admin(event):
                     with colB:
                         student_email = st.text_input("Email studente", key=f"email_{c['id']}")
 
-                    # Genera lista slot disponibili
-                    available_slots = generate_slots()
-                    booked_slots = {r["slot"] for r in bookings}
+                    # Genera lista slot disponibili (pieno = tutte le linee occupate)
+                    with engine.begin() as conn:
+                        available_slots = get_event_slots(conn, event["id"])
+                        booked_slots = get_full_slots(conn, event["id"], c["id"])
                     free_slots = [s for s in available_slots if s not in booked_slots]
 
                     slot_choice = st.selectbox(
@@ -212,15 +360,19 @@ def render_admin(event):
                             student_identifier = f"{student_name} <{student_email}>"
                             try:
                                 with engine.begin() as conn:
+                                    lane = free_lane(conn, event["id"], c["id"], slot_choice)
+                                    if lane is None:
+                                        raise ValueError(f"slot {slot_choice} già pieno")
                                     conn.execute(
                                         text("""
-                                            INSERT INTO booking (event_id, company_id, student, slot, cv, status)
-                                            VALUES (:e, :c, :s, :slot, :cv, 'manual')
+                                            INSERT INTO booking (event_id, company_id, lane, student, slot, cv, status)
+                                            VALUES (:e, :c, :lane, :s, :slot, :cv, 'manual')
                                             ON CONFLICT(event_id, company_id, student, slot) DO NOTHING
                                         """),
                                         {
                                             "e": event["id"],
                                             "c": c["id"],
+                                            "lane": lane,
                                             "s": student_identifier,
                                             "slot": slot_choice,
                                             "cv": cv_link or None,
@@ -256,19 +408,23 @@ def render_admin(event):
             # ---------------------------------
             # LOOP PRINCIPALE SU ROUND TABLES
             # ---------------------------------
+            q_rt = text(f"""
+                SELECT s.givenName, s.sn, s.matricola, s.email,
+                    r.attended
+                FROM roundtable_booking r
+                JOIN student s ON s.email = r.student
+                WHERE r.roundtable_id=:rt_id
+                AND r.event_id=:event_id
+                {"AND s.id IN :ids" if hits is not None else ""}
+                ORDER BY s.sn COLLATE NOCASE ASC, s.givenName COLLATE NOCASE ASC
+            """)
+            rt_params = {"event_id": event["id"]}
+            if hits is not None:
+                q_rt = q_rt.bindparams(bindparam("ids", expanding=True))
+                rt_params["ids"] = list(hits["student_ids"]) or [-1]
+
             for rt in rts:
-                bookings = list(conn.execute(
-                    text("""
-                        SELECT s.givenName, s.sn, s.matricola, s.email,
-                            r.attended
-                        FROM roundtable_booking r
-                        JOIN student s ON s.email = r.student
-                        WHERE r.roundtable_id=:rt_id
-                        AND r.event_id=:event_id
-                        ORDER BY s.sn COLLATE NOCASE ASC, s.givenName COLLATE NOCASE ASC
-                    """),
-                    {"rt_id": rt["id"], "event_id": event["id"]}
-                ).mappings())
+                bookings = list(conn.execute(q_rt, {**rt_params, "rt_id": rt["id"]}).mappings())
 
                 if not bookings:
                     continue
@@ -394,3 +550,192 @@ def render_admin(event):
                 file_name="presenze_roundtables.csv",
                 mime="text/csv"
             )
+
+
+    # -----------------------------
+    # Preferenze + assegnazione automatica
+    # -----------------------------
+    with tab_prefs:
+        st.subheader("🎯 Prenotazione per preferenze")
+
+        with engine.begin() as conn:
+            settings = get_booking_settings(conn, event["id"])
+            pref_stats = conn.execute(
+                text("""
+                    SELECT COUNT(DISTINCT student) AS students, COUNT(*) AS prefs
+                    FROM booking_preference WHERE event_id = :e
+                """),
+                {"e": event["id"]}
+            ).mappings().first()
+
+        st.write(
+            f"Modalità attuale: **{'preferenze' if settings['mode'] == 'preferences' else 'libera (FCFS)'}**"
+            + (f" • finestra aperta fino a {settings['close_at'].replace('T', ' ')}" if settings["window_open"] and settings["close_at"] else "")
+            + (" • finestra chiusa" if settings["mode"] == "preferences" and not settings["window_open"] else "")
+        )
+        st.caption(f"{pref_stats['students']} studenti hanno indicato {pref_stats['prefs']} preferenze.")
+
+        with st.form("booking_mode_form"):
+            mode = st.radio(
+                "Modalità di prenotazione",
+                ["fcfs", "preferences"],
+                index=0 if settings["mode"] == "fcfs" else 1,
+                format_func=lambda m: "Libera (FCFS)" if m == "fcfs" else "Finestra preferenze",
+                horizontal=True,
+            )
+            col1, col2 = st.columns(2)
+            with col1:
+                close_date = st.date_input("Chiusura finestra (data)", value=None)
+            with col2:
+                close_time = st.time_input("Ora", value=None)
+            if st.form_submit_button("💾 Salva modalità"):
+                close_at = None
+                if close_date and close_time:
+                    close_at = f"{close_date.isoformat()}T{close_time.strftime('%H:%M')}"
+                with engine.begin() as conn:
+                    set_booking_mode(conn, event["id"], mode, close_at)
+                st.rerun()
+
+        st.markdown("#### Assegnazione automatica")
+        quota = st.number_input("Colloqui massimi per studente", 1, 14, DEFAULT_QUOTA)
+        col1, col2 = st.columns(2)
+        with col1:
+            simulate = st.button("🔍 Simula")
+        with col2:
+            assign_now = st.button("⚙️ Assegna e scrivi prenotazioni", disabled=settings["window_open"])
+        if simulate or assign_now:
+            with st.spinner("Assegnazione in corso..."):
+                res = run_scheduler(event["id"], quota=int(quota), dry_run=not assign_now)
+            st.success(
+                f"{'Scritti' if res['written'] else 'Simulati'} {res['assigned']} colloqui per "
+                f"{res['students']} studenti • senza colloqui: {res['students_without_interview']} • "
+                f"calcolo {res['solve_s']}s"
+            )
+            if res["by_rank"]:
+                st.bar_chart(pd.Series(res["by_rank"], name="colloqui per rango"))
+
+    # -----------------------------
+    # Email outbox
+    # -----------------------------
+    with tab_email:
+        st.subheader("📧 Coda email")
+
+        with engine.begin() as conn:
+            counts = get_outbox_counts(conn)
+            failed = list(conn.execute(
+                text("""
+                    SELECT id, recipient, kind, attempts, last_error, created_at
+                    FROM email_outbox
+                    WHERE status = 'failed'
+                    ORDER BY id DESC
+                    LIMIT 50
+                """)
+            ).mappings())
+
+        cols = st.columns(4)
+        for col, status in zip(cols, ("pending", "sending", "sent", "failed")):
+            col.metric(status, counts.get(status, 0))
+
+        worker = get_outbox_worker()
+        if worker and worker.is_alive():
+            stats = worker.stats()
+            st.caption(
+                f"Worker attivo • inviate {stats['sent']} • retry {stats['retried']} • "
+                f"fallite {stats['failed']} • {stats['messages_per_sec']} msg/s • "
+                f"connessioni SMTP {stats['smtp_connects']}"
+            )
+            if stats["last_error"]:
+                st.caption(f"Ultimo errore: {stats['last_error']}")
+        else:
+            st.warning("Worker email non attivo in questo processo (OUTBOX_WORKER=0?).")
+
+        if failed:
+            st.write("**Email fallite (ultime 50)**")
+            st.dataframe(pd.DataFrame(failed), use_container_width=True)
+            if st.button("🔁 Riprova email fallite"):
+                with engine.begin() as conn:
+                    conn.execute(text("""
+                        UPDATE email_outbox
+                        SET status = 'pending', attempts = 0, next_attempt_at = created_at
+                        WHERE status = 'failed'
+                    """))
+                st.rerun()
+
+    # -----------------------------
+    # Statistiche query
+    # -----------------------------
+    with tab_queries:
+        st.subheader("⏱️ Query SQL più costose")
+        if not QUERY_STATS_ENABLED:
+            st.warning("Statistiche disattivate in questo processo (QUERY_STATS=0).")
+        else:
+            c1, c2, c3 = st.columns([2, 2, 1])
+            scopes = get_query_scopes()
+            scope = c1.selectbox("Pagina / ruolo", ["tutte"] + [s["scope"] for s in scopes], key="qstats_scope")
+            order = c2.selectbox("Ordina per", ["total_ms", "max_ms", "count", "avg_ms"], key="qstats_order")
+            top = c3.number_input("Top", min_value=5, max_value=200, value=20, step=5, key="qstats_top")
+            live = st.checkbox("Aggiornamento automatico (5 s)", key="qstats_live")
+            # solo il frammento si riesegue: niente rerun dell'intera pagina admin
+            st.fragment(_render_query_stats, run_every=5 if live else None)(
+                None if scope == "tutte" else scope, order, int(top)
+            )
+            if st.button("🧹 Azzera statistiche", key="qstats_reset"):
+                reset_query_stats()
+                st.rerun()
+
+    # -----------------------------
+    # Profiler a richiesta
+    # -----------------------------
+    with tab_profiler:
+        st.subheader("🔬 Profila i prossimi rerun")
+        c1, c2, c3 = st.columns([2, 1, 2])
+        prof_role = c1.selectbox("Ruolo", ["student", "company", "admin"], key="prof_role")
+        prof_runs = c2.number_input("Rerun", min_value=1, max_value=50, value=5, key="prof_runs")
+        prof_mode = c3.radio("Modalità", MODES, horizontal=True, key="prof_mode",
+                             help="cprofile: esatto ma rallenta la pagina; sampling: campioni ogni pochi ms")
+        if st.button("▶️ Avvia profiling", key="prof_start"):
+            request_profile(prof_role, int(prof_runs), prof_mode)
+            st.rerun()
+
+        req = get_profile_request()
+        if req:
+            st.info(f"In attesa: {req['remaining']} rerun di **{req['role']}** ({req['mode']}), "
+                    f"richiesto alle {req['requested_at']} • vale solo per questo processo")
+            if st.button("⏹️ Annulla", key="prof_cancel"):
+                cancel_profile()
+                st.rerun()
+
+        profiles = list_profiles()
+        if not profiles:
+            st.caption("Nessun profilo salvato.")
+        else:
+            st.dataframe(pd.DataFrame(profiles)[["profilo", "creato", "ruolo", "modalità", "ms"]],
+                         use_container_width=True, hide_index=True)
+            chosen = st.selectbox("Profilo", [p["profilo"] for p in profiles], key="prof_chosen")
+            p = next(p for p in profiles if p["profilo"] == chosen)
+            st.dataframe(pd.DataFrame(top_frames(p["folded"])), use_container_width=True, hide_index=True)
+            d1, d2 = st.columns(2)
+            with open(p["folded"], "rb") as f:
+                d1.download_button("⬇️ .folded (flamegraph / speedscope)", f.read(),
+                                   file_name=os.path.basename(p["folded"]), key="prof_dl_folded")
+            if p["prof"]:
+                with open(p["prof"], "rb") as f:
+                    d2.download_button("⬇️ .prof (snakeviz / pstats)", f.read(),
+                                       file_name=os.path.basename(p["prof"]), key="prof_dl_prof")
+
+
+def _render_query_stats(scope, order, top):
+    rows = get_query_stats(scope=scope, top=top, order=order)
+    if rows:
+        st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+    else:
+        st.info("Nessuna query registrata.")
+    st.write("**Per pagina / ruolo**")
+    st.dataframe(pd.DataFrame(get_query_scopes()), use_container_width=True, hide_index=True)
+    slow = get_slow_queries()
+    st.write(f"**Query lente (≥ {SLOW_QUERY_MS:.0f} ms, parametri oscurati)**")
+    if slow:
+        st.dataframe(pd.DataFrame([{**q, "params": str(q["params"])} for q in slow]),
+                     use_container_width=True, hide_index=True)
+    else:
+        st.caption("Nessuna.")
@@ -1,25 +1,59 @@
 # page_company.py
 import os
+import time
 import streamlit as st
 import pandas as pd
 from sqlalchemy import text
 from datetime import datetime, timedelta
 
-from core import engine, get_bookings_with_logs, upsert_running_late_notification
+import clock
+from core import (
+    engine, get_bookings_with_logs, sanitize_filename, search_cvs,
+    release_booking, waitlist_length, walkin_current, walkin_waiting, walkin_pop, walkin_start,
+    walkin_finish, pull_walkin_if_free, booked_student_due, get_company_lanes, record_interview_stats,
+    mark_no_show,
+)
+from metrics import NOTIFICATIONS
+from cv_files import is_cv_link, cv_file_meta, open_cv_stream, format_size, build_company_cv_bundle
 
-def render_company(event):
-    """Render the Company area (unchanged behavior)."""
-    st.title("Area Azienda")
-    cid = st.session_state.get("company_id")
-    if not cid:
-        st.error("Nessuna azienda associata all'utente.")
-        return
 
-    with engine.begin() as conn:
-        name = conn.execute(text("SELECT name FROM company WHERE id=:id"), {"id": cid}).scalar()
-        event_id = conn.execute(text("SELECT id FROM event WHERE is_active=1 LIMIT 1")).scalar()
+def _notify_next_slot(wconn, event_id_, company_id_, lane, curr_slot: str, kind: str, msg: str):
+    """Avvisa lo studente prenotato nello slot successivo della stessa linea."""
+    try:
+        slot_start = datetime.strptime(curr_slot, "%H:%M")
+        next_slot = (slot_start + timedelta(minutes=15)).strftime("%H:%M")
+        nxt = wconn.execute(
+            text("""SELECT student FROM booking 
+                    WHERE event_id=:e AND company_id=:c AND lane=:l AND slot=:s"""),
+            {"e": event_id_, "c": company_id_, "l": lane, "s": next_slot}
+        ).mappings().first()
+        if nxt:
+            wconn.execute(
+                text("""INSERT INTO notification 
+                        (event_id, company_id, student, slot_from, kind, message, created_at)
+                        VALUES (:e,:c,:s,:slot,:k,:m,:t)"""),
+                {"e": event_id_, "c": company_id_, "s": nxt["student"],
+                 "slot": curr_slot, "k": kind, "m": msg, "t": clock.utcnow().isoformat()}
+            )
+            NOTIFICATIONS.inc(kind=kind)
+    except Exception:
+        pass
+
+
+WAITLIST_HELP = "Lo slot passa al primo idoneo in lista d'attesa, se c'è, finché non è finito."
+
 
-    current_id = st.session_state.get("current_booking_id")
+def _after_release(lane, slot, promoted):
+    if promoted:
+        st.toast(f"Slot {slot} riassegnato a {promoted} dalla lista d'attesa")
+    st.session_state.pop(f"current_booking_id_{lane}", None)
+    st.session_state.pop(f"started_at_{lane}", None)
+    st.rerun()
+
+
+def _render_lane(event_id, cid, lane):
+    """Coda di colloqui di una linea: prossimo prenotato, inizio/fine/annullo."""
+    current_id = st.session_state.get(f"current_booking_id_{lane}")
 
     if current_id:
         with engine.begin() as conn:
@@ -33,8 +67,8 @@ def render_company(event):
                     {"b": current_b["id"]}
                 ).scalar()
                 if st_record in ("done", "cancelled", "no-show"):
-                    st.session_state.pop("current_booking_id", None)
-                    st.session_state.pop("started_at", None)
+                    st.session_state.pop(f"current_booking_id_{lane}", None)
+                    st.session_state.pop(f"started_at_{lane}", None)
                     current_b = None
     else:
         with engine.begin() as conn:
@@ -45,61 +79,17 @@ def render_company(event):
                     LEFT JOIN interview_log il ON il.booking_id = b.id
                     WHERE b.event_id = :e
                       AND b.company_id = :c
+                      AND b.lane = :l
                       AND (il.status IS NULL OR il.status='pending' OR il.status='active')
                     ORDER BY b.slot ASC
                     LIMIT 1
                 """),
-                {"e": event_id, "c": cid}
+                {"e": event_id, "c": cid, "l": lane}
             ).mappings().first()
 
-    # --- Se il colloquio corrente sfora il suo slot, avvisa il prossimo studente con i minuti di ritardo
-    if current_b:
-        with engine.begin() as wconn:
-            st_rec = wconn.execute(
-                text("SELECT COALESCE(status, 'pending') FROM interview_log WHERE booking_id=:b"),
-                {"b": current_b["id"]}
-            ).scalar()
-            if st_rec in ("pending", "active"):
-                slot_start = datetime.strptime(current_b["slot"], "%H:%M")
-                slot_end = slot_start + timedelta(minutes=15)
-                now_hm = datetime.strptime(datetime.now().strftime("%H:%M"), "%H:%M")
-                if now_hm > slot_end:
-                    minutes_late = int((now_hm - slot_end).total_seconds() // 60)
-                    next_slot = (slot_start + timedelta(minutes=15)).strftime("%H:%M")
-                    nxt = wconn.execute(
-                        text("""SELECT student FROM booking 
-                                WHERE event_id=:e AND company_id=:c AND slot=:s"""),
-                        {"e": event_id, "c": cid, "s": next_slot}
-                    ).mappings().first()
-                    if nxt:
-                        upsert_running_late_notification(
-                            wconn, event_id, cid, current_b["slot"], nxt["student"], minutes_late
-                        )
-
-    st.subheader(f"Prossimo colloquio – {name}")
     if current_b:
         st.markdown(f"### 🕒 {current_b['slot']} – Studente: **{current_b['student']}**")
-        colA, colB, colC = st.columns(3)
-
-        def _notify_next_slot(wconn, event_id_, company_id_, curr_slot: str, kind: str, msg: str):
-            try:
-                slot_start = datetime.strptime(curr_slot, "%H:%M")
-                next_slot = (slot_start + timedelta(minutes=15)).strftime("%H:%M")
-                nxt = wconn.execute(
-                    text("""SELECT student FROM booking 
-                            WHERE event_id=:e AND company_id=:c AND slot=:s"""),
-                    {"e": event_id_, "c": company_id_, "s": next_slot}
-                ).mappings().first()
-                if nxt:
-                    wconn.execute(
-                        text("""INSERT INTO notification 
-                                (event_id, company_id, student, slot_from, kind, message, created_at)
-                                VALUES (:e,:c,:s,:slot,:k,:m,:t)"""),
-                        {"e": event_id_, "c": company_id_, "s": nxt["student"],
-                         "slot": curr_slot, "k": kind, "m": msg, "t": datetime.utcnow().isoformat()}
-                    )
-            except Exception:
-                pass
+        colA, colB, colC, colD = st.columns(4)
 
         with colA:
             if st.button("▶️ Inizia", key=f"start_{current_b['id']}", use_container_width=True):
@@ -110,10 +100,10 @@ def render_company(event):
                             VALUES (:b, :t, 'active')
                             ON CONFLICT(booking_id) DO UPDATE SET start_time=:t, status='active'
                         """),
-                        {"b": current_b["id"], "t": datetime.utcnow().isoformat()}
+                        {"b": current_b["id"], "t": clock.utcnow().isoformat()}
                     )
-                st.session_state["current_booking_id"] = current_b["id"]
-                st.session_state["started_at"] = datetime.utcnow().isoformat()
+                st.session_state[f"current_booking_id_{lane}"] = current_b["id"]
+                st.session_state[f"started_at_{lane}"] = clock.utcnow().isoformat()
                 st.rerun()
 
         with colB:
@@ -121,20 +111,24 @@ def render_company(event):
                 with engine.begin() as wconn:
                     wconn.execute(
                         text("UPDATE interview_log SET end_time=:t, status='done' WHERE booking_id=:b"),
-                        {"b": current_b["id"], "t": datetime.utcnow().isoformat()}
+                        {"b": current_b["id"], "t": clock.utcnow().isoformat()}
                     )
+                    record_interview_stats(wconn, current_b["id"])
                     slot_start = datetime.strptime(current_b["slot"], "%H:%M")
                     slot_end = slot_start + timedelta(minutes=15)
-                    now_hm = datetime.strptime(datetime.now().strftime("%H:%M"), "%H:%M")
+                    now_hm = datetime.strptime(clock.now().strftime("%H:%M"), "%H:%M")
                     if now_hm < slot_end:
                         msg = f"Lo slot precedente ({current_b['slot']}) è terminato in anticipo. Puoi presentarti ora."
-                        _notify_next_slot(wconn, event_id, cid, current_b["slot"], "early_finish", msg)
-                st.session_state.pop("current_booking_id", None)
-                st.session_state.pop("started_at", None)
+                        _notify_next_slot(wconn, event_id, cid, lane, current_b["slot"], "early_finish", msg)
+                    # nessun prenotato atteso a breve: entra il prossimo walk-in
+                    pull_walkin_if_free(wconn, event_id, cid, lane)
+                st.session_state.pop(f"current_booking_id_{lane}", None)
+                st.session_state.pop(f"started_at_{lane}", None)
                 st.rerun()
 
         with colC:
-            if st.button("🗙 Annulla", key=f"cancel_{current_b['id']}", use_container_width=True):
+            if st.button("🗙 Annulla", key=f"cancel_{current_b['id']}", use_container_width=True,
+                         help=WAITLIST_HELP):
                 with engine.begin() as wconn:
                     wconn.execute(
                         text("""
@@ -142,64 +136,207 @@ def render_company(event):
                             VALUES (:b, :t, 'cancelled')
                             ON CONFLICT(booking_id) DO UPDATE SET end_time=:t, status='cancelled'
                         """),
-                        {"b": current_b["id"], "t": datetime.utcnow().isoformat()}
+                        {"b": current_b["id"], "t": clock.utcnow().isoformat()}
                     )
-                    msg = f"Lo slot precedente ({current_b['slot']}) è stato annullato. Puoi presentarti ora."
-                    _notify_next_slot(wconn, event_id, cid, current_b["slot"], "cancelled_prev", msg)
-                st.session_state.pop("current_booking_id", None)
-                st.session_state.pop("started_at", None)
-                st.rerun()
+                    # slot non ancora finito: passa al primo in lista d'attesa
+                    promoted = release_booking(wconn, current_b["id"], "cancelled")
+                    if not promoted:
+                        msg = f"Lo slot precedente ({current_b['slot']}) è stato annullato. Puoi presentarti ora."
+                        _notify_next_slot(wconn, event_id, cid, lane, current_b["slot"], "cancelled_prev", msg)
+                    pull_walkin_if_free(wconn, event_id, cid, lane)
+                _after_release(lane, current_b["slot"], promoted)
+
+        with colD:
+            if st.button("🚫 Assente", key=f"noshow_{current_b['id']}", use_container_width=True,
+                         help=WAITLIST_HELP):
+                with engine.begin() as wconn:
+                    promoted = mark_no_show(wconn, current_b["id"])
+                    if not promoted:
+                        msg = (f"Lo studente dello slot precedente ({current_b['slot']}) non si è presentato. "
+                               "Puoi presentarti ora.")
+                        _notify_next_slot(wconn, event_id, cid, lane, current_b["slot"], "cancelled_prev", msg)
+                    pull_walkin_if_free(wconn, event_id, cid, lane)
+                _after_release(lane, current_b["slot"], promoted)
 
-        started_iso = st.session_state.get("started_at")
+        started_iso = st.session_state.get(f"started_at_{lane}")
         if started_iso:
             started_dt = datetime.fromisoformat(started_iso)
-            elapsed = datetime.utcnow() - started_dt
+            elapsed = clock.utcnow() - started_dt
             mins = elapsed.seconds // 60
             secs = elapsed.seconds % 60
             st.markdown(f"⏱ Colloquio in corso: {mins}m {secs}s")
     else:
         st.info("Nessun colloquio disponibile")
 
+
+def _render_walkin(event_id, cid, lane):
+    """Walk-in della linea: studenti in coda senza prenotazione, chiamati nei buchi del calendario."""
+    with engine.begin() as conn:
+        walkin = walkin_current(conn, event_id, cid, lane)
+        n_walkin = walkin_waiting(conn, event_id, cid)
+        booked_due = booked_student_due(conn, event_id, cid, lane)
+    if walkin or n_walkin:
+        st.markdown(f"#### 🚶 Walk-in ({n_walkin} in coda)")
+    if walkin:
+        st.markdown(
+            f"**{walkin['student']}** – "
+            f"{'colloquio in corso' if walkin['status'] == 'active' else 'chiamato, in arrivo'}"
+        )
+        colA, colB, colC = st.columns(3)
+        with colA:
+            if walkin["status"] == "called" and st.button(
+                "▶️ Inizia walk-in", key=f"wstart_{walkin['id']}_{lane}", use_container_width=True
+            ):
+                with engine.begin() as wconn:
+                    walkin_start(wconn, walkin["id"])
+                st.rerun()
+        with colB:
+            if st.button("⏹️ Termina walk-in", key=f"wend_{walkin['id']}_{lane}", use_container_width=True):
+                with engine.begin() as wconn:
+                    walkin_finish(wconn, walkin["id"], "done")
+                    pull_walkin_if_free(wconn, event_id, cid, lane)
+                st.rerun()
+        with colC:
+            if st.button("🗙 Assente", key=f"wnoshow_{walkin['id']}_{lane}", use_container_width=True):
+                with engine.begin() as wconn:
+                    walkin_finish(wconn, walkin["id"], "no-show")
+                    pull_walkin_if_free(wconn, event_id, cid, lane)
+                st.rerun()
+    elif n_walkin:
+        if booked_due:
+            st.caption("Un prenotato è atteso a breve su questa linea: i walk-in restano in coda.")
+        if st.button("📣 Chiama prossimo walk-in", key=f"wpop_{lane}", disabled=booked_due):
+            with engine.begin() as wconn:
+                walkin_pop(wconn, event_id, cid, lane)
+            st.rerun()
+
+
+def render_company(event):
+    """Render the Company area (unchanged behavior)."""
+    st.title("Area Azienda")
+    cid = st.session_state.get("company_id")
+    if not cid:
+        st.error("Nessuna azienda associata all'utente.")
+        return
+
+    with engine.begin() as conn:
+        name = conn.execute(text("SELECT name FROM company WHERE id=:id"), {"id": cid}).scalar()
+        event_id = conn.execute(text("SELECT id FROM event WHERE is_active=1 LIMIT 1")).scalar()
+
+    with engine.begin() as conn:
+        lanes = get_company_lanes(conn, event_id, cid)
+
+    st.subheader(f"Prossimo colloquio – {name}")
+    if lanes == 1:
+        _render_lane(event_id, cid, 1)
+        _render_walkin(event_id, cid, 1)
+    else:
+        # una coda indipendente per ogni linea (recruiter)
+        for lane, tab in enumerate(st.tabs([f"👤 Linea {l}" for l in range(1, lanes + 1)]), start=1):
+            with tab:
+                _render_lane(event_id, cid, lane)
+                _render_walkin(event_id, cid, lane)
+
     # Table of bookings
     st.subheader("Prenotazioni – Lista completa")
     with engine.begin() as conn:
         rows = get_bookings_with_logs(conn, event["id"], cid)
+        n_waiting = waitlist_length(conn, event["id"], cid)
+    if n_waiting:
+        st.caption(f"📋 In lista d'attesa: {n_waiting} studenti")
 
     if not rows:
         st.info("Nessuna prenotazione")
         return
 
-    df = pd.DataFrame(rows).sort_values("slot")
+    df = pd.DataFrame(rows).sort_values(["slot", "lane"])
 
-    st.dataframe(df[["slot", "student", "CV", "status", "start_time", "end_time"]], use_container_width=True)
+    cols = ["slot", "student", "CV", "status", "start_time", "end_time"]
+    if df["lane"].max() > 1:
+        cols.insert(1, "lane")
+    st.dataframe(df[cols], use_container_width=True)
+
+    # --- Ricerca full-text nei CV caricati (indicizzati in background da cv_index.py) ---
+    st.markdown("### 🔎 Cerca nei CV")
+    cv_query = st.text_input("Parole chiave (es. MATLAB Python)", key="cv_search").strip()
+    if cv_query:
+        t0 = time.perf_counter()
+        with engine.begin() as conn:
+            hits = search_cvs(conn, event["id"], cid, cv_query)
+        elapsed_ms = (time.perf_counter() - t0) * 1000
+        for h in hits:
+            st.markdown(f"**{h['slot']} – {h['student']}** · {h['snippet']}")
+        st.caption(f"{len(hits)} CV trovati in {elapsed_ms:.1f} ms")
 
     st.markdown("### 📂 CV degli studenti")
 
+    # --- Tutti i CV in un unico ZIP (ricostruito solo se le prenotazioni cambiano) ---
+    def _clear_cv_bundle():
+        st.session_state.pop("cv_bundle", None)
+
+    bundle = st.session_state.get("cv_bundle")
+    if bundle and os.path.exists(bundle):
+        with open_cv_stream(bundle) as f:
+            st.download_button(
+                label="⬇️ Scarica ZIP con tutti i CV",
+                data=f,
+                file_name=f"cv_{sanitize_filename(name or str(cid))}.zip",
+                mime="application/zip",
+                key="dl_cv_bundle",
+                on_click=_clear_cv_bundle,
+            )
+    elif st.button("📦 Prepara ZIP con tutti i CV", key="cv_bundle_build"):
+        with engine.begin() as conn:
+            path, n = build_company_cv_bundle(conn, event["id"], cid)
+        if n:
+            st.session_state["cv_bundle"] = path
+            st.rerun()
+        st.info("Nessun CV da esportare")
+
+    # Il file viene letto solo per il CV richiesto: gli altri sono solo metadati in cache.
+    requested = st.session_state.get("cv_requested")
+
+    def _clear_cv_request():
+        st.session_state.pop("cv_requested", None)
+
     for r in df.to_dict("records"):
-        cv_path = r.get("_cv") or r.get("cv_path") or r.get("CV")
+        cv_path = r.get("cv_path")
         if not cv_path:
             continue
 
-        slot = r.get("slot") or r.get("Orario") or "?"
-        student = r.get("student") or r.get("Studente") or "?"
+        slot = r.get("slot") or "?"
+        student = r.get("student") or "?"
 
-        if isinstance(cv_path, str) and cv_path.strip().lower().startswith("http"):
+        if is_cv_link(cv_path):
             st.markdown(
                 f"🔗 **[{slot} – {student}]({cv_path})**",
                 unsafe_allow_html=True
             )
-        else:
+            continue
+
+        meta = cv_file_meta(cv_path)
+        if not meta["exists"]:
+            st.warning(f"CV non trovato su disco per {slot} – {student}")
+            continue
+
+        label = f"CV: {slot} – {student} ({format_size(meta['size'])})"
+        if requested == r["id"]:
             try:
-                with open(cv_path, "rb") as f:
+                with open_cv_stream(cv_path) as f:
                     st.download_button(
-                        label=f"📄 Scarica CV: {slot} – {student}",
-                        data=f.read(),
-                        file_name=os.path.basename(cv_path),
+                        label=f"⬇️ Scarica {label}",
+                        data=f,
+                        file_name=f"cv_{slot.replace(':', '')}_{sanitize_filename(student)}.pdf",
                         mime="application/pdf",
-                        key=f"dl_{r.get('_id', cv_path)}"
+                        key=f"dl_{r['id']}",
+                        on_click=_clear_cv_request,
                     )
             except FileNotFoundError:
+                cv_file_meta.clear()
                 st.warning(f"CV non trovato su disco per {slot} – {student}")
+        elif st.button(f"📄 {label}", key=f"cvreq_{r['id']}"):
+            st.session_state["cv_requested"] = r["id"]
+            st.rerun()
 
 
 
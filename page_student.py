@@ -3,15 +3,13 @@ from datetime import datetime, timedelta
 from sqlalchemy import text, Table, MetaData, update
 from auth import find_student_user
 from core import _neighbor_slots
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+from mailer import enqueue_booking_summary
+from metrics import BOOKING_REJECTS
 
 from core import (
     engine,
     get_companies,
-    generate_slots,
-    get_bookings,
+    get_event_slots,
     get_student_bookings,
     save_cv_file,
     book_slot,
@@ -20,6 +18,20 @@ from core import (
     get_roundtables,
     get_student_roundtable_bookings,
     book_roundtable,
+    get_booking_settings,
+    get_preferences,
+    save_preferences,
+    PREF_MAX_RANKED,
+    join_waitlist,
+    leave_waitlist,
+    waitlist_position,
+    get_student_waitlists,
+    walkin_join,
+    walkin_leave,
+    get_student_walkins,
+    get_full_slots,
+    roundtable_capacity,
+    ROUNDTABLE_BOOKABLE_SHARE,
 )
 from auth import find_student_user
 
@@ -88,69 +100,41 @@ def student_first_access(email: str):
             st.rerun()
 
 def send_confirmation_email(student, event):
-    """Invia una mail di riepilogo delle prenotazioni allo studente."""
-    email = student["email"]
-    student_name = f"{student['givenName']} {student['sn']}"
-
+    """Accoda la mail di riepilogo delle prenotazioni (la spedisce il worker dell'outbox)."""
     with engine.begin() as conn:
-        # --- Colloqui aziendali ---
-        interviews = get_student_bookings(conn, event["id"], email)
-
-        # --- Roundtable bookings ---
-        rt_bookings = get_student_roundtable_bookings(conn, event["id"], email)
-
-        # Recupera tutti i roundtable disponibili per questo evento
-        result = conn.execute(
-            text("SELECT id, name FROM roundtable WHERE event_id = :eid"),
-            {"eid": event["id"]}
-        )
-        all_roundtables = {r.id: r.name for r in result}
-
-    # --- Costruisci testo email ---
-    interviews_text = "\n".join(
-        f"- {b['company']} at {b['slot']}" for b in interviews
-    ) if interviews else "None"
-
-    roundtables_text = "\n".join(
-        f"- {all_roundtables.get(b['roundtable_id'], f'Roundtable {b['roundtable_id']}')}"
-        for b in rt_bookings
-    ) if rt_bookings else "None"
-
-    body = f"""
-    Dear {student_name},
-
-    Here is a summary of your current bookings for Industrial Engineering Day 2025:
-
-    🏛️ Plenary session: confirmed
-
-    🏢 Company interviews:
-    {interviews_text}
-
-    💬 Round tables:
-    {roundtables_text}
-
-    Please make sure to attend all booked sessions.
-    Thank you for participating!
+        enqueue_booking_summary(conn, event, student)
 
-    Best regards,
-    Industrial Engineering Day Team
-    """
 
-    # --- Configurazione email ---
-    sender = "noreply@unitn.it"
-    msg = MIMEMultipart()
-    msg["From"] = sender
-    msg["To"] = email
-    msg["Subject"] = "Your Industrial Engineering Day 2025 Bookings"
-    msg.attach(MIMEText(body, "plain"))
-
-    try:
-        with smtplib.SMTP("smtp.unitn.it", 587) as server:
-            server.starttls()
-            # server.login("user", "password")  # se serve
-            server.send_message(msg)
-    except Exception as e:
-        st.error(f"❌ Error sending email: {e}")
+def render_preferences(event, email, settings):
+    """Finestra preferenze: lo studente ordina le aziende, gli slot li assegna scheduler.py."""
+    st.subheader("Interview preferences")
+    with engine.begin() as conn:
+        comps = get_companies(conn, event["id"])
+        current = get_preferences(conn, event["id"], email)
+
+    if not settings["window_open"]:
+        if current:
+            st.write("Your preferences: " + ", ".join(f"{p['rank']}. {p['company']}" for p in current))
+        st.info("The preference window is closed. Interview slots will be assigned soon.")
+        return
+
+    if settings["close_at"]:
+        st.info(f"Preferences can be changed until {settings['close_at'].replace('T', ' ')}.")
+    names = {c["id"]: c["name"] for c in comps}
+    picked = st.multiselect(
+        f"Select up to {PREF_MAX_RANKED} companies, in order of preference (first = favourite)",
+        list(names),
+        default=[p["company_id"] for p in current if p["company_id"] in names],
+        format_func=lambda cid: names[cid],
+        max_selections=PREF_MAX_RANKED,
+        key="pref_companies",
+    )
+    if picked:
+        st.caption(" → ".join(f"{i + 1}. {names[c]}" for i, c in enumerate(picked)))
+    if st.button("💾 Save preferences"):
+        with engine.begin() as conn:
+            save_preferences(conn, event["id"], email, picked)
+        st.success("✅ Preferences saved.")
 
 
 def render_student(event):
@@ -210,130 +194,196 @@ def render_student(event):
 
             # Prenotazioni studente
             myb = get_student_bookings(conn, event["id"], email)
+            booking_settings = get_booking_settings(conn, event["id"])
 
         st.subheader("My Bookings")
         if myb:
             now = datetime.now()
             for b in myb:
-                st.write(f"🕒 {b['slot']} — **{b['company']}**")
+                # orario previsto dal motore ETA (durate/ritardi storici dell'azienda)
+                eta = f" · expected start ~{b['eta']}" if b.get("eta") and b["eta"] != b["slot"] else ""
+                st.write(f"🕒 {b['slot']} — **{b['company']}**{eta}")
         else:
             st.info("No Bookings")
 
-        # --- New Booking ---
-        st.subheader("Book an interview - NOTE: bookings cannot be deleted")
-        with engine.begin() as conn:
-            comps = get_companies(conn, event["id"])
-
-        pick = st.selectbox("Select the company", [c["name"] for c in comps])
-        comp_id = next(c["id"] for c in comps if c["name"] == pick)
-
         with engine.begin() as conn:
-            booked = {b["slot"] for b in get_bookings(conn, event["id"], comp_id)}
-            myb = get_student_bookings(conn, event["id"], email)
+            my_waitlists = get_student_waitlists(conn, event["id"], email)
+        for w in my_waitlists:
+            colA, colB = st.columns([4, 1])
+            with colA:
+                st.write(f"📋 Waiting list **{w['company']}** — position #{w['position']}")
+            with colB:
+                if st.button("Leave", key=f"leave_wl_{w['company_id']}"):
+                    with engine.begin() as conn:
+                        leave_waitlist(conn, event["id"], w["company_id"], email)
+                    st.rerun()
 
-        # --- Filter slots ---
-        slots = generate_slots()
+        # --- Walk-in: coda senza prenotazione per il giorno dell'evento ---
+        with st.expander("🚶 Walk-in queue (event day, no booking needed)"):
+            with engine.begin() as conn:
+                my_walkins = get_student_walkins(conn, event["id"], email)
+                walkin_comps = get_companies(conn, event["id"])
+            for w in my_walkins:
+                colA, colB = st.columns([4, 1])
+                with colA:
+                    if w["status"] == "waiting":
+                        st.write(f"🚶 **{w['company']}** — position #{w['position']}")
+                    else:
+                        st.success(f"🚶 **{w['company']}** — it's your turn, go now!")
+                with colB:
+                    if w["status"] == "waiting" and st.button("Leave", key=f"leave_wi_{w['company_id']}"):
+                        with engine.begin() as conn:
+                            walkin_leave(conn, event["id"], w["company_id"], email)
+                        st.rerun()
+            queued = {w["company_id"] for w in my_walkins}
+            options = [c for c in walkin_comps if c["id"] not in queued]
+            if options:
+                wi_pick = st.selectbox(
+                    "Company", options, format_func=lambda c: c["name"], key="walkin_company"
+                )
+                if st.button("🚶 Join walk-in queue"):
+                    with engine.begin() as conn:
+                        position = walkin_join(conn, event["id"], wi_pick["id"], email)
+                    if position is None:
+                        st.warning("You already have an interview with this company.")
+                    else:
+                        st.rerun()
 
-        # Block same and adjacent (±15 min) to any existing booking by the student (any company)
-        blocked = set()
-        for b in myb:
-            blocked.add(b["slot"])
-            prev_s, next_s = _neighbor_slots(b["slot"], step=15)
-            blocked.add(prev_s)
-            blocked.add(next_s)
+        # --- Modalità preferenze: niente prenotazione diretta, solo lista ordinata ---
+        if booking_settings["mode"] == "preferences":
+            render_preferences(event, email, booking_settings)
+        else:
+            # --- New Booking ---
+            st.subheader("Book an interview - NOTE: bookings cannot be deleted")
+            with engine.begin() as conn:
+                comps = get_companies(conn, event["id"])
 
-        available = [s for s in slots if s not in booked and s not in blocked]
+            pick = st.selectbox("Select the company", [c["name"] for c in comps])
+            comp_id = next(c["id"] for c in comps if c["name"] == pick)
 
-        if not available:
-            st.warning("No slots available for this company.")
-        else:
-            slot_choice = st.selectbox("Available slots", available)
-            cv_link = st.text_input("Optional link / CV", key="cv_link_input")
+            with engine.begin() as conn:
+                # slot pieni = tutte le linee (recruiter) dell'azienda occupate
+                booked = get_full_slots(conn, event["id"], comp_id)
+                myb = get_student_bookings(conn, event["id"], email)
 
-            # --- Info limite prenotazioni ---
-            now = datetime.now()
-            limit_active = (
-                MAX_INTERVIEWS_PER_STUDENT is not None and
-                (LIMIT_ACTIVE_UNTIL is None or now <= LIMIT_ACTIVE_UNTIL)
-            )
+            # --- Filter slots ---
+            with engine.begin() as conn:
+                slots = get_event_slots(conn, event["id"])
 
-            if limit_active:
-                st.info(
-                    f"⚙️ Each student can book up to {MAX_INTERVIEWS_PER_STUDENT} interviews "
+            # Block same and adjacent (±15 min) to any existing booking by the student (any company)
+            blocked = set()
+            for b in myb:
+                blocked.add(b["slot"])
+                prev_s, next_s = _neighbor_slots(b["slot"], step=15)
+                blocked.add(prev_s)
+                blocked.add(next_s)
+
+            available = [s for s in slots if s not in booked and s not in blocked]
+
+            if not available:
+                st.warning("No slots available for this company.")
+                already_with_company = any(b["company"] == pick for b in myb)
+                if all(s in booked for s in slots) and not already_with_company:
+                    # azienda piena: lista d'attesa, lo slot arriva da solo se qualcuno cancella
+                    with engine.begin() as conn:
+                        position = waitlist_position(conn, event["id"], comp_id, email)
+                    if position:
+                        st.info(f"📋 You are #{position} on the waiting list for {pick}.")
+                    elif st.button("📋 Join the waiting list"):
+                        with engine.begin() as conn:
+                            position = join_waitlist(conn, event["id"], comp_id, email, student["matricola"])
+                        st.success(
+                            f"✅ You are #{position} on the waiting list. If a slot opens up you will be "
+                            "booked automatically and notified here."
+                        )
+            else:
+                slot_choice = st.selectbox("Available slots", available)
+                cv_link = st.text_input("Optional link / CV", key="cv_link_input")
+                st.file_uploader("Optional CV (PDF)", type=["pdf"], key="cv_file_input")
+
+                # --- Info limite prenotazioni ---
+                now = datetime.now()
+                limit_active = (
+                    MAX_INTERVIEWS_PER_STUDENT is not None and
+                    (LIMIT_ACTIVE_UNTIL is None or now <= LIMIT_ACTIVE_UNTIL)
                 )
 
-            # --- Bottone di prenotazione con conferma ---
-            if st.button("📅 Book slot"):
-                # Salvo i dati della prenotazione in sessione per conferma
-                st.session_state["pending_booking"] = {
-                    "company_name": pick,
-                    "company_id": comp_id,
-                    "slot": slot_choice,
-                    "cv_link": cv_link or None,
-                    "email": email,
-                    "matricola": student["matricola"]
-                }
-                st.rerun()
-
-            # --- Se esiste una prenotazione in attesa, mostra richiesta di conferma ---
-            if "pending_booking" in st.session_state:
-                pending = st.session_state["pending_booking"]
-                st.warning(
-                    f"⚠️ Do you really want to book an interview with **{pending['company_name']}** "
-                    f"at **{pending['slot']}**?"
-                )
-                col1, col2 = st.columns(2)
-                with col1:
-                    if st.button("✅ Confirm booking"):
-                        try:
-                            with engine.begin() as conn:
-                                # Controlla duplicati e limiti
-                                myb = get_student_bookings(conn, event["id"], pending["email"])
-                                already_with_company = any(b["company"] == pending["company_name"] for b in myb)
-                                if already_with_company:
-                                    st.error(f"⚠️ You have already booked with {pending['company_name']}.")
-                                elif limit_active and len(myb) >= MAX_INTERVIEWS_PER_STUDENT:
-                                    st.error(f"⚠️ You already booked {MAX_INTERVIEWS_PER_STUDENT} interviews.")
-                                else:
-                                    book_slot(
-                                        conn,
-                                        event["id"],
-                                        pending["company_id"],
-                                        pending["email"],
-                                        pending["slot"],
-                                        pending["cv_link"],
-                                        pending["matricola"]
-                                    )
-                                    st.success(
-                                        f"✅ Booking confirmed with {pending['company_name']} at {pending['slot']}!"
-                                    )
-                            del st.session_state["pending_booking"]
-                            st.rerun()
-                        except Exception as ex:
-                            st.error(f"❌ Error during booking: {ex}")
+                if limit_active:
+                    st.info(
+                        f"⚙️ Each student can book up to {MAX_INTERVIEWS_PER_STUDENT} interviews "
+                    )
+
+                # --- Bottone di prenotazione con conferma ---
+                if st.button("📅 Book slot"):
+                    # Salvo i dati della prenotazione in sessione per conferma
+                    st.session_state["pending_booking"] = {
+                        "company_name": pick,
+                        "company_id": comp_id,
+                        "slot": slot_choice,
+                        "cv_link": cv_link or None,
+                        "email": email,
+                        "matricola": student["matricola"]
+                    }
+                    st.rerun()
+
+                # --- Se esiste una prenotazione in attesa, mostra richiesta di conferma ---
+                if "pending_booking" in st.session_state:
+                    pending = st.session_state["pending_booking"]
+                    st.warning(
+                        f"⚠️ Do you really want to book an interview with **{pending['company_name']}** "
+                        f"at **{pending['slot']}**?"
+                    )
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        if st.button("✅ Confirm booking"):
+                            try:
+                                with engine.begin() as conn:
+                                    # Controlla duplicati e limiti
+                                    myb = get_student_bookings(conn, event["id"], pending["email"])
+                                    already_with_company = any(b["company"] == pending["company_name"] for b in myb)
+                                    if already_with_company:
+                                        BOOKING_REJECTS.inc(reason="already_booked")
+                                        st.error(f"⚠️ You have already booked with {pending['company_name']}.")
+                                    elif limit_active and len(myb) >= MAX_INTERVIEWS_PER_STUDENT:
+                                        BOOKING_REJECTS.inc(reason="limit")
+                                        st.error(f"⚠️ You already booked {MAX_INTERVIEWS_PER_STUDENT} interviews.")
+                                    else:
+                                        # Il PDF caricato (se c'è) ha la precedenza sul link
+                                        cv_path, cv_digest = save_cv_file(conn, st.session_state.get("cv_file_input"))
+                                        book_slot(
+                                            conn,
+                                            event["id"],
+                                            pending["company_id"],
+                                            pending["email"],
+                                            pending["slot"],
+                                            cv_path or pending["cv_link"],
+                                            pending["matricola"],
+                                            cv_digest=cv_digest
+                                        )
+                                        # riepilogo via mail, nella stessa transazione della prenotazione
+                                        enqueue_booking_summary(conn, event, student)
+                                        st.success(
+                                            f"✅ Booking confirmed with {pending['company_name']} at {pending['slot']}!"
+                                        )
+                                del st.session_state["pending_booking"]
+                                st.rerun()
+                            except Exception as ex:
+                                if not isinstance(ex, ValueError):  # i ValueError li conta già book_slot
+                                    BOOKING_REJECTS.inc(reason="error")
+                                st.error(f"❌ Error during booking: {ex}")
+                                del st.session_state["pending_booking"]
+                                st.rerun()
+                    with col2:
+                        if st.button("❌ Cancel"):
                             del st.session_state["pending_booking"]
+                            st.info("Booking cancelled.")
                             st.rerun()
-                with col2:
-                    if st.button("❌ Cancel"):
-                        del st.session_state["pending_booking"]
-                        st.info("Booking cancelled.")
-                        st.rerun()
 
 
     # --- ROUND TABLES ---
     with tab_roundtables:
         st.subheader("Book a Round Table  9 - 11 am -- The round table booking cannot be deleted")
 
-        # Capacità definite per nome (non per ID)
-        CAPACITY_BY_NAME = {
-            "Round Table 1": 140,
-            "Round Table 2": 140,
-            "Round Table 3": 73,
-            "Round Table 4": 130,
-            "Round Table 5": 113,
-            "Round Table 6": 68,
-        }
-
         with engine.begin() as conn:
             roundtables = get_roundtables(conn, event["id"])
             my_rt_bookings = {
@@ -352,18 +402,18 @@ def render_student(event):
         else:
             available_roundtables = []
             for rt in roundtables:
-                capacity = CAPACITY_BY_NAME.get(rt['name'], 100)
+                capacity = roundtable_capacity(rt['name'])
                 count = current_counts[rt['id']]
                 
                 # ✅ Limite del 50% della capacità
-                if count < capacity * 0.5:
+                if count < capacity * ROUNDTABLE_BOOKABLE_SHARE:
                     available_roundtables.append(rt)
             if available_roundtables:
                 rt_choice_str = st.selectbox(
                     "Select a round table",
                     [
                         f"{rt['name']} – 📍 {rt['room']} "
-                        f"({current_counts[rt['id']]}/{CAPACITY_BY_NAME.get(rt['name'], 100)})"
+                        f"({current_counts[rt['id']]}/{roundtable_capacity(rt['name'])})"
                         for rt in available_roundtables
                     ]
                 )
@@ -407,6 +457,7 @@ def render_student(event):
                                     pending_rt["email"],
                                     pending_rt["matricola"]
                                 )
+                                enqueue_booking_summary(conn, event, student)
                                 st.success(
                                     f"✅ Round table **{pending_rt['roundtable_name']}** booked successfully!"
                                 )
@@ -0,0 +1,250 @@
+# profiler.py
+"""
+Profiler a richiesta per i rerun di un ruolo, attivato dall'admin (tab "Profiler").
+
+L'admin chiede di profilare i prossimi N rerun di student / company / admin con:
+- "cprofile": cProfile deterministico sul thread del rerun; salva il .prof
+  (snakeviz, `python -m pstats`) e ne ricava gli stack "folded";
+- "sampling": un thread campiona lo stack del rerun ogni PROFILE_SAMPLE_MS
+  (default 5) ms; costo quasi nullo per la pagina, risultato statistico.
+
+Entrambi scrivono in PROFILE_DIR (default profiles/) un file .folded, una riga
+"frame;frame;frame peso" per stack, leggibile da flamegraph.pl e speedscope:
+
+    flamegraph.pl profiles/20251112-101502_admin_cprofile_2310ms.folded > admin.svg
+
+Si profila solo il render della pagina (app.py lo avvolge con profile_rerun):
+così i rerun interrotti da st.rerun()/st.stop() si chiudono nello stesso thread.
+La richiesta vale per il processo che ha servito l'admin, come le metriche.
+Restano gli ultimi PROFILE_KEEP profili (default 50).
+"""
+import cProfile
+import glob
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+from core import read_secret
+
+PROFILE_DIR = read_secret("PROFILE_DIR", "profiles")
+PROFILE_KEEP = int(read_secret("PROFILE_KEEP", 50))
+SAMPLE_SECONDS = float(read_secret("PROFILE_SAMPLE_MS", 5)) / 1000
+MODES = ("cprofile", "sampling")
+MAX_DEPTH = 80  # stack più profondi vengono troncati alla radice
+
+_request = None  # {"role", "mode", "remaining", "requested_at"}
+_request_lock = threading.Lock()
+
+
+def request_profile(role: str, runs: int, mode: str = "cprofile"):
+    """Profila i prossimi `runs` rerun di `role` in questo processo (sostituisce la richiesta aperta)."""
+    global _request
+    if mode not in MODES:
+        raise ValueError(f"Modalità di profiling sconosciuta: {mode}")
+    with _request_lock:
+        _request = {"role": role, "mode": mode, "remaining": int(runs),
+                    "requested_at": datetime.now().isoformat(timespec="seconds")}
+
+
+def cancel_profile():
+    global _request
+    with _request_lock:
+        _request = None
+
+
+def get_profile_request() -> dict | None:
+    req = _request
+    return dict(req) if req else None
+
+
+def _claim(role: str) -> str | None:
+    """Consuma un rerun della richiesta se è per `role`; ritorna la modalità."""
+    global _request
+    if _request is None or _request["role"] != role:
+        return None  # percorso comune: nessun lock
+    with _request_lock:
+        req = _request
+        if req is None or req["role"] != role:
+            return None
+        req["remaining"] -= 1
+        if req["remaining"] <= 0:
+            _request = None
+        return req["mode"]
+
+
+def _frame_label(code) -> str:
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ",")
+
+
+# ------------------- sampling -------------------
+class _Sampler(threading.Thread):
+    def __init__(self, target_ident):
+        super().__init__(name="profiler-sampler", daemon=True)
+        self.target_ident = target_ident
+        self.stacks = Counter()
+        self._done = threading.Event()
+
+    def run(self):
+        last = time.perf_counter()
+        while not self._done.wait(SAMPLE_SECONDS):
+            frame = sys._current_frames().get(self.target_ident)
+            now = time.perf_counter()
+            stack = []
+            while frame is not None and len(stack) < MAX_DEPTH:
+                stack.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                # peso = tempo reale dall'ultimo campione: col GIL il thread si sveglia in ritardo
+                self.stacks[";".join(reversed(stack))] += now - last
+            last = now
+
+    def stop(self) -> Counter:
+        self._done.set()
+        self.join()
+        return Counter({s: round(w * 1e6) for s, w in self.stacks.items()})  # µs, come per cProfile
+
+
+# ------------------- cProfile -> folded -------------------
+def _label(func) -> str:
+    filename, line, name = func
+    if filename == "~":
+        return name.replace(";", ",")  # built-in: "<built-in method time.sleep>"
+    return f"{name} ({os.path.basename(filename)}:{line})".replace(";", ",")
+
+
+def pstats_to_folded(stats: pstats.Stats) -> Counter:
+    """
+    Stack "folded" ricostruiti dal grafo chiamante/chiamato di cProfile.
+
+    cProfile conosce solo gli archi, non gli stack completi: il tempo cumulativo
+    di una funzione è ripartito tra i chiamanti in proporzione agli archi, come
+    fanno flameprof e gprof2dot. Peso in microsecondi di tempo proprio.
+    """
+    raw = stats.stats  # func -> (cc, nc, tt, ct, callers)
+    children = {}
+    for func, (_, _, _, _, callers) in raw.items():
+        for caller, edge in callers.items():
+            children.setdefault(caller, []).append((func, edge[3]))
+    roots = [f for f, (_, _, _, _, callers) in raw.items() if not callers]
+    folded = Counter()
+
+    def walk(func, stack, share):
+        tt, ct = raw[func][2], raw[func][3]
+        stack = stack + [_label(func)]
+        if tt * share >= 1e-6:
+            folded[";".join(stack)] += round(tt * share * 1e6)
+        if len(stack) >= MAX_DEPTH:
+            return
+        on_stack = set(stack)
+        for child, edge_ct in children.get(func, ()):
+            child_ct = raw[child][3]
+            if child_ct <= 0 or _label(child) in on_stack:
+                continue  # ricorsione: il tempo è già nel frame sopra
+            child_share = share * edge_ct / child_ct
+            if child_share * child_ct >= 1e-5:  # sotto i 10 µs non vale il ramo
+                walk(child, stack, min(child_share, 1.0))
+
+    for root in roots:
+        walk(root, [], 1.0)
+    return folded
+
+
+# ------------------- rerun profilato -------------------
+def _prune():
+    files = sorted(glob.glob(os.path.join(PROFILE_DIR, "*.folded")))
+    for path in files[:-PROFILE_KEEP] if PROFILE_KEEP > 0 else []:
+        for p in (path, path[:-len(".folded")] + ".prof"):
+            try:
+                os.remove(p)
+            except OSError:
+                pass
+
+
+def _save(role, mode, ms, folded: Counter, prof: cProfile.Profile | None):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stem = os.path.join(PROFILE_DIR, f"{datetime.now():%Y%m%d-%H%M%S}_{role}_{mode}_{ms:.0f}ms")
+    if prof is not None:
+        prof.dump_stats(stem + ".prof")
+    with open(stem + ".folded", "w", encoding="utf-8") as f:
+        for stack, weight in sorted(folded.items()):
+            f.write(f"{stack} {weight}\n")
+    _prune()
+
+
+@contextmanager
+def profile_rerun(role: str):
+    """Avvolge il render della pagina: profila se c'è una richiesta aperta per `role`."""
+    mode = _claim(role)
+    if mode is None:
+        yield
+        return
+    prof = sampler = None
+    if mode == "cprofile":
+        prof = cProfile.Profile()
+        try:
+            prof.enable()
+        except ValueError:  # un altro profiler è già attivo sul thread
+            prof = None
+            mode = "sampling"
+    if mode == "sampling":
+        sampler = _Sampler(threading.get_ident())
+        sampler.start()
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        ms = (time.perf_counter() - t0) * 1000
+        if prof is not None:
+            prof.disable()
+            folded = pstats_to_folded(pstats.Stats(prof))
+        else:
+            folded = sampler.stop()
+        try:
+            _save(role, mode, ms, folded, prof)
+        except OSError:
+            pass  # il profiler non deve mai rompere la pagina
+
+
+# ------------------- lettura per il tab admin -------------------
+def list_profiles(limit: int = 50) -> list[dict]:
+    out = []
+    for path in sorted(glob.glob(os.path.join(PROFILE_DIR, "*.folded")), reverse=True)[:limit]:
+        name = os.path.basename(path)[:-len(".folded")]
+        parts = name.split("_")
+        prof = path[:-len(".folded")] + ".prof"
+        out.append({
+            "profilo": name,
+            "creato": datetime.strptime(parts[0], "%Y%m%d-%H%M%S") if len(parts) == 4 else None,
+            "ruolo": parts[1] if len(parts) == 4 else "",
+            "modalità": parts[2] if len(parts) == 4 else "",
+            "ms": float(parts[3][:-2]) if len(parts) == 4 else None,
+            "folded": path,
+            "prof": prof if os.path.exists(prof) else None,
+        })
+    return out
+
+
+def top_frames(folded_path: str, top: int = 25) -> list[dict]:
+    """Funzioni con più tempo proprio (foglia dello stack) e totale (ovunque nello stack)."""
+    own, total = Counter(), Counter()
+    grand = 0
+    with open(folded_path, encoding="utf-8") as f:
+        for line in f:
+            stack, _, weight = line.rstrip("\n").rpartition(" ")
+            if not stack:
+                continue
+            w = int(weight)
+            frames = stack.split(";")
+            own[frames[-1]] += w
+            for fr in set(frames):
+                total[fr] += w
+            grand += w
+    grand = grand or 1
+    return [{"funzione": fr, "proprio %": round(100 * w / grand, 1),
+             "totale %": round(100 * total[fr] / grand, 1)} for fr, w in own.most_common(top)]
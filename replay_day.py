@@ -0,0 +1,262 @@
+# replay_day.py
+"""
+Riproduce una giornata registrata (booking + interview_log) in tempo accelerato.
+
+    python replay_day.py --db synthetic.db                    # 60×: una giornata in ~9 minuti
+    python replay_day.py --db ieday.db --event 3 --speed 120 --force
+    python replay_day.py --db synthetic.db --speed 0          # senza attese, solo il carico
+
+Copia il DB in --out, svuota log dei colloqui, notifiche, ETA e statistiche
+dell'evento e rigioca gli inizi e le fine registrati con le funzioni vere
+(core.start_interview / core.end_interview, che avvisa della fine anticipata;
+page_company._notify_next_slot per gli annullati), sotto un clock.ReplayClock
+che parte dal primo evento della giornata e scorre --speed volte più veloce.
+Ogni --tick secondi simulati gira lo stesso giro del LateNotifier
+(notifier.scan_late + eta.refresh_etas). I no-show, che nel log non hanno ora,
+vengono segnati NO_SHOW_MINUTES dopo l'inizio dello slot; le prenotazioni non
+cambiano (nessuna promozione dalla lista d'attesa), così il confronto regge.
+
+Alla fine riporta il ritmo ottenuto (eventi e notifiche al secondo, durata dei
+giri, ritardo del replay rispetto all'ora registrata) e confronta con la
+giornata originale le notifiche (per tipo, studente e slot) e le statistiche
+incrementali dei colloqui.
+"""
+import argparse
+import os
+import re
+import shutil
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import create_engine, text
+
+import clock
+import core
+from eta import refresh_etas
+from metrics import NOTIFICATIONS
+from notifier import LATE_NOTIFIER_SECONDS, scan_late
+from page_company import _notify_next_slot
+
+NO_SHOW_MINUTES = 5
+EVENT_KINDS = ("early_finish", "cancelled_prev")  # scritte dai click, non dal giro del notifier
+_ORDER = {"end": 0, "cancelled": 1, "no-show": 2, "start": 3}  # a parità d'ora la linea si libera prima
+
+
+def load_day(conn, event_id) -> tuple[list, list]:
+    """Eventi (ora locale, tipo, prenotazione) in ordine di tempo e notifiche originali dell'evento."""
+    offset = core.utc_offset()
+    events = []
+    for r in conn.execute(
+        text("""SELECT b.id, b.company_id, b.lane, b.slot, il.start_time, il.end_time, il.status
+                FROM booking b JOIN interview_log il ON il.booking_id = b.id
+                WHERE b.event_id = :e"""),
+        {"e": event_id}
+    ).mappings():
+        b = dict(r)
+        if r["start_time"]:
+            events.append((datetime.fromisoformat(r["start_time"]) + offset, "start", b))
+        if r["status"] == "done" and r["end_time"]:
+            events.append((datetime.fromisoformat(r["end_time"]) + offset, "end", b))
+        elif r["status"] in ("no-show", "cancelled"):
+            events.append((None, r["status"], b))  # ora fissata sotto, serve il giorno
+    days = [at.date() for at, _, _ in events if at]
+    if not days:
+        raise SystemExit(f"Evento {event_id}: nessun colloquio con orari in interview_log")
+    day = datetime.combine(min(days), datetime.min.time())
+    for i, (at, kind, b) in enumerate(events):
+        if at is None:
+            h, m = map(int, b["slot"].split(":"))
+            events[i] = (day + timedelta(hours=h, minutes=m + NO_SHOW_MINUTES), kind, b)
+    events.sort(key=lambda ev: (ev[0], _ORDER[ev[1]], ev[2]["slot"]))
+    notifs = [dict(r) for r in conn.execute(
+        text("""SELECT company_id, student, slot_from, kind, message, created_at
+                FROM notification WHERE event_id = :e"""),
+        {"e": event_id}
+    ).mappings()]
+    return events, notifs
+
+
+def reset_event(conn, event_id):
+    """Riporta l'evento della copia a inizio giornata: restano prenotazioni e storico degli altri eventi."""
+    bookings = "SELECT id FROM booking WHERE event_id = :e"
+    conn.execute(text(f"DELETE FROM interview_log WHERE booking_id IN ({bookings})"), {"e": event_id})
+    conn.execute(text(f"DELETE FROM booking_eta WHERE booking_id IN ({bookings})"), {"e": event_id})
+    conn.execute(text("DELETE FROM notification WHERE event_id = :e"), {"e": event_id})
+    conn.execute(text("DELETE FROM interview_stats WHERE event_id = :e"), {"e": event_id})
+    conn.execute(text("UPDATE event SET is_active = CASE WHEN id = :e THEN 1 ELSE 0 END"), {"e": event_id})
+
+
+def _apply(conn, event_id, kind, b):
+    if kind == "start":
+        core.start_interview(conn, b["id"])
+    elif kind == "end":
+        core.end_interview(conn, b["id"])
+    else:
+        conn.execute(
+            text("""INSERT INTO interview_log (booking_id, end_time, status) VALUES (:b, :t, :st)
+                    ON CONFLICT(booking_id) DO UPDATE SET end_time = :t, status = :st"""),
+            {"b": b["id"], "t": clock.utcnow().isoformat(), "st": kind}
+        )
+        if kind == "cancelled":
+            msg = f"Lo slot precedente ({b['slot']}) è stato annullato. Puoi presentarti ora."
+            _notify_next_slot(conn, event_id, b["company_id"], b["lane"], b["slot"], "cancelled_prev", msg)
+
+
+def replay(eng, event_id, events, speed=60.0, tick_seconds=LATE_NOTIFIER_SECONDS, eta=True) -> dict:
+    """Rigioca `events` sulla copia `eng`; ritorna tempi e conteggi del replay."""
+    start = events[0][0] - timedelta(minutes=1)
+    clk = clock.ReplayClock(start, speed=speed or None)
+    tick_step = timedelta(seconds=tick_seconds)
+    next_tick = start
+    event_ms, tick_ms, lag = [], [], []
+    writes = {"running_late": 0, "expected_start": 0}
+    before = {k: NOTIFICATIONS.value(kind=k) for k in EVENT_KINDS}
+
+    def tick():
+        t0 = time.perf_counter()
+        with eng.begin() as conn:
+            writes["running_late"] += scan_late(conn)
+            if eta:
+                writes["expected_start"] += refresh_etas(conn)
+        tick_ms.append((time.perf_counter() - t0) * 1000)
+
+    t_start = time.perf_counter()
+    with clock.use_clock(clk):
+        for at, kind, b in events:
+            while next_tick <= at:
+                clk.sleep_until(next_tick)
+                tick()
+                next_tick += tick_step
+            clk.sleep_until(at)
+            lag.append((clk.now() - at).total_seconds())
+            t0 = time.perf_counter()
+            with eng.begin() as conn:
+                _apply(conn, event_id, kind, b)
+            event_ms.append((time.perf_counter() - t0) * 1000)
+        clk.sleep_until(next_tick)
+        tick()  # ultimo giro: chiude le notifiche degli ultimi colloqui
+        simulated = (clk.now() - start).total_seconds()
+    for k in EVENT_KINDS:
+        writes[k] = NOTIFICATIONS.value(kind=k) - before[k]
+    return {"seconds": time.perf_counter() - t_start, "simulated": simulated, "events": len(events),
+            "event_ms": np.array(event_ms), "tick_ms": np.array(tick_ms), "lag": np.array(lag), "writes": writes}
+
+
+def _minutes_late(message) -> int | None:
+    m = re.search(r"(\d+) min", message or "")
+    return int(m.group(1)) if m else None
+
+
+def compare_notifications(original: list, replayed: list) -> list[dict]:
+    """Per tipo: notifiche (studente, azienda, slot) solo originali, solo del replay e comuni."""
+    def index(rows):
+        out = {}
+        for r in rows:
+            out.setdefault(r["kind"], {})[(r["company_id"], r["student"], r["slot_from"])] = r
+        return out
+    orig, rep = index(original), index(replayed)
+    out = []
+    for kind in sorted(set(orig) | set(rep)):
+        o, r = orig.get(kind, {}), rep.get(kind, {})
+        both = o.keys() & r.keys()
+        shift = [abs((datetime.fromisoformat(r[k]["created_at"]) - datetime.fromisoformat(o[k]["created_at"]))
+                     .total_seconds()) / 60 for k in both]
+        same_min = [abs(_minutes_late(r[k]["message"]) - _minutes_late(o[k]["message"])) <= 1 for k in both
+                    if _minutes_late(o[k]["message"]) is not None and _minutes_late(r[k]["message"]) is not None]
+        out.append({"kind": kind, "original": len(o), "replay": len(r), "both": len(both),
+                    "only_original": len(o.keys() - r.keys()), "only_replay": len(r.keys() - o.keys()),
+                    "shift_p50": float(np.median(shift)) if shift else None,
+                    "minutes_match": sum(same_min) / len(same_min) if same_min else None})
+    return out
+
+
+def original_stats(conn, event_id) -> dict:
+    """
+    Stime per azienda ricalcolate da interview_log. Da chiamare sulla copia prima di
+    reset_event, su una connessione senza commit: il DB originale non viene mai scritto.
+    """
+    core.rebuild_interview_stats(conn, event_id)
+    return core.get_company_estimates(conn, event_id)
+
+
+def compare_stats(a: dict, rep_conn, event_id) -> dict:
+    """Statistiche incrementali del replay contro quelle dell'originale (da original_stats)."""
+    b = core.get_company_estimates(rep_conn, event_id)
+    common = a.keys() & b.keys()
+    diff = [abs(a[c]["duration"] - b[c]["duration"]) for c in common]
+    return {"companies": len(common), "missing": len(a.keys() ^ b.keys()),
+            "n_original": sum(v["n"] for v in a.values()), "n_replay": sum(v["n"] for v in b.values()),
+            "duration_diff_max": max(diff) if diff else 0.0}
+
+
+def _pct(a, q):
+    return float(np.percentile(a, q)) if len(a) else 0.0
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Replay accelerato di una giornata registrata")
+    ap.add_argument("--db", help="file SQLite della giornata (default: DB_URL dell'app)")
+    ap.add_argument("--out", help="copia su cui rigiocare (default: <db>_replay.db)")
+    ap.add_argument("--event", type=int, help="evento (default: quello attivo)")
+    ap.add_argument("--speed", type=float, default=60.0, help="accelerazione; 0 = senza attese")
+    ap.add_argument("--tick", type=int, default=LATE_NOTIFIER_SECONDS, help="secondi simulati tra i giri")
+    ap.add_argument("--no-eta", action="store_true", help="giri del notifier senza eta.refresh_etas")
+    ap.add_argument("--force", action="store_true", help="sovrascrive la copia se esiste")
+    args = ap.parse_args()
+
+    src = args.db or core.DB_URL.removeprefix("sqlite:///")
+    if not os.path.exists(src):
+        raise SystemExit(f"{src} non esiste")
+    out = args.out or os.path.splitext(src)[0] + "_replay.db"
+    if os.path.exists(out) and not args.force:
+        raise SystemExit(f"{out} esiste già: usa --force per ricrearlo")
+    shutil.copyfile(src, out)
+    src_eng = create_engine(f"sqlite:///file:{src}?mode=ro&uri=true", future=True)  # sola lettura
+    rep_eng = create_engine(f"sqlite:///{out}", future=True)
+
+    with src_eng.connect() as conn:
+        event_id = args.event or core.get_active_event(conn)["id"]
+        events, original = load_day(conn, event_id)
+    with rep_eng.connect() as conn:  # senza commit: la copia resta com'era
+        stats_before = original_stats(conn, event_id)
+    with rep_eng.begin() as conn:
+        reset_event(conn, event_id)
+    span = (events[-1][0] - events[0][0]).total_seconds()
+    print(f"Evento {event_id}: {len(events)} eventi dalle {events[0][0]:%H:%M} alle {events[-1][0]:%H:%M} • "
+          f"{len(original)} notifiche originali • replay su {out}"
+          + (f" a {args.speed:g}× (~{span / args.speed / 60:.1f} min)" if args.speed else " senza attese"))
+
+    r = replay(rep_eng, event_id, events, args.speed, args.tick, eta=not args.no_eta)
+    w = r["writes"]
+    total = sum(w.values())
+    print(f"\n{r['seconds']:.1f} s reali per {r['simulated'] / 60:.0f} min simulati "
+          f"({r['simulated'] / r['seconds']:.0f}×) • {r['events'] / r['seconds']:.0f} eventi/s")
+    print(f"eventi: p50 {_pct(r['event_ms'], 50):.1f} ms • p95 {_pct(r['event_ms'], 95):.1f} • "
+          f"max {_pct(r['event_ms'], 100):.1f}")
+    print(f"giri notifier: {len(r['tick_ms'])} • p50 {_pct(r['tick_ms'], 50):.1f} ms • "
+          f"p95 {_pct(r['tick_ms'], 95):.1f} • max {_pct(r['tick_ms'], 100):.1f}")
+    print(f"ritardo del replay sull'ora registrata: p95 {_pct(r['lag'], 95):.0f} s • max {_pct(r['lag'], 100):.0f} s")
+    print(f"notifiche scritte: {total} ({total / r['seconds']:.0f}/s reali"
+          + (f", {(w['running_late'] + w['expected_start']) / (r['tick_ms'].sum() / 1000):.0f}/s nei giri"
+             if r["tick_ms"].sum() else "") + ") • "
+          + " • ".join(f"{k} {v}" for k, v in w.items()))
+
+    with rep_eng.connect() as conn:
+        replayed = [dict(x) for x in conn.execute(
+            text("""SELECT company_id, student, slot_from, kind, message, created_at
+                    FROM notification WHERE event_id = :e"""),
+            {"e": event_id}
+        ).mappings()]
+    print(f"\n{'tipo':<16} {'orig.':>6} {'replay':>6} {'comuni':>6} {'solo orig.':>10} {'solo replay':>11} "
+          f"{'Δ ora p50':>9} {'min ±1':>6}")
+    for c in compare_notifications(original, replayed):
+        shift = f"{c['shift_p50']:.1f}m" if c["shift_p50"] is not None else "-"
+        match = f"{c['minutes_match']:.0%}" if c["minutes_match"] is not None else "-"
+        print(f"{c['kind']:<16} {c['original']:>6} {c['replay']:>6} {c['both']:>6} {c['only_original']:>10} "
+              f"{c['only_replay']:>11} {shift:>9} {match:>6}")
+    with rep_eng.connect() as conn:
+        st_cmp = compare_stats(stats_before, conn, event_id)
+    print(f"\nstatistiche colloqui: {st_cmp['n_original']} campioni originali, {st_cmp['n_replay']} nel replay • "
+          f"{st_cmp['companies']} aziende a confronto ({st_cmp['missing']} solo da una parte) • "
+          f"differenza massima durata media {st_cmp['duration_diff_max']:.2f} min")
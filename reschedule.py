@@ -0,0 +1,384 @@
+# reschedule.py
+"""
+Spostamenti di massa del calendario colloqui (admin).
+
+shift_bookings sposta in blocco i colloqui ancora da fare: di N minuti (tutti, solo
+alcune aziende e/o solo da un certo orario in poi) oppure su un nuovo calendario
+generate_slots (lo slot i-esimo del vecchio calendario diventa l'i-esimo del nuovo).
+I vincoli si controllano sull'insieme finale, non prenotazione per prenotazione:
+  - ogni nuovo orario deve stare nel calendario dell'evento,
+  - (azienda, linea, slot) resta unico,
+  - nessuno studente con due colloqui a ±15 minuti (come book_slot).
+Se tutto torna, una sola transazione: due UPDATE multipli (passando da uno slot
+temporaneo, così UNIQUE non scatta a metà), il nuovo calendario in event.slots e
+una notifica per studente con un solo INSERT multiplo.
+
+rebook_dropout ricolloca gli studenti di un'azienda che si ritira: matrice di
+occupazione azienda×slot e studente×slot costruita una volta, poi lo stesso
+motore vettoriale dello scheduler da preferenze (scheduler.assign).
+"""
+import re
+import time
+from collections import Counter
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import bindparam, text
+
+from core import generate_slots, get_event_slots, set_event_slots, unindex_cv_bookings, release_cv_blobs
+from metrics import NOTIFICATIONS
+from scheduler import DEFAULT_SEED, assign, slot_adjacency
+
+ADJACENT_MINUTES = 15
+MAX_REPORTED_CONFLICTS = 20
+HM = re.compile(r"([01]\d|2[0-3]):[0-5]\d")
+
+
+def hm_to_min(hm: str) -> int:
+    return int(hm[:2]) * 60 + int(hm[3:5])
+
+
+def min_to_hm(m: int) -> str:
+    return f"{m // 60:02d}:{m % 60:02d}"
+
+
+def parse_ranges(spec: str) -> list:
+    """'11:30-13:00, 15:00-17:00' -> [('11:30', '13:00'), ('15:00', '17:00')]"""
+    ranges = []
+    for part in spec.split(","):
+        start, _, end = part.strip().partition("-")
+        start, end = start.strip(), end.strip()
+        if not (HM.fullmatch(start) and HM.fullmatch(end) and start < end):
+            raise ValueError(f"Intervallo non valido: '{part.strip()}' (formato HH:MM-HH:MM)")
+        ranges.append((start, end))
+    if not ranges:
+        raise ValueError("Nessun intervallo indicato")
+    return ranges
+
+
+def adjacency_conflicts(students, minutes, moved) -> list:
+    """
+    Coppie (i, j) di prenotazioni dello stesso studente a ±ADJACENT_MINUTES, di cui almeno una
+    spostata. Ordinando per (studente, orario) basta confrontare gli elementi consecutivi.
+    """
+    if not len(students):
+        return []
+    _, codes = np.unique(np.asarray(students, dtype=object).astype(str), return_inverse=True)
+    minutes = np.asarray(minutes)
+    moved = np.asarray(moved, dtype=bool)
+    order = np.lexsort((minutes, codes))
+    a, b = order[:-1], order[1:]
+    bad = (codes[a] == codes[b]) & (minutes[b] - minutes[a] <= ADJACENT_MINUTES) & (moved[a] | moved[b])
+    return list(zip(a[bad].tolist(), b[bad].tolist()))
+
+
+def shift_bookings(conn, event_id, minutes=None, ranges=None, step=15,
+                   company_ids=None, from_slot=None, dry_run=False) -> dict:
+    """
+    Sposta i colloqui non ancora iniziati di `minutes` minuti oppure sul calendario
+    generate_slots(step, ranges). company_ids / from_slot restringono lo spostamento
+    in minuti. Se ci sono conflitti (o con dry_run) non scrive nulla.
+    """
+    t0 = time.perf_counter()
+    if (minutes is None) == (ranges is None):
+        raise ValueError("Indica i minuti oppure il nuovo calendario")
+    if ranges is not None and (company_ids or from_slot):
+        raise ValueError("Il nuovo calendario vale per tutto l'evento: niente filtri per azienda/orario")
+
+    old_schedule = get_event_slots(conn, event_id)
+    rows = conn.execute(
+        text("""
+            SELECT b.id, b.company_id, b.lane, b.student, b.slot, c.name AS company,
+                   COALESCE(il.status, 'pending') AS status
+            FROM booking b
+            JOIN company c ON c.id = b.company_id
+            LEFT JOIN interview_log il ON il.booking_id = b.id
+            WHERE b.event_id = :e
+        """),
+        {"e": event_id}
+    ).mappings().all()
+    selected_companies = set(company_ids or [])
+
+    def selected(r):
+        return (r["status"] == "pending"
+                and (not selected_companies or r["company_id"] in selected_companies)
+                and (not from_slot or r["slot"] >= from_slot))
+
+    conflicts = []
+    if minutes is not None:
+        def shift(slot):
+            if not HM.fullmatch(slot) or not 0 <= hm_to_min(slot) + minutes < 24 * 60:
+                return None
+            return min_to_hm(hm_to_min(slot) + minutes)
+        if selected_companies:
+            # calendario invariato: lo spostamento deve restare sulla griglia
+            new_schedule = list(old_schedule)
+        else:
+            new_schedule = [shift(s) if not from_slot or s >= from_slot else s for s in old_schedule]
+            if None in new_schedule:
+                conflicts.append("Lo spostamento esce dalla giornata")
+                new_schedule = [s for s in new_schedule if s]
+            if len(set(new_schedule)) != len(new_schedule):
+                conflicts.append("Il nuovo calendario si sovrappone agli slot che restano fermi")
+    else:
+        new_schedule = generate_slots(step, ranges)
+        index = {s: i for i, s in enumerate(old_schedule)}
+
+        def shift(slot):
+            i = index.get(slot)
+            return new_schedule[i] if i is not None and i < len(new_schedule) else None
+
+    grid = set(new_schedule)
+    final, moves = [], []
+    for r in rows:
+        slot = r["slot"]
+        if selected(r):
+            slot = shift(r["slot"])
+            if slot is None or slot not in grid:
+                conflicts.append(f"{r['company']} {r['slot']} ({r['student']}): nessuno slot corrispondente")
+                slot = r["slot"]
+            elif slot != r["slot"]:
+                moves.append({**r, "new_slot": slot})
+        final.append((r, slot, slot != r["slot"]))
+
+    taken = Counter((r["company_id"], r["lane"], slot) for r, slot, _ in final)
+    for (company_id, lane, slot), n in taken.items():
+        if n > 1:
+            name = next(r["company"] for r, _, _ in final if r["company_id"] == company_id)
+            conflicts.append(f"{name} linea {lane}: {n} colloqui alle {slot}")
+    on_grid = [k for k, (_, slot, _) in enumerate(final) if HM.fullmatch(slot)]
+    for i, j in adjacency_conflicts(
+        [final[k][0]["student"] for k in on_grid],
+        [hm_to_min(final[k][1]) for k in on_grid],
+        [final[k][2] for k in on_grid],
+    ):
+        i, j = on_grid[i], on_grid[j]
+        conflicts.append(f"{final[i][0]['student']}: colloqui alle {final[i][1]} e {final[j][1]} troppo vicini")
+
+    students = {}
+    for m in moves:
+        students.setdefault(m["student"], []).append(m)
+    result = {
+        "moved": len(moves),
+        "students": len(students),
+        "conflicts": conflicts[:MAX_REPORTED_CONFLICTS],
+        "n_conflicts": len(conflicts),
+        "schedule": new_schedule,
+        "written": False,
+    }
+    schedule_changed = sorted(new_schedule) != sorted(old_schedule)
+    if conflicts or dry_run or not (moves or schedule_changed):
+        result["elapsed_s"] = round(time.perf_counter() - t0, 3)
+        return result
+
+    if moves:
+        ids = [m["id"] for m in moves]
+        conn.execute(
+            text("UPDATE booking SET slot = '~' || id WHERE id IN :ids").bindparams(bindparam("ids", expanding=True)),
+            {"ids": ids}
+        )
+        conn.execute(text("UPDATE booking SET slot = :slot WHERE id = :id"),
+                     [{"id": m["id"], "slot": m["new_slot"]} for m in moves])
+        conn.execute(
+            text("DELETE FROM booking_eta WHERE booking_id IN :ids").bindparams(bindparam("ids", expanding=True)),
+            {"ids": ids}
+        )
+    if schedule_changed:
+        set_event_slots(conn, event_id, new_schedule)
+
+    now_iso = datetime.utcnow().isoformat()
+    notifs = []
+    for student, ms in students.items():
+        changes = "; ".join(f"{m['company']} {m['slot']} → {m['new_slot']}" for m in sorted(ms, key=lambda m: m["slot"]))
+        notifs.append({"e": event_id, "c": ms[0]["company_id"], "s": student, "slot": ms[0]["slot"],
+                       "m": f"Your interview schedule has changed: {changes}.", "t": now_iso})
+    if notifs:
+        conn.execute(
+            text("""INSERT INTO notification (event_id, company_id, student, slot_from, kind, message, created_at)
+                    VALUES (:e, :c, :s, :slot, 'rescheduled', :m, :t)"""),
+            notifs
+        )
+        NOTIFICATIONS.inc(len(notifs), kind="rescheduled")
+    result["written"] = True
+    result["elapsed_s"] = round(time.perf_counter() - t0, 3)
+    return result
+
+
+def rebook_dropout(conn, event_id, company_id, use_preferences=True, not_before=None,
+                   remove_company=True, seed=DEFAULT_SEED, dry_run=False) -> dict:
+    """
+    Sposta su altre aziende i colloqui ancora da fare dell'azienda `company_id`.
+    Ogni studente prova prima le aziende delle sue preferenze (se use_preferences), poi le
+    altre in ordine di posti liberi; lo slot è il primo utile da `not_before` (default adesso)
+    che rispetti linee libere, capacità e ±15 minuti dagli altri suoi colloqui.
+    Chi non trova posto perde la prenotazione (archiviata in booking_released) e viene avvisato.
+    Con remove_company l'azienda esce dall'evento e le sue code (lista d'attesa, walk-in) si chiudono.
+    """
+    t0 = time.perf_counter()
+    slots = get_event_slots(conn, event_id)
+    n_slots = len(slots)
+    t_index = {s: i for i, s in enumerate(slots)}
+    not_before = not_before or datetime.now().strftime("%H:%M")
+
+    dropped_name = conn.execute(text("SELECT name FROM company WHERE id = :c"), {"c": company_id}).scalar()
+    affected = conn.execute(
+        text("""
+            SELECT b.id, b.student, b.slot, b.matricola, b.cv_digest
+            FROM booking b
+            LEFT JOIN interview_log il ON il.booking_id = b.id
+            WHERE b.event_id = :e AND b.company_id = :c AND COALESCE(il.status, 'pending') = 'pending'
+            ORDER BY b.slot
+        """),
+        {"e": event_id, "c": company_id}
+    ).mappings().all()
+    companies = conn.execute(
+        text("""
+            SELECT ec.company_id, ec.capacity, ec.lanes, c.name
+            FROM event_company ec JOIN company c ON c.id = ec.company_id
+            WHERE ec.event_id = :e AND ec.company_id != :c
+            ORDER BY ec.company_id
+        """),
+        {"e": event_id, "c": company_id}
+    ).mappings().all()
+    existing = conn.execute(
+        text("SELECT student, company_id, lane, slot FROM booking WHERE event_id = :e AND company_id != :c"),
+        {"e": event_id, "c": company_id}
+    ).all()
+
+    # --- occupazione: linee libere per azienda/slot, capacità residua, slot bloccati per studente ---
+    c_index = {r["company_id"]: i for i, r in enumerate(companies)}
+    students = sorted({r["student"] for r in affected})
+    s_index = {s: i for i, s in enumerate(students)}
+    adj = slot_adjacency(slots)
+    lanes = np.array([max(r["lanes"] or 1, 1) for r in companies], dtype=np.int32)
+    company_free = np.repeat(lanes[:, None], n_slots, axis=1) if len(companies) else np.zeros((0, n_slots), np.int32)
+    company_left = np.array([r["capacity"] or n_slots * l for r, l in zip(companies, lanes)], dtype=np.int32)
+    student_blocked = np.zeros((len(students), n_slots), dtype=bool)
+    student_blocked[:, [t for t, s in enumerate(slots) if s < not_before]] = True
+    booked_with = {s: set() for s in students}
+    used_lanes = {}
+    for student, cid, lane, slot in existing:
+        ci, ti, si = c_index.get(cid), t_index.get(slot), s_index.get(student)
+        if ci is not None:
+            company_left[ci] -= 1
+            if ti is not None:
+                company_free[ci, ti] -= 1
+                used_lanes.setdefault((ci, ti), set()).add(lane)
+        if si is not None:
+            booked_with[student].add(cid)
+            if ti is not None:
+                student_blocked[si] |= adj[ti]
+    company_free = np.maximum(company_free, 0)
+    company_left = np.maximum(company_left, 0)
+
+    # --- candidati per studente: preferenze, poi le aziende con più posti liberi ---
+    prefs = {}
+    if use_preferences and students:
+        for student, cid in conn.execute(
+            text("""SELECT student, company_id FROM booking_preference
+                    WHERE event_id = :e AND student IN :s ORDER BY student, rank""").bindparams(
+                bindparam("s", expanding=True)),
+            {"e": event_id, "s": students}
+        ):
+            if cid in c_index:
+                prefs.setdefault(student, []).append(cid)
+    by_room = [companies[i]["company_id"] for i in np.argsort(-company_left, kind="stable")]
+    ps, pc, pr, from_pref = [], [], [], set()
+    for student in students:
+        mine = prefs.get(student, [])
+        ranked = mine + [c for c in by_room if c not in mine]
+        rank = 0
+        for cid in ranked:
+            if cid in booked_with[student]:
+                continue
+            rank += 1
+            ps.append(s_index[student]); pc.append(c_index[cid]); pr.append(rank)
+            if cid in mine:
+                from_pref.add((s_index[student], c_index[cid]))
+    s_arr, c_arr, t_arr, _ = assign(
+        np.array(ps, dtype=np.int64), np.array(pc, dtype=np.int64), np.array(pr, dtype=np.int64),
+        company_free, company_left, student_blocked, np.ones(len(students), dtype=np.int32), adj, seed=seed
+    )
+
+    placed = {}
+    for si, ci, ti in zip(s_arr.tolist(), c_arr.tolist(), t_arr.tolist()):
+        taken = used_lanes.setdefault((ci, ti), set())
+        lane = next(l for l in range(1, int(lanes[ci]) + 1) if l not in taken)
+        taken.add(lane)
+        placed[students[si]] = {"company_id": companies[ci]["company_id"], "company": companies[ci]["name"],
+                                "lane": lane, "slot": slots[ti], "preferred": (si, ci) in from_pref}
+    moved, stranded = [], []
+    for b in affected:
+        # una sola ricollocazione per studente (book_slot non ne ammette due con la stessa azienda)
+        target = placed.pop(b["student"], None)
+        if target:
+            moved.append({**b, "old_slot": b["slot"], **target})
+        else:
+            stranded.append(b)
+    result = {
+        "affected": len(affected),
+        "rebooked": len(moved),
+        "from_preferences": sum(m["preferred"] for m in moved),
+        "stranded": [b["student"] for b in stranded],
+        "written": False,
+    }
+    if dry_run:
+        result["elapsed_s"] = round(time.perf_counter() - t0, 3)
+        return result
+
+    now_iso = datetime.utcnow().isoformat()
+    if affected:
+        conn.execute(
+            text("""INSERT INTO booking_released (booking_id, event_id, company_id, student, slot, matricola,
+                                                  reason, released_at)
+                    VALUES (:b, :e, :c, :s, :slot, :m, 'company_dropout', :t)"""),
+            [{"b": b["id"], "e": event_id, "c": company_id, "s": b["student"], "slot": b["slot"],
+              "m": b["matricola"], "t": now_iso} for b in affected]
+        )
+        # il CV va indicizzato con l'azienda nuova (o tolto, per chi resta senza colloquio)
+        unindex_cv_bookings(conn, [b["id"] for b in affected])
+    if moved:
+        conn.execute(
+            text("UPDATE booking SET company_id = :c, lane = :lane, slot = :slot, status = 'rebooked' WHERE id = :id"),
+            [{"id": m["id"], "c": m["company_id"], "lane": m["lane"], "slot": m["slot"]} for m in moved]
+        )
+        reindex = [{"b": m["id"], "d": m["cv_digest"], "t": now_iso} for m in moved if m["cv_digest"]]
+        if reindex:
+            conn.execute(
+                text("INSERT OR REPLACE INTO cv_index_job (booking_id, digest, created_at) VALUES (:b, :d, :t)"),
+                reindex
+            )
+    if stranded:
+        conn.execute(text("DELETE FROM booking WHERE id = :id"), [{"id": b["id"]} for b in stranded])
+        release_cv_blobs(conn, [b["cv_digest"] for b in stranded])
+    if remove_company:
+        conn.execute(text("DELETE FROM event_company WHERE event_id = :e AND company_id = :c"),
+                     {"e": event_id, "c": company_id})
+        conn.execute(text("""UPDATE waitlist SET status = 'cancelled'
+                             WHERE event_id = :e AND company_id = :c AND status = 'waiting'"""),
+                     {"e": event_id, "c": company_id})
+        conn.execute(text("""UPDATE walkin_queue SET status = 'left'
+                             WHERE event_id = :e AND company_id = :c AND status IN ('waiting', 'called')"""),
+                     {"e": event_id, "c": company_id})
+
+    notifs = [
+        {"e": event_id, "c": m["company_id"], "s": m["student"], "slot": m["old_slot"],
+         "m": f"{dropped_name} has cancelled its participation. Your {m['old_slot']} interview has been "
+              f"moved to {m['company']} at {m['slot']}.", "t": now_iso}
+        for m in moved
+    ] + [
+        {"e": event_id, "c": company_id, "s": b["student"], "slot": b["slot"],
+         "m": f"{dropped_name} has cancelled its participation and we could not find another free slot "
+              f"for your {b['slot']} interview. Please book another company.", "t": now_iso}
+        for b in stranded
+    ]
+    if notifs:
+        conn.execute(
+            text("""INSERT INTO notification (event_id, company_id, student, slot_from, kind, message, created_at)
+                    VALUES (:e, :c, :s, :slot, 'company_dropout', :m, :t)"""),
+            notifs
+        )
+        NOTIFICATIONS.inc(len(notifs), kind="company_dropout")
+    result["written"] = True
+    result["elapsed_s"] = round(time.perf_counter() - t0, 3)
+    return result
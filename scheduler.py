@@ -0,0 +1,261 @@
+# scheduler.py
+"""
+Assegnazione automatica dei colloqui a partire dalle preferenze degli studenti.
+
+Durante la finestra preferenze (event.booking_mode = 'preferences') gli studenti
+indicano un elenco ordinato di aziende; a finestra chiusa l'admin lancia
+l'assegnazione, che rispetta:
+  - ±15 minuti tra due colloqui dello stesso studente (come book_slot),
+  - un solo slot per azienda per studente,
+  - la capacità dell'azienda (event_company.capacity, default = tutti gli slot
+    di tutte le linee) e le sue linee parallele (event_company.lanes),
+  - la quota di colloqui per studente,
+  - le prenotazioni già presenti (manuali o FCFS).
+
+L'algoritmo procede per rango: al giro r ogni studente chiede la sua r-esima
+azienda; all'interno della stessa azienda passano prima gli studenti con meno
+colloqui (prenotazioni già presenti comprese), poi un ordine casuale (seed). Richieste dello stesso
+"turno" riguardano studenti e aziende tutti diversi, quindi ogni turno è
+un'unica operazione vettoriale NumPy sulle matrici studente×slot e azienda×slot.
+
+    python scheduler.py --event 1 --quota 3            # assegna e scrive
+    python scheduler.py --event 1 --quota 3 --dry-run  # solo statistiche
+"""
+import argparse
+import time
+
+import numpy as np
+from sqlalchemy import text
+
+from core import engine, get_event_slots, read_secret
+
+DEFAULT_QUOTA = int(read_secret("SCHEDULER_QUOTA", 3))
+DEFAULT_SEED = 2025
+
+
+def slot_minutes(slots) -> np.ndarray:
+    return np.array([int(s[:2]) * 60 + int(s[3:5]) for s in slots])
+
+
+def slot_adjacency(slots, step: int = 15) -> np.ndarray:
+    """ADJ[t, u] = True se uno studente con un colloquio in t non può averne uno in u."""
+    m = slot_minutes(slots)
+    return np.abs(m[:, None] - m[None, :]) <= step
+
+
+def assign(pref_s, pref_c, pref_r, company_free, company_left, student_blocked, student_left,
+           adj, seed=DEFAULT_SEED, student_booked=None):
+    """
+    Motore di assegnazione (puro NumPy, nessun accesso al DB).
+
+    pref_s, pref_c, pref_r: indici studente/azienda e rango (1 = preferita) di ogni preferenza.
+    company_free [C, T]  int,  linee ancora libere per azienda e slot (modificata in place).
+    company_left [C]     int,  colloqui ancora disponibili per azienda (capacità).
+    student_blocked [S, T] bool, slot non utilizzabili dallo studente (occupati o adiacenti).
+    student_left [S]     int,  quota residua dello studente.
+    student_booked [S]   int,  colloqui già prenotati dallo studente (default nessuno).
+
+    Restituisce (s, c, t, r): una riga per colloquio assegnato.
+    """
+    rng = np.random.default_rng(seed)
+    n_students = student_blocked.shape[0]
+    lottery = rng.permutation(n_students)
+    # colloqui per studente, prenotazioni esistenti comprese: chi ne ha meno passa prima
+    assigned = (np.zeros(n_students, dtype=np.int32) if student_booked is None
+                else np.asarray(student_booked, dtype=np.int32).copy())
+    out_s, out_c, out_t, out_r = [], [], [], []
+
+    for r in np.unique(pref_r):
+        sel = (pref_r == r) & (student_left[pref_s] > 0) & (company_left[pref_c] > 0)
+        s, c = pref_s[sel], pref_c[sel]
+        if not len(s):
+            continue
+
+        # per azienda: prima chi ha meno colloqui, poi sorteggio
+        order = np.lexsort((lottery[s], assigned[s], c))
+        s, c = s[order], c[order]
+        first = np.r_[0, np.flatnonzero(np.diff(c)) + 1]
+        sizes = np.diff(np.r_[first, len(c)])
+        turn = np.arange(len(c)) - np.repeat(first, sizes)
+
+        # raggruppo per turno: in ogni turno al più uno studente per azienda
+        by_turn = np.argsort(turn, kind="stable")
+        s, c, turn = s[by_turn], c[by_turn], turn[by_turn]
+        bounds = np.searchsorted(turn, np.arange(turn[-1] + 2))
+
+        for k in range(len(bounds) - 1):
+            ss, cc = s[bounds[k]:bounds[k + 1]], c[bounds[k]:bounds[k + 1]]
+            ok = (company_left[cc] > 0) & (student_left[ss] > 0)
+            if not ok.any():
+                continue
+            ss, cc = ss[ok], cc[ok]
+            feasible = (company_free[cc] > 0) & ~student_blocked[ss]
+            has = feasible.any(axis=1)
+            ss, cc = ss[has], cc[has]
+            t = feasible[has].argmax(axis=1)  # primo slot utile: calendari aziendali compatti
+
+            company_free[cc, t] -= 1
+            company_left[cc] -= 1
+            student_blocked[ss] |= adj[t]
+            student_left[ss] -= 1
+            assigned[ss] += 1
+            out_s.append(ss); out_c.append(cc); out_t.append(t); out_r.append(np.full(len(ss), r))
+
+    if not out_s:
+        empty = np.array([], dtype=np.int64)
+        return empty, empty, empty, empty
+    return np.concatenate(out_s), np.concatenate(out_c), np.concatenate(out_t), np.concatenate(out_r)
+
+
+def load_problem(conn, event_id, slots, quota):
+    """Legge preferenze, capacità e prenotazioni esistenti e costruisce le matrici per assign()."""
+    companies = list(conn.execute(
+        text("""SELECT company_id, capacity, lanes FROM event_company WHERE event_id = :e ORDER BY company_id"""),
+        {"e": event_id}
+    ).mappings())
+    prefs = conn.execute(
+        text("""
+            SELECT p.student, p.company_id, p.rank, s.matricola
+            FROM booking_preference p
+            LEFT JOIN student s ON s.email = p.student
+            WHERE p.event_id = :e
+            ORDER BY p.student, p.rank
+        """),
+        {"e": event_id}
+    ).all()
+    existing = conn.execute(
+        text("SELECT student, company_id, slot, lane FROM booking WHERE event_id = :e"),
+        {"e": event_id}
+    ).all()
+
+    n_slots = len(slots)
+    c_index = {r["company_id"]: i for i, r in enumerate(companies)}
+    t_index = {s: i for i, s in enumerate(slots)}
+    students = sorted({p[0] for p in prefs})
+    s_index = {s: i for i, s in enumerate(students)}
+    matricola = {p[0]: p[3] for p in prefs}
+    adj = slot_adjacency(slots)
+
+    lanes = np.array([max(r["lanes"] or 1, 1) for r in companies], dtype=np.int32)
+    cap = np.minimum(
+        np.array([r["capacity"] or n_slots * l for r, l in zip(companies, lanes)], dtype=np.int32),
+        lanes * n_slots
+    )
+    company_free = np.repeat(lanes[:, None], n_slots, axis=1)
+    used_lanes = {}
+    student_blocked = np.zeros((len(students), n_slots), dtype=bool)
+    student_left = np.full(len(students), quota, dtype=np.int32)
+    student_booked = np.zeros(len(students), dtype=np.int32)
+    booked_pairs = set()
+
+    for student, company_id, slot, lane in existing:
+        ci, ti, si = c_index.get(company_id), t_index.get(slot), s_index.get(student)
+        if ci is not None:
+            cap[ci] -= 1
+            if ti is not None:
+                company_free[ci, ti] -= 1
+                used_lanes.setdefault((ci, ti), set()).add(lane)
+        if si is not None:
+            student_left[si] -= 1
+            student_booked[si] += 1
+            booked_pairs.add((si, ci))
+            if ti is not None:
+                student_blocked[si] |= adj[ti]
+
+    ps, pc = [], []
+    for student, company_id, _, _ in prefs:
+        si, ci = s_index[student], c_index.get(company_id)
+        if ci is not None and (si, ci) not in booked_pairs:
+            ps.append(si)
+            pc.append(ci)
+    pref_s = np.array(ps, dtype=np.int64)
+    pref_c = np.array(pc, dtype=np.int64)
+    # rango denso per studente (1, 2, ...) dopo aver tolto aziende già prenotate
+    first = np.r_[0, np.flatnonzero(np.diff(pref_s)) + 1] if len(pref_s) else np.array([], dtype=np.int64)
+    pref_r = np.arange(len(pref_s)) - np.repeat(first, np.diff(np.r_[first, len(pref_s)])) + 1
+
+    return {
+        "students": students,
+        "matricola": matricola,
+        "company_ids": [r["company_id"] for r in companies],
+        "lanes": lanes,
+        "used_lanes": used_lanes,
+        "pref_s": pref_s, "pref_c": pref_c, "pref_r": pref_r,
+        "company_free": np.maximum(company_free, 0),
+        "company_left": np.maximum(cap, 0),
+        "student_blocked": student_blocked,
+        "student_left": np.maximum(student_left, 0),
+        "student_booked": student_booked,
+        "adj": adj,
+    }
+
+
+def run_scheduler(event_id, quota=DEFAULT_QUOTA, seed=DEFAULT_SEED, dry_run=False, db_engine=None) -> dict:
+    """
+    Assegna gli slot per l'evento e li scrive con un solo INSERT multiplo, nella stessa
+    transazione in cui legge lo stato. A fine assegnazione l'evento torna in modalità
+    'fcfs', così gli slot rimasti liberi si possono prenotare come sempre.
+    """
+    t0 = time.perf_counter()
+    with (db_engine or engine).begin() as conn:
+        slots = get_event_slots(conn, event_id)
+        p = load_problem(conn, event_id, slots, quota)
+        t_load = time.perf_counter() - t0
+        s, c, t, r = assign(
+            p["pref_s"], p["pref_c"], p["pref_r"], p["company_free"], p["company_left"],
+            p["student_blocked"], p["student_left"], p["adj"], seed=seed,
+            student_booked=p["student_booked"]
+        )
+        t_solve = time.perf_counter() - t0 - t_load
+
+        rows = []
+        used = p["used_lanes"]
+        for si, ci, ti in zip(s.tolist(), c.tolist(), t.tolist()):
+            taken = used.setdefault((ci, ti), set())
+            lane = next(l for l in range(1, int(p["lanes"][ci]) + 1) if l not in taken)
+            taken.add(lane)
+            rows.append({
+                "e": event_id,
+                "c": p["company_ids"][ci],
+                "lane": lane,
+                "s": p["students"][si],
+                "slot": slots[ti],
+                "m": p["matricola"].get(p["students"][si]),
+            })
+        if rows and not dry_run:
+            conn.execute(
+                text("""
+                    INSERT INTO booking (event_id, company_id, lane, student, slot, status, matricola)
+                    VALUES (:e, :c, :lane, :s, :slot, 'auto', :m)
+                """),
+                rows
+            )
+            conn.execute(text("UPDATE event SET booking_mode = 'fcfs' WHERE id = :e"), {"e": event_id})
+
+    n_students = len(p["students"])
+    got = np.bincount(s, minlength=n_students) if n_students else np.array([])
+    return {
+        "students": n_students,
+        "preferences": int(len(p["pref_s"])),
+        "assigned": len(rows),
+        "students_without_interview": int((got == 0).sum()) if n_students else 0,
+        "by_rank": {int(k): int(v) for k, v in zip(*np.unique(r, return_counts=True))},
+        "load_s": round(t_load, 3),
+        "solve_s": round(t_solve, 3),
+        "written": not dry_run,
+    }
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Assegnazione colloqui da preferenze")
+    ap.add_argument("--event", type=int, default=1)
+    ap.add_argument("--quota", type=int, default=DEFAULT_QUOTA)
+    ap.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    ap.add_argument("--dry-run", action="store_true")
+    args = ap.parse_args()
+
+    res = run_scheduler(args.event, quota=args.quota, seed=args.seed, dry_run=args.dry_run)
+    print(f"{'🔍 (dry-run) ' if args.dry_run else '✅ '}Colloqui assegnati: {res['assigned']} "
+          f"a {res['students']} studenti ({res['preferences']} preferenze)")
+    print(f"   per rango: {res['by_rank']} • senza colloqui: {res['students_without_interview']}")
+    print(f"   lettura {res['load_s']}s • calcolo {res['solve_s']}s")
@@ -0,0 +1,350 @@
+# simulate_day.py
+"""
+Simulazione Monte Carlo della giornata dei colloqui, per scegliere la configurazione.
+
+    python simulate_day.py                                   # evento attivo del DB_URL, 1000 giornate
+    python simulate_day.py --slot-minutes 15,20 --companies 40,60,80 --demand 1200
+    python simulate_day.py --db synthetic.db --rt-scale 1,1.25 --rt-demand 600 --detail
+
+Dal DB impara, per azienda e con ritorno alla media globale se i campioni sono
+pochi (STATS_MIN_SAMPLES), la durata dei colloqui (lognormale) e la quota di
+no-show; da tutte le code il ritardo di apertura della linea, l'anticipo o
+ritardo degli studenti rispetto allo slot e il tempo di cambio tra un colloquio
+e il successivo. Poi simula migliaia di giornate in blocco con NumPy (matrici
+giornate × linee, un passo per slot):
+
+    inizio = max(slot + arrivo studente, fine del precedente + cambio)
+
+Per ogni configurazione (lunghezza slot × numero aziende × capienza round
+table) riporta il ritardo d'inizio dei colloqui, le notifiche che scriverebbero
+notifier.py ("running late", un aggiornamento per minuto di ritardo) ed eta.py
+("expected start", una ogni ETA_NOTIFY_MINUTES di spostamento), i minuti di
+inattività per linea, lo sforamento a fine giornata e gli studenti rimasti senza
+round table. Con --detail aggiunge la tabella per azienda della prima configurazione.
+
+Le prenotazioni sono quelle vere se la configurazione coincide con l'evento
+(stesso calendario, stesse aziende), altrimenti sintetiche: --demand colloqui
+richiesti (default quelli prenotati) ripartiti con popolarità sbilanciata.
+"""
+import argparse
+import itertools
+import os
+import time
+
+import numpy as np
+from sqlalchemy import create_engine, text
+
+import core
+from eta import ETA_NOTIFY_MINUTES
+
+DEFAULTS = {"duration": 14.0, "duration_sd": 3.5, "no_show": 0.05, "open_mu": 2.0, "open_sd": 3.0,
+            "arrive_mu": 0.0, "arrive_sd": 1.5, "gap": 0.5}
+LATE_AFTER = 0  # notifier.py avvisa appena il colloquio supera la fine dello slot
+
+
+def hm_to_min(hm: str) -> int:
+    return int(hm[:2]) * 60 + int(hm[3:5])
+
+
+def slot_ranges(slots, step) -> list[tuple[str, str]]:
+    """Intervalli continui del calendario, per rigenerarlo con un altro passo."""
+    ranges, start, prev = [], None, None
+    for m in sorted(hm_to_min(s) for s in slots):
+        if start is None:
+            start = m
+        elif m - prev != step:
+            ranges.append((start, prev + step))
+            start = m
+        prev = m
+    if start is not None:
+        ranges.append((start, prev + step))
+    return [(f"{a // 60:02d}:{a % 60:02d}", f"{b // 60:02d}:{b % 60:02d}") for a, b in ranges]
+
+
+# ------------------- parametri dal DB -------------------
+def _lognormal(samples, prior_mean, prior_sd, k):
+    """mu/sigma di una lognormale, con i momenti tirati verso il prior se i campioni sono pochi."""
+    x = np.asarray(samples, dtype=float)
+    w = len(x) / (len(x) + k)
+    mean = w * x.mean() + (1 - w) * prior_mean if len(x) else prior_mean
+    var = w * x.var() + (1 - w) * prior_sd ** 2 if len(x) > 1 else prior_sd ** 2
+    sigma2 = np.log1p(var / mean ** 2)
+    return np.log(mean) - sigma2 / 2, np.sqrt(sigma2)
+
+
+def learn(conn, event_id) -> dict:
+    """Distribuzioni dai colloqui registrati (tutti gli eventi) e prenotazioni dell'evento."""
+    step = 15
+    slots = core.get_event_slots(conn, event_id)
+    companies = list(conn.execute(
+        text("""SELECT ec.company_id, c.name, COALESCE(ec.lanes, 1) AS lanes
+                FROM event_company ec JOIN company c ON c.id = ec.company_id
+                WHERE ec.event_id = :e ORDER BY c.name"""),
+        {"e": event_id}
+    ).mappings())
+    rows = list(conn.execute(text("""
+        SELECT b.event_id, b.company_id, b.lane, b.slot, il.status, il.start_time, il.end_time
+        FROM booking b LEFT JOIN interview_log il ON il.booking_id = b.id
+        ORDER BY b.event_id, b.company_id, b.lane, b.slot
+    """)).mappings())
+
+    durations, shows, noshows = {}, {}, {}
+    opening, arrive, gaps = [], [], []
+    for (ev, company, lane), group in itertools.groupby(rows, lambda r: (r["event_id"], r["company_id"], r["lane"])):
+        prev_end = None
+        first = True
+        for r in group:
+            if r["status"] == "no-show":
+                noshows[company] = noshows.get(company, 0) + 1
+                continue
+            sample = core.interview_sample(r["slot"], r["start_time"], r["end_time"]) if r["status"] == "done" else None
+            if not sample:
+                continue
+            shows[company] = shows.get(company, 0) + 1
+            durations.setdefault(company, []).append(sample["duration"])
+            late = sample["lateness"]
+            start = hm_to_min(r["slot"]) + late
+            if first:
+                opening.append(late)
+            elif prev_end is not None and prev_end <= hm_to_min(r["slot"]) - 1:
+                arrive.append(late)  # linea libera: conta solo lo studente
+            elif prev_end is not None:
+                gaps.append(start - prev_end)
+            prev_end = start + sample["duration"]
+            first = False
+
+    pooled = [d for ds in durations.values() for d in ds]
+    n_show, n_noshow = sum(shows.values()), sum(noshows.values())
+    base = {
+        "duration": float(np.mean(pooled)) if pooled else DEFAULTS["duration"],
+        "duration_sd": float(np.std(pooled)) if len(pooled) > 1 else DEFAULTS["duration_sd"],
+        "no_show": (n_noshow + 1) / (n_show + n_noshow + 20) if n_show + n_noshow else DEFAULTS["no_show"],
+        "open_mu": float(np.mean(opening)) if opening else DEFAULTS["open_mu"],
+        "open_sd": float(np.std(opening)) if len(opening) > 1 else DEFAULTS["open_sd"],
+        "arrive_mu": float(np.mean(arrive)) if arrive else DEFAULTS["arrive_mu"],
+        "arrive_sd": float(np.std(arrive)) if len(arrive) > 1 else DEFAULTS["arrive_sd"],
+        "gap": float(np.clip(np.median(gaps), 0, 3)) if gaps else DEFAULTS["gap"],
+        "samples": len(pooled),
+    }
+    k = core.STATS_MIN_SAMPLES
+    per_company = {}
+    for c in companies:
+        cid = c["company_id"]
+        mu, sigma = _lognormal(durations.get(cid, []), base["duration"], base["duration_sd"], k)
+        n = shows.get(cid, 0) + noshows.get(cid, 0)
+        per_company[cid] = {
+            "name": c["name"], "lanes": int(c["lanes"]), "mu": mu, "sigma": sigma,
+            "no_show": (noshows.get(cid, 0) + k * base["no_show"]) / (n + k),
+        }
+
+    booked = {}
+    for r in conn.execute(text("SELECT company_id, lane, slot FROM booking WHERE event_id = :e"), {"e": event_id}):
+        booked.setdefault((r[0], r[1]), set()).add(r[2])
+    rt = list(conn.execute(text("""
+        SELECT r.name, COUNT(rb.id) AS n FROM roundtable r
+        LEFT JOIN roundtable_booking rb ON rb.roundtable_id = r.id
+        WHERE r.event_id = :e GROUP BY r.id ORDER BY r.id
+    """), {"e": event_id}).mappings())
+    return {"slots": slots, "step": step, "base": base, "companies": per_company, "booked": booked,
+            "demand": sum(len(v) for v in booked.values()),
+            "roundtables": [(r["name"], r["n"]) for r in rt]}
+
+
+# ------------------- simulazione -------------------
+def _lanes(params, n_companies, rng):
+    """Parametri per linea: le aziende vere (prima le più prenotate), poi aziende medie."""
+    base = params["base"]
+    load = {cid: sum(len(params["booked"].get((cid, l), ())) for l in range(1, c["lanes"] + 1))
+            for cid, c in params["companies"].items()}
+    chosen = sorted(params["companies"], key=lambda cid: -load[cid])[:n_companies]
+    mu0, sigma0 = _lognormal([], base["duration"], base["duration_sd"], 1)
+    lanes = []
+    for cid in chosen:
+        c = params["companies"][cid]
+        lanes += [(cid, lane, c["mu"], c["sigma"], c["no_show"]) for lane in range(1, c["lanes"] + 1)]
+    for extra in range(n_companies - len(chosen)):
+        lanes.append((-1 - extra, 1, mu0, sigma0, base["no_show"]))
+    return lanes
+
+
+def _booked(params, lanes, slots, demand, n_sims, rng, real):
+    """(slot, giornate, linee) prenotati: quelli veri oppure `demand` colloqui con popolarità sbilanciata."""
+    L, K = len(lanes), len(slots)
+    if real:
+        mask = np.array([[s in params["booked"].get((cid, lane), ()) for cid, lane, *_ in lanes] for s in slots])
+        return np.broadcast_to(mask[:, None, :], (K, n_sims, L))
+    popularity = 1.0 / np.arange(1, L + 1) ** 0.8
+    popularity /= popularity.sum()
+    n_booked = np.zeros((n_sims, L), dtype=int)
+    spill = np.full(n_sims, demand)
+    for _ in range(8):  # chi trova l'azienda piena ripiega su un'altra con posti, sempre per popolarità
+        room = n_booked < K
+        if not spill.any() or not room.any():
+            break
+        p = popularity * room
+        p /= np.maximum(p.sum(axis=1, keepdims=True), 1e-12)
+        wanted = n_booked + rng.multinomial(spill, p)
+        n_booked = np.minimum(wanted, K)
+        spill = (wanted - n_booked).sum(axis=1)
+    # n_booked slot a caso per linea: le chiavi sotto la n-esima più piccola
+    keys = rng.random((K, n_sims, L))
+    cut = np.concatenate([np.sort(keys, axis=0), np.ones((1, n_sims, L))])
+    return keys < np.take_along_axis(cut, n_booked[None], axis=0)
+
+
+def simulate(params, slot_minutes, n_companies, demand, n_sims, rng, rt_scale=1.0, rt_demand=None) -> dict:
+    base = params["base"]
+    slots = core.generate_slots(slot_minutes, slot_ranges(params["slots"], params["step"]))
+    lanes = _lanes(params, n_companies, rng)
+    real = (slot_minutes == params["step"] and slots == list(params["slots"])
+            and n_companies == len(params["companies"]) and demand == params["demand"])
+    # assi (slot, giornata, linea): il ciclo sugli slot legge fette contigue
+    booked = _booked(params, lanes, slots, demand, n_sims, rng, real)
+    K, S, L = booked.shape
+    slot_m = np.array([hm_to_min(s) for s in slots], dtype=float)
+    contiguous = np.append(np.diff(slot_m) == slot_minutes, False)  # lo slot k+1 segue subito k
+
+    mu = np.array([l[2] for l in lanes])
+    sigma = np.array([l[3] for l in lanes])
+    no_show = np.array([l[4] for l in lanes])
+    show = booked & (rng.random((K, S, L)) >= no_show)
+    dur = np.exp(mu + sigma * rng.standard_normal((K, S, L)))
+    ready = slot_m[:, None, None] + rng.normal(base["arrive_mu"], base["arrive_sd"], (K, S, L))
+
+    start = np.full((K, S, L), np.nan)
+    # la prima linea apre in ritardo; poi ogni colloquio aspetta la fine del precedente + il cambio
+    free = slot_m[0] + np.maximum(rng.normal(base["open_mu"], base["open_sd"], (S, L)), -2.0) - base["gap"]
+    for k in range(K):
+        s_k = np.maximum(ready[k], free + base["gap"])
+        start[k] = np.where(show[k], s_k, np.nan)
+        free = np.where(show[k], s_k + dur[k], free)
+    end = start + dur
+    delay = start - slot_m[:, None, None]
+
+    # notifier.py: finché il colloquio k sfora la fine del suo slot, un aggiornamento al minuto
+    # allo studente dello slot k+1 (se prenotato e contiguo)
+    slot_end = (slot_m + slot_minutes + LATE_AFTER)[:, None, None]
+    next_booked = np.zeros((K, S, L), dtype=bool)
+    next_booked[:-1] = booked[1:] & contiguous[:-1, None, None]
+    over = np.where(show, end - slot_end, -1.0)
+    late = next_booked & (over > 0)
+    already = np.where(show, np.maximum(start - slot_end, 0.0), 0.0)
+    late_writes = np.where(late, np.floor(over) - np.floor(already) + 1, 0).sum(axis=(0, 2))
+    eta_writes = np.floor(np.where(show, np.maximum(delay, 0.0), 0.0) / ETA_NOTIFY_MINUTES).sum(axis=(0, 2))
+
+    busy = np.where(show, dur, 0.0).sum(axis=0)
+    last_end = np.where(show, end, 0.0).max(axis=0)
+    overrun = np.maximum(last_end - (slot_m[-1] + slot_minutes), 0.0)
+    idle = K * slot_minutes + overrun - busy  # minuti di linea aperta senza colloquio
+
+    d = delay[show]
+    p90, p99 = np.percentile(d, [90, 99]) if d.size else (0.0, 0.0)  # una sola partizione
+    out = {
+        "slot": slot_minutes, "companies": n_companies, "lanes": L, "bookings": "reali" if real else "sintetiche",
+        "fill": booked.sum() / (S * L * K),
+        "delay_mean": float(d.mean()) if d.size else 0.0,
+        "delay_p90": float(p90),
+        "delay_p99": float(p99),
+        "late_students": float(late.sum(axis=(0, 2)).mean()),
+        "late_writes": float(late_writes.mean()),
+        "eta_writes": float(eta_writes.mean()),
+        "idle_lane": float(idle.mean()),
+        "overrun_p90": float(np.percentile(overrun, 90)),
+        "rt_scale": rt_scale,
+    }
+    out.update(_roundtables(params, rt_scale, rt_demand, n_sims, rng))
+
+    # per azienda: prima si riduce sugli slot, poi si sommano le linee della stessa azienda
+    shown = show.sum(axis=0)
+    delay_sum = np.where(show, delay, 0.0).sum(axis=0)
+    by_company = {}
+    for i, (cid, *_rest) in enumerate(lanes):
+        by_company.setdefault(cid, []).append(i)
+    out["per_company"] = [{
+        "azienda": params["companies"][cid]["name"] if cid in params["companies"] else f"(media) {-cid}",
+        "linee": len(ix),
+        "colloqui": float(shown[:, ix].sum(axis=1).mean()),
+        "ritardo medio": float(delay_sum[:, ix].sum() / max(shown[:, ix].sum(), 1)),
+        "inattività/linea": float(idle[:, ix].mean()),
+        "sforamento p90": float(np.percentile(overrun[:, ix].max(axis=1), 90)),
+    } for cid, ix in by_company.items()]
+    return out
+
+
+def _roundtables(params, scale, demand, n_sims, rng) -> dict:
+    """Prima scelta per popolarità osservata; chi la trova piena ripiega su un'altra con posti."""
+    tables = params["roundtables"]
+    booked = np.array([b for _, b in tables], dtype=float)
+    demand = int(demand if demand is not None else booked.sum())
+    if not tables or demand <= 0:
+        return {"rt_first": None, "rt_unplaced": None}  # nessuna domanda: stampato come "-"
+    seats = np.array([int(core.roundtable_capacity(n) * core.ROUNDTABLE_BOOKABLE_SHARE * scale) for n, _ in tables])
+    share = (booked + 1) / (booked + 1).sum()
+    first = rng.multinomial(demand, share, size=n_sims)
+    overflow = np.maximum(first - seats, 0).sum(axis=1)
+    spare = np.maximum(seats - first, 0).sum(axis=1)
+    unplaced = np.maximum(overflow - spare, 0)
+    return {"rt_first": float(1 - overflow.mean() / demand), "rt_unplaced": float(unplaced.mean())}
+
+
+def _opt(value, fmt) -> str:
+    return "-" if value is None else format(value, fmt)
+
+
+def _floats(s, cast=float):
+    return [cast(x) for x in s.split(",")] if s else None
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Simulazione Monte Carlo della giornata dei colloqui")
+    ap.add_argument("--db", help="file SQLite (default: DB_URL dell'app)")
+    ap.add_argument("--event", type=int, help="evento (default: quello attivo)")
+    ap.add_argument("--sims", type=int, default=1000, help="giornate simulate per configurazione")
+    ap.add_argument("--slot-minutes", default="15", help="lunghezze slot da provare, es. 15,20")
+    ap.add_argument("--companies", help="numeri di aziende da provare (default: quelle dell'evento)")
+    ap.add_argument("--demand", type=int, help="colloqui richiesti (default: quelli prenotati)")
+    ap.add_argument("--rt-scale", default="1", help="moltiplicatori di capienza round table, es. 1,1.25")
+    ap.add_argument("--rt-demand", type=int, help="studenti che vogliono una round table (default: iscritti)")
+    ap.add_argument("--detail", action="store_true", help="tabella per azienda della prima configurazione")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    if args.db and not os.path.exists(args.db):
+        raise SystemExit(f"{args.db} non esiste")
+    eng = create_engine(f"sqlite:///{args.db}", future=True) if args.db else core.engine
+    with eng.connect() as conn:
+        event_id = args.event or core.get_active_event(conn)["id"]
+        params = learn(conn, event_id)
+    b = params["base"]
+    print(f"Evento {event_id}: {len(params['companies'])} aziende • {params['demand']} prenotazioni • "
+          f"{b['samples']} colloqui registrati")
+    print(f"Durata media {b['duration']:.1f} ± {b['duration_sd']:.1f} min • no-show {b['no_show']:.1%} • "
+          f"apertura {b['open_mu']:+.1f} min • arrivo {b['arrive_mu']:+.1f} ± {b['arrive_sd']:.1f} • "
+          f"cambio {b['gap']:.1f} min")
+
+    rng = np.random.default_rng(args.seed)
+    configs = itertools.product(_floats(args.slot_minutes, int), _floats(args.companies, int) or
+                                [len(params["companies"])], _floats(args.rt_scale))
+    head = (f"{'slot':>4} {'az.':>4} {'linee':>5} {'pren.':>11} {'riemp.':>6} {'rit.med':>7} {'rit.p90':>7} "
+            f"{'rit.p99':>7} {'stud.late':>9} {'agg.late':>8} {'eta':>6} {'inatt./l':>8} {'sfor.p90':>8} "
+            f"{'rt×':>5} {'rt 1a%':>6} {'rt esclusi':>10} {'ms':>5}")
+    print(head)
+    first = None
+    for slot_minutes, n_companies, rt_scale in configs:
+        t0 = time.perf_counter()
+        r = simulate(params, slot_minutes, n_companies, args.demand or params["demand"], args.sims, rng,
+                     rt_scale, args.rt_demand)
+        ms = (time.perf_counter() - t0) * 1000
+        first = first or r
+        print(f"{r['slot']:>4} {r['companies']:>4} {r['lanes']:>5} {r['bookings']:>11} {r['fill']:>6.0%} "
+              f"{r['delay_mean']:>7.1f} {r['delay_p90']:>7.1f} {r['delay_p99']:>7.1f} {r['late_students']:>9.1f} "
+              f"{r['late_writes']:>8.0f} {r['eta_writes']:>6.0f} {r['idle_lane']:>8.0f} {r['overrun_p90']:>8.1f} "
+              f"{r['rt_scale']:>5.2f} {_opt(r['rt_first'], '.0%'):>6} {_opt(r['rt_unplaced'], '.1f'):>10} {ms:>5.0f}")
+    print("minuti; stud.late/agg.late/eta = notifiche per giornata; inatt./l = minuti senza colloquio per linea")
+
+    if args.detail and first:
+        print(f"\nPer azienda (slot {first['slot']} min, {first['companies']} aziende):")
+        print(f"{'azienda':<34} {'linee':>5} {'colloqui':>8} {'rit.med':>7} {'inatt./l':>8} {'sfor.p90':>8}")
+        for c in sorted(first["per_company"], key=lambda c: -c["ritardo medio"]):
+            print(f"{c['azienda'][:34]:<34} {c['linee']:>5} {c['colloqui']:>8.1f} {c['ritardo medio']:>7.1f} "
+                  f"{c['inattività/linea']:>8.0f} {c['sforamento p90']:>8.1f}")
@@ -0,0 +1,111 @@
+# smtp_sink.py
+"""
+Server SMTP locale "finto" per provare l'outbox senza toccare smtp.unitn.it.
+
+    python smtp_sink.py --port 8025 [--fail-rate 0.2] [--delay 0.05]
+
+e nei secrets/.env:  SMTP_HOST=127.0.0.1  SMTP_PORT=8025  SMTP_STARTTLS=0
+
+Accetta EHLO/HELO/MAIL/RCPT/DATA/RSET/NOOP/QUIT (niente STARTTLS/AUTH);
+con --fail-rate rifiuta a caso una parte dei DATA con 451 per esercitare i retry.
+"""
+import argparse
+import random
+import socketserver
+import threading
+import time
+
+
+class SinkServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, addr, fail_rate=0.0, delay=0.0, verbose=False):
+        super().__init__(addr, SinkHandler)
+        self.fail_rate = fail_rate
+        self.delay = delay
+        self.verbose = verbose
+        self.messages = []          # (mail_from, [rcpt], data)
+        self.connections = 0
+        self.lock = threading.Lock()
+
+
+class SinkHandler(socketserver.StreamRequestHandler):
+    def _reply(self, line: str):
+        self.wfile.write((line + "\r\n").encode())
+
+    def handle(self):
+        srv = self.server
+        with srv.lock:
+            srv.connections += 1
+        self._reply("220 smtp-sink ready")
+        mail_from, rcpts = None, []
+        while True:
+            raw = self.rfile.readline()
+            if not raw:
+                return
+            line = raw.decode(errors="replace").rstrip("\r\n")
+            cmd = line[:4].upper()
+            if cmd == "EHLO":
+                self._reply("250-smtp-sink")
+                self._reply("250 8BITMIME")
+            elif cmd == "HELO":
+                self._reply("250 smtp-sink")
+            elif cmd == "MAIL":
+                mail_from, rcpts = line[10:].strip(), []
+                self._reply("250 OK")
+            elif cmd == "RCPT":
+                rcpts.append(line[8:].strip())
+                self._reply("250 OK")
+            elif cmd == "DATA":
+                self._reply("354 End data with <CR><LF>.<CR><LF>")
+                chunks = []
+                while True:
+                    d = self.rfile.readline()
+                    if not d or d in (b".\r\n", b".\n"):
+                        break
+                    chunks.append(d)
+                if srv.delay:
+                    time.sleep(srv.delay)
+                if srv.fail_rate and random.random() < srv.fail_rate:
+                    self._reply("451 Temporary failure, try again later")
+                else:
+                    with srv.lock:
+                        srv.messages.append((mail_from, rcpts, b"".join(chunks)))
+                    if srv.verbose:
+                        print(f"📨 {mail_from} -> {', '.join(rcpts)} ({sum(map(len, chunks))} bytes)")
+                    self._reply("250 OK queued")
+                mail_from, rcpts = None, []
+            elif cmd == "RSET":
+                mail_from, rcpts = None, []
+                self._reply("250 OK")
+            elif cmd == "NOOP":
+                self._reply("250 OK")
+            elif cmd == "QUIT":
+                self._reply("221 Bye")
+                return
+            else:
+                self._reply("502 Command not implemented")
+
+
+def start_sink(host="127.0.0.1", port=0, **kw) -> SinkServer:
+    """Avvia il sink in un thread e lo restituisce (port=0 -> porta libera)."""
+    srv = SinkServer((host, port), **kw)
+    threading.Thread(target=srv.serve_forever, name="smtp-sink", daemon=True).start()
+    return srv
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="SMTP sink locale per i test dell'outbox")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8025)
+    ap.add_argument("--fail-rate", type=float, default=0.0)
+    ap.add_argument("--delay", type=float, default=0.0, help="secondi di attesa per ogni DATA")
+    args = ap.parse_args()
+
+    srv = SinkServer((args.host, args.port), fail_rate=args.fail_rate, delay=args.delay, verbose=True)
+    print(f"✅ SMTP sink in ascolto su {args.host}:{args.port}")
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\n{len(srv.messages)} messaggi ricevuti su {srv.connections} connessioni")
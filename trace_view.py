@@ -0,0 +1,109 @@
+# trace_view.py
+"""
+Visualizzatore delle tracce scritte da tracing.py.
+
+    python trace_view.py                       # le 10 tracce più lente
+    python trace_view.py --top 30 --page student --since 2025-11-12T09:00
+    python trace_view.py --trace 3f2a9c...     # albero degli span di una traccia
+
+Per ogni traccia mostra durata, pagina/ruolo, sessione e quanto del tempo è
+andato in SQL, hashing delle password, SMTP e nel resto (rendering e Python).
+Nell'albero, gli span foglia ripetuti con lo stesso nome (tipicamente "sql")
+sono raggruppati in una riga con numero, totale e massimo.
+"""
+import argparse
+import glob
+import json
+import os
+from collections import defaultdict
+
+CATEGORIES = (("sql", "sql"), ("hash", "auth.hash"), ("smtp", "smtp.send"))
+
+
+def load(trace_dir):
+    traces = []
+    for path in sorted(glob.glob(os.path.join(trace_dir, "traces.jsonl*"))):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    traces.append(json.loads(line))
+                except ValueError:
+                    continue  # riga troncata dalla rotazione
+    return traces
+
+
+def breakdown(trace) -> dict:
+    """ms per categoria; il resto è rendering, Python e span non classificati."""
+    out = defaultdict(float)
+    for s in trace["spans"]:
+        for label, prefix in CATEGORIES:
+            if s["name"].startswith(prefix):
+                out[label] += s["ms"]
+                break
+    out["altro"] = max(trace["ms"] - sum(out.values()), 0.0)
+    return out
+
+
+def print_list(traces, top):
+    print(f"{'ms':>9}  {'inizio (UTC)':<23} {'traccia':<16} {'pagina':<10} {'sessione':<12} "
+          f"{'span':>5} {'sql':>8} {'hash':>8} {'smtp':>8} {'altro':>8}")
+    for t in sorted(traces, key=lambda t: t["ms"], reverse=True)[:top]:
+        b = breakdown(t)
+        page = t["attrs"].get("page", t["name"])
+        flag = " (interrotta)" if t.get("aborted") else ""
+        print(f"{t['ms']:>9.1f}  {t['started_at']:<23} {t['trace_id']:<16} {page:<10} {t.get('session', ''):<12} "
+              f"{len(t['spans']):>5} {b['sql']:>8.1f} {b['hash']:>8.1f} {b['smtp']:>8.1f} {b['altro']:>8.1f}{flag}")
+
+
+def print_tree(trace):
+    print(f"Traccia {trace['trace_id']} • {trace['name']} {trace['attrs']} • {trace['ms']:.1f} ms"
+          f"{' • interrotta' if trace.get('aborted') else ''}")
+    children = defaultdict(list)
+    for s in trace["spans"]:
+        children[s["parent"]].append(s)
+
+    def walk(parent, depth):
+        kids = sorted(children.get(parent, []), key=lambda s: s["start_ms"])
+        leaves = defaultdict(list)
+        for s in kids:
+            if s["id"] not in children:
+                leaves[s["name"]].append(s)
+        shown = set()
+        for s in kids:
+            group = leaves.get(s["name"])
+            if group and len(group) > 1 and s["id"] not in children:
+                if s["name"] in shown:
+                    continue
+                shown.add(s["name"])
+                total = sum(g["ms"] for g in group)
+                print(f"{'  ' * depth}{s['name']} ×{len(group)}  {total:.1f} ms (max {max(g['ms'] for g in group):.1f})")
+                continue
+            extra = f"  {s['attrs']}" if s.get("attrs") else ""
+            print(f"{'  ' * depth}{s['name']}  {s['ms']:.1f} ms  @{s['start_ms']:.1f}{extra}")
+            walk(s["id"], depth + 1)
+
+    walk(0, 1)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Tracce più lente (tracing.py)")
+    ap.add_argument("--dir", default=os.getenv("TRACE_DIR", "traces"))
+    ap.add_argument("--top", type=int, default=10)
+    ap.add_argument("--page", help="solo questa pagina (student, company, admin, login)")
+    ap.add_argument("--since", help="solo tracce iniziate da questo istante (ISO, UTC)")
+    ap.add_argument("--trace", help="mostra l'albero degli span di questa traccia")
+    args = ap.parse_args()
+
+    traces = load(args.dir)
+    if args.trace:
+        match = [t for t in traces if t["trace_id"].startswith(args.trace)]
+        if not match:
+            raise SystemExit(f"Traccia {args.trace} non trovata in {args.dir}")
+        print_tree(match[0])
+    else:
+        if args.page:
+            traces = [t for t in traces if t["attrs"].get("page") == args.page]
+        if args.since:
+            traces = [t for t in traces if t["started_at"] >= args.since]
+        print(f"{len(traces)} tracce in {args.dir}")
+        print_list(traces, args.top)
@@ -0,0 +1,191 @@
+# tracing.py
+"""
+Tracing leggero dei rerun: "la pagina si blocca" era hashing, DB o rendering?
+
+Una traccia per rerun campionato (TRACE_SAMPLE_RATE, default 0.01) con ruolo,
+pagina e sessione; dentro, span figli annidati: render della pagina, helper di
+core e cv_files decorati con @traced, hashing delle password in auth, ogni
+query SQL (dal listener di core), invio SMTP nel worker email (che traccia i
+suoi batch con lo stesso campionamento). A fine rerun la traccia diventa una
+riga JSON in TRACE_DIR/traces.jsonl, ruotato a TRACE_MAX_MB con
+TRACE_BACKUPS copie. `python trace_view.py` mostra le tracce più lente.
+
+Se il rerun non è campionato ogni span costa una lettura di ContextVar. I rerun
+interrotti da st.rerun()/st.stop() non arrivano a end_trace(): li chiude il
+rerun successivo della stessa sessione (marcati "aborted").
+
+Come metrics, non importa core a livello di modulo (core usa @traced).
+"""
+import contextvars
+import functools
+import json
+import logging
+import logging.handlers
+import os
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+MAX_SPANS = 2000  # oltre, gli span vengono solo contati
+
+_trace = contextvars.ContextVar("trace", default=None)
+_parent = contextvars.ContextVar("trace_parent", default=0)
+_open = {}  # sessione -> traccia non ancora chiusa
+_open_lock = threading.Lock()
+_settings = None
+_logger = None
+_logger_lock = threading.Lock()
+
+
+def _config() -> dict:
+    global _settings
+    if _settings is None:
+        from core import read_secret  # import tardivo: core importa tracing
+        _settings = {
+            "rate": float(read_secret("TRACE_SAMPLE_RATE", 0.01)),
+            "dir": read_secret("TRACE_DIR", "traces"),
+            "max_bytes": int(float(read_secret("TRACE_MAX_MB", 10)) * 1024 * 1024),
+            "backups": int(read_secret("TRACE_BACKUPS", 5)),
+        }
+    return _settings
+
+
+class Trace:
+    __slots__ = ("trace_id", "name", "attrs", "session", "started_at", "t0", "last", "spans", "dropped", "seq")
+
+    def __init__(self, name, session, attrs):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attrs = attrs
+        self.session = session
+        self.started_at = datetime.utcnow().isoformat(timespec="milliseconds")
+        self.t0 = self.last = time.perf_counter()
+        self.spans = []
+        self.dropped = 0
+        self.seq = 0
+
+    def add(self, span_id, parent, name, start, end, attrs):
+        self.last = max(self.last, end)
+        if len(self.spans) >= MAX_SPANS:
+            self.dropped += 1
+            return
+        self.spans.append({"id": span_id, "parent": parent, "name": name,
+                           "start_ms": round((start - self.t0) * 1000, 3),
+                           "ms": round((end - start) * 1000, 3), **({"attrs": attrs} if attrs else {})})
+
+    def next_id(self) -> int:
+        self.seq += 1
+        return self.seq
+
+
+def _write(record: dict):
+    global _logger
+    if _logger is None:
+        with _logger_lock:
+            if _logger is None:
+                cfg = _config()
+                os.makedirs(cfg["dir"], exist_ok=True)
+                handler = logging.handlers.RotatingFileHandler(
+                    os.path.join(cfg["dir"], "traces.jsonl"),
+                    maxBytes=cfg["max_bytes"], backupCount=cfg["backups"], encoding="utf-8"
+                )
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                logger = logging.getLogger("ied.tracing")
+                logger.propagate = False
+                logger.setLevel(logging.INFO)
+                logger.addHandler(handler)
+                _logger = logger
+    _logger.info(json.dumps(record, ensure_ascii=False, default=str))
+
+
+def start_trace(name: str, session: str = "", force: bool = False, **attrs) -> Trace | None:
+    """Apre la traccia del thread corrente se campionata; chiude quella rimasta aperta della sessione."""
+    if session:
+        with _open_lock:
+            prev = _open.pop(session, None)
+        if prev is not None:
+            _finish(prev, aborted=True)
+    rate = _config()["rate"]
+    if not force and (rate <= 0 or random.random() >= rate):
+        _trace.set(None)
+        return None
+    t = Trace(name, session, attrs)
+    _trace.set(t)
+    _parent.set(0)
+    if session:
+        with _open_lock:
+            _open[session] = t
+    return t
+
+
+def end_trace(trace: Trace | None = None, **attrs):
+    t = trace or _trace.get()
+    if t is None:
+        return
+    _trace.set(None)
+    if t.session:
+        with _open_lock:
+            if _open.get(t.session) is t:
+                del _open[t.session]
+    t.attrs.update(attrs)
+    _finish(t)
+
+
+def _finish(t: Trace, aborted: bool = False):
+    end = t.last if aborted else time.perf_counter()
+    record = {"trace_id": t.trace_id, "name": t.name, "started_at": t.started_at, "session": t.session,
+              "ms": round((end - t.t0) * 1000, 3), "attrs": t.attrs, "spans": t.spans}
+    if aborted:
+        record["aborted"] = True
+    if t.dropped:
+        record["dropped_spans"] = t.dropped
+    try:
+        _write(record)
+    except OSError:
+        pass  # il tracing non deve mai rompere la pagina
+
+
+def active() -> bool:
+    return _trace.get() is not None
+
+
+@contextmanager
+def span(name: str, **attrs):
+    t = _trace.get()
+    if t is None:
+        yield
+        return
+    span_id = t.next_id()
+    token = _parent.set(span_id)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        _parent.reset(token)
+        t.add(span_id, _parent.get(), name, start, end, attrs)
+
+
+def add_span(name: str, start: float, end: float, **attrs):
+    """Span già misurato (perf_counter di inizio e fine), es. dal listener SQL."""
+    t = _trace.get()
+    if t is not None:
+        t.add(t.next_id(), _parent.get(), name, start, end, attrs)
+
+
+def traced(name: str | None = None):
+    """Decoratore: span attorno alla funzione, solo se il rerun è campionato."""
+    def deco(fn):
+        label = name or f"{fn.__module__}.{fn.__name__}"
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _trace.get() is None:
+                return fn(*args, **kwargs)
+            with span(label):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco